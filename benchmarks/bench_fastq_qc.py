@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Benchmark the streaming FASTQ pre-QC of fastq_qc.py on synthetic gzipped FASTQ files.
+
+Synthetic paired-end samples are written to a temporary directory, then fastq_qc.qc_files streams them with
+1 worker and with --workers processes. For every setting the best wall time over --repeat runs is reported with
+the throughput in compressed MB, uncompressed MB and reads per second.
+
+Usage: python benchmarks/bench_fastq_qc.py [--samples 8] [--reads 50000] [--read-length 150] [--workers 4]
+                                           [--repeat 3] [--json results.json]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'utils'))
+
+from fastq_qc import qc_files
+
+
+def write_fastq(path, n_reads, read_length=150, seed=0):
+    """
+    Write a synthetic gzipped FASTQ file with random bases and Illumina-like qualities.
+
+    Returns:
+    int: Number of uncompressed bytes written.
+    """
+    rng = random.Random(seed)
+    bases = 'ACGT'
+    qualities = 'FFFF:,F'
+    n_bytes = 0
+    with gzip.open(path, 'wt', compresslevel=6) as fastq:
+        for i in range(n_reads):
+            sequence = ''.join(rng.choice(bases) for _ in range(read_length))
+            quality = ''.join(rng.choice(qualities) for _ in range(read_length))
+            record = f'@BENCH:{seed}:{i} 1:N:0:1\n{sequence}\n+\n{quality}\n'
+            fastq.write(record)
+            n_bytes += len(record)
+    return n_bytes
+
+
+def write_samples(work_dir, n_samples, n_reads, read_length):
+    paths = []
+    uncompressed = 0
+    for sample in range(n_samples):
+        for read in ('R1', 'R2'):
+            path = os.path.join(work_dir, f'BENCH{sample}_S{sample + 1}_L001_{read}_001.fastq.gz')
+            uncompressed += write_fastq(path, n_reads, read_length, seed=sample * 2 + (read == 'R2'))
+            paths.append(path)
+    return paths, uncompressed
+
+
+def measure(name, paths, workers, uncompressed, repeat=3):
+    timings = []
+    stats = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stats = qc_files(paths, workers)
+        timings.append(time.perf_counter() - start)
+    wall = min(timings)
+    compressed = sum(file_stats['compressed_bytes'] for file_stats in stats.values())
+    reads = sum(file_stats['reads'] for file_stats in stats.values())
+    return {
+        'name': name,
+        'workers': workers,
+        'wall_s': wall,
+        'compressed_mb_s': compressed / 1e6 / wall,
+        'uncompressed_mb_s': uncompressed / 1e6 / wall,
+        'reads_s': reads / wall,
+        'reads': reads,
+    }
+
+
+def print_report(results):
+    print(f"{'step':<28}{'workers':>8}{'wall (s)':>10}{'gz MB/s':>10}{'raw MB/s':>10}{'reads/s':>12}")
+    for result in results:
+        print(f"{result['name']:<28}{result['workers']:>8}{result['wall_s']:>10.3f}{result['compressed_mb_s']:>10.1f}"
+              f"{result['uncompressed_mb_s']:>10.1f}{result['reads_s']:>12.0f}")
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the streaming FASTQ pre-QC on synthetic data.')
+    parser.add_argument('--samples', type=int, default=8, help='Paired-end samples to generate')
+    parser.add_argument('--reads', type=int, default=50000, help='Reads per FASTQ file')
+    parser.add_argument('--read-length', type=int, default=150, help='Read length')
+    parser.add_argument('--workers', type=int, default=4, help='Processes of the parallel run')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per setting; the best is reported')
+    parser.add_argument('--json', default=None, help='Also write the results to this JSON file')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_arguments(args)
+    with tempfile.TemporaryDirectory() as work_dir:
+        paths, uncompressed = write_samples(work_dir, args.samples, args.reads, args.read_length)
+        results = [measure('fastq_qc.qc_files', paths, 1, uncompressed, args.repeat)]
+        if args.workers > 1:
+            results.append(measure('fastq_qc.qc_files', paths, args.workers, uncompressed, args.repeat))
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'parameters': vars(args), 'results': results}, output, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Benchmark the Python post-processing of Freyja results on synthetic data.
+
+Synthetic aggregate files and lineage abundance histories are generated with synthetic_freyja.py, then the
+aggregate parsing (prepLineageDict, expand_data, parse_lineage_aggregate), the lineage group classification
+(get_parent_lineage, LineageClassifier), the alias step (custom_parent, CachedAliasor) and the
+freyja_old_new_res_merge.main merge path are timed. For every step the best wall time over --repeat runs and
+the peak memory traced by tracemalloc during one extra run are reported.
+
+Usage: python benchmarks/bench_postprocessing.py [--samples 96] [--lineages-per-sample 40]
+                                                 [--history-samples 5000] [--repeat 3] [--json results.json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'utils'))
+sys.path.insert(0, REPO_DIR)
+
+import synthetic_freyja
+from utils import (prepLineageDict, expand_data, parse_lineage_aggregate, get_parent_lineage, LineageClassifier,
+                   custom_parent, CachedAliasor)
+
+RUN_NAME = 'UT-VH00000-BENCH'
+OLD_RES_DATE = '2000-01-01'
+
+
+def measure(name, func, setup=lambda: (), repeat=3):
+    """
+    Time func(*setup()) and trace its peak memory.
+
+    setup is called before every run and is not timed, so functions that modify their input get fresh data.
+
+    Returns:
+    dict: 'name', 'wall_s' (best of repeat runs), 'peak_mib' and 'rows' (length of the result, if any).
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'name': name,
+        'wall_s': min(timings),
+        'peak_mib': peak / 2 ** 20,
+        'rows': len(result) if hasattr(result, '__len__') else None,
+    }
+
+
+def read_aggregate(path):
+    agg_df = pd.read_csv(path, sep='\t', names=['sample_id', 'summarized', 'lineages', 'abundances', 'resid', 'coverage'],
+                         skiprows=1)
+    return agg_df.dropna(subset=['lineages'])
+
+
+def bench_parsing(agg_file, repeat):
+    return [
+        measure('prepLineageDict', prepLineageDict, lambda: (read_aggregate(agg_file),), repeat),
+        measure('expand_data', expand_data, lambda: (prepLineageDict(read_aggregate(agg_file)),), repeat),
+        measure('parse_lineage_aggregate', parse_lineage_aggregate, lambda: (read_aggregate(agg_file),), repeat),
+    ]
+
+
+def bench_classification(lineages, repeat):
+    with open(os.path.join(REPO_DIR, 'data', 'lineage_mapping.json')) as mapping_file:
+        lineage_mapping = json.load(mapping_file)
+    unique_lineages = lineages.unique()
+    return [
+        measure('get_parent_lineage',
+                lambda: {lineage: get_parent_lineage(lineage, lineage_mapping) for lineage in unique_lineages},
+                repeat=repeat),
+        measure('LineageClassifier.classify_series',
+                lambda: LineageClassifier(lineage_mapping).classify_series(lineages), repeat=repeat),
+    ]
+
+
+def bench_aliasing(lineages, alias_file, repeat):
+    try:
+        from pango_aliasor.aliasor import Aliasor
+    except ImportError:
+        print("pango_aliasor is not installed, skipping the custom_parent benchmarks.")
+        return []
+    aliasor = Aliasor(alias_file)
+    return [
+        measure('custom_parent', lambda: lineages.apply(lambda name: custom_parent(aliasor, name)), repeat=repeat),
+        measure('CachedAliasor.custom_parent_series', lambda: CachedAliasor(aliasor).custom_parent_series(lineages),
+                repeat=repeat),
+    ]
+
+
+def bench_merge(work_dir, n_samples, lineages_per_sample, history_samples, repeat):
+    # The merge script logs to app.log in the working directory at import time
+    os.chdir(work_dir)
+    import freyja_old_new_res_merge
+
+    seq_dir = os.path.join(work_dir, 'wastewater_sequencing')
+    results_dir = os.path.join(seq_dir, 'all_freyja_results')
+    synthetic_freyja.write_run_results(os.path.join(seq_dir, RUN_NAME), RUN_NAME, n_samples=n_samples,
+                                       lineages_per_sample=lineages_per_sample, seed=2)
+    synthetic_freyja.write_history(
+        os.path.join(results_dir, OLD_RES_DATE, f'{OLD_RES_DATE}_WW_feyja_varaints_SC2_lineage_abundance_cln.csv'),
+        n_samples=history_samples, lineages_per_sample=lineages_per_sample)
+    config = {
+        'wastewater_seq_dir': seq_dir,
+        'lat_long_file': os.path.join(REPO_DIR, 'data', 'msd_short_names_lat_long.csv'),
+        'all_freyja_results_dir': results_dir,
+    }
+
+    # Seed a lineage store once so the store benchmark measures an incremental run only
+    seeded_store = os.path.join(work_dir, 'seeded_store.sqlite')
+    store_file = os.path.join(work_dir, 'store.sqlite')
+    freyja_old_new_res_merge.main(config, [RUN_NAME, OLD_RES_DATE, '--store', seeded_store])
+
+    def fresh_store():
+        shutil.copyfile(seeded_store, store_file)
+        return ()
+
+    return [
+        measure('freyja_old_new_res_merge.main',
+                lambda: freyja_old_new_res_merge.main(config, [RUN_NAME, OLD_RES_DATE]), repeat=repeat),
+        measure('freyja_old_new_res_merge.main --chunksize',
+                lambda: freyja_old_new_res_merge.main(config, [RUN_NAME, OLD_RES_DATE, '--chunksize', '50000']),
+                repeat=repeat),
+        measure('freyja_old_new_res_merge.main --store',
+                lambda: freyja_old_new_res_merge.main(config, [RUN_NAME, '--store', store_file]),
+                fresh_store, repeat),
+    ]
+
+
+def print_report(results):
+    print(f"{'step':<42}{'rows':>10}{'wall (s)':>12}{'peak (MiB)':>12}")
+    for result in results:
+        rows = '' if result['rows'] is None else result['rows']
+        print(f"{result['name']:<42}{rows:>10}{result['wall_s']:>12.3f}{result['peak_mib']:>12.1f}")
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Freyja post-processing on synthetic data.')
+    parser.add_argument('--samples', type=int, default=96, help='Samples in the synthetic aggregate and new run')
+    parser.add_argument('--lineages-per-sample', type=int, default=40, help='Maximum lineages per sample')
+    parser.add_argument('--lineages', type=int, default=600, help='Distinct lineages in the synthetic data')
+    parser.add_argument('--history-samples', type=int, default=5000, help='Samples in the old results history')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per step; the best is reported')
+    parser.add_argument('--json', default=None, help='Also write the results to this JSON file')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_arguments(args)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        agg_file = synthetic_freyja.write_aggregate(os.path.join(work_dir, f'{RUN_NAME}_lineages_aggregate.tsv'),
+                                                    args.samples, args.lineages_per_sample, args.lineages)
+        lineages = parse_lineage_aggregate(read_aggregate(agg_file))['lineage']
+        alias_file = synthetic_freyja.write_alias_key(os.path.join(work_dir, 'alias_key.json'), lineages.unique())
+
+        results = bench_parsing(agg_file, args.repeat)
+        results += bench_classification(lineages, args.repeat)
+        results += bench_aliasing(lineages, alias_file, args.repeat)
+        results += bench_merge(work_dir, args.samples, args.lineages_per_sample, args.history_samples, args.repeat)
+        os.chdir(cwd)
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'parameters': vars(args), 'results': results}, output, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+Synthetic Freyja outputs for benchmarking the Python post-processing.
+
+Lineage names are drawn from the prefixes of data/lineage_mapping.json (extended with random sublineage
+components), sample IDs follow the '<yymmdd>-<site>' pattern of the wastewater runs and site codes come from
+data/msd_short_names_lat_long.csv, so the generated files exercise the same code paths as production data.
+"""
+
+import json
+import os
+import random
+from datetime import date, timedelta
+
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(REPO_DIR, 'data')
+
+# Aliases used for the synthetic alias key, so names such as 'BQ.1.1' can be uncompressed and compressed
+SYNTHETIC_ALIASES = {
+    'A': '', 'B': '', 'C': 'B.1.1.1', 'P': 'B.1.1.28', 'AY': 'B.1.617.2',
+    'BA': 'B.1.1.529', 'BE': 'B.1.1.529.5.3.1', 'BF': 'B.1.1.529.5.2.1', 'BQ': 'B.1.1.529.5.3.1.1.1.1',
+    'BM': 'B.1.1.529.2.75.3', 'BN': 'B.1.1.529.2.75.5', 'CH': 'B.1.1.529.2.75.3.4.1.1',
+    'XBB': ['BJ.1', 'BM.1.1.1'], 'BJ': 'B.1.1.529.2.10.1.1', 'EG': 'XBB.1.9.2', 'JN': 'B.1.1.529.2.86.1',
+}
+
+
+def lineage_pool(n_lineages, seed=0, mapping_file=os.path.join(DATA_DIR, 'lineage_mapping.json')):
+    """
+    Generate real-looking Pango lineage names from the lineage mapping prefixes.
+
+    Parameters:
+    n_lineages (int): Number of distinct lineage names to generate.
+    seed (int): Random seed.
+    mapping_file (str): Lineage mapping JSON providing the prefixes.
+
+    Returns:
+    list: Distinct lineage names.
+    """
+    rng = random.Random(seed)
+    with open(mapping_file) as mapping:
+        prefixes = [prefix for group in json.load(mapping) for prefix in group['prefixes']]
+    # Add the aliased names that dominate recent wastewater data
+    prefixes += [alias for alias in SYNTHETIC_ALIASES if len(alias) == 2 and alias not in ('AY',)] + ['XBB', 'AY']
+
+    pool = set()
+    while len(pool) < n_lineages:
+        depth = rng.randint(0, 4)
+        pool.add(rng.choice(prefixes) + ''.join(f'.{rng.randint(1, 30)}' for _ in range(depth)))
+    return sorted(pool)
+
+
+def site_codes(lat_long_file=os.path.join(DATA_DIR, 'msd_short_names_lat_long.csv')):
+    return pd.read_csv(lat_long_file)['msd_shrtnm'].tolist()
+
+
+def _sample_abundances(rng, pool, lineages_per_sample):
+    k = rng.randint(max(1, lineages_per_sample // 2), lineages_per_sample)
+    lineages = rng.sample(pool, min(k, len(pool)))
+    weights = [rng.random() for _ in lineages]
+    total = sum(weights)
+    return lineages, [weight / total for weight in weights]
+
+
+def _sample_ids(rng, n_samples, start=date(2022, 1, 3)):
+    sites = site_codes()
+    return [f"{(start + timedelta(days=rng.randint(0, 900))).strftime('%y%m%d')}-{rng.choice(sites)}"
+            for _ in range(n_samples)]
+
+
+def write_aggregate(path, n_samples=96, lineages_per_sample=40, n_lineages=600, seed=0):
+    """
+    Write a synthetic '*lineages_aggregate.tsv' file in the Freyja aggregate format.
+
+    Returns:
+    str: The path written.
+    """
+    rng = random.Random(seed)
+    pool = lineage_pool(n_lineages, seed)
+    with open(path, 'w') as aggregate:
+        aggregate.write('\tsummarized\tlineages\tabundances\tresid\tcoverage\n')
+        for i, sample in enumerate(_sample_ids(rng, n_samples)):
+            lineages, abundances = _sample_abundances(rng, pool, lineages_per_sample)
+            aggregate.write(f"{sample}-{i}_lin_out.tsv\t[('Omicron', {sum(abundances):.4f})]\t{' '.join(lineages)}\t"
+                            f"{' '.join(f'{abundance:.8f}' for abundance in abundances)}\t{rng.random():.4f}\t"
+                            f"{rng.uniform(40, 100):.2f}\n")
+    return path
+
+
+def long_frame(n_samples=96, lineages_per_sample=40, n_lineages=600, seed=0):
+    """
+    Build a synthetic '*lingrps_final.csv' style long DataFrame for one run.
+    """
+    rng = random.Random(seed)
+    pool = lineage_pool(n_lineages, seed)
+    rows = []
+    for i, sample in enumerate(_sample_ids(rng, n_samples)):
+        lineages, abundances = _sample_abundances(rng, pool, lineages_per_sample)
+        sample_id = sample.replace('-', '_', 1)
+        rows.extend((sample_id, lineage, abundance) for lineage, abundance in zip(lineages, abundances))
+    long_df = pd.DataFrame(rows, columns=['sample_id', 'lineage', 'abundance'])
+    long_df = long_df.drop_duplicates(subset=['sample_id', 'lineage'])
+    long_df['uncompress_lineage'] = long_df['lineage']
+    long_df['parent_lineage'] = long_df['lineage'].str.rsplit('.', n=1).str[0]
+    long_df['summarized_lineage'] = 'Omicron'
+    long_df.index.name = 'idx_name'
+    return long_df.reset_index()
+
+
+def write_run_results(run_dir, run_name, **kwargs):
+    """
+    Write '<run_dir>/results/<run_name>_freyja_lin_dict_long_df_lingrps_final.csv'.
+    """
+    results_dir = os.path.join(run_dir, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f'{run_name}_freyja_lin_dict_long_df_lingrps_final.csv')
+    long_frame(**kwargs).to_csv(path, index=False)
+    return path
+
+
+def write_history(path, n_samples=5000, lineages_per_sample=40, n_lineages=1500, seed=1,
+                  lat_long_file=os.path.join(DATA_DIR, 'msd_short_names_lat_long.csv')):
+    """
+    Write a synthetic '*_lineage_abundance_cln.csv' history, as produced by freyja_old_new_res_merge.py.
+    """
+    history = long_frame(n_samples, lineages_per_sample, n_lineages, seed)
+    history[['collection_date', 'msd_shrtnm']] = history['sample_id'].str.split('_', n=1, expand=True)
+    history['collection_date'] = pd.to_datetime(history['collection_date'], format='%y%m%d')
+    history = history.merge(pd.read_csv(lat_long_file), on='msd_shrtnm')
+    history['idx_name'] = range(len(history))
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    history.to_csv(path, index=False)
+    return path
+
+
+def write_alias_key(path, lineages=()):
+    """
+    Write an alias key JSON for pango_aliasor covering the given lineages.
+
+    SYNTHETIC_ALIASES is extended with made-up aliases ('ZAA', 'ZAB', ...) for every uncompressed prefix that
+    Aliasor.compress needs when computing the parents of the generated names.
+
+    Returns:
+    str: The path written.
+    """
+    aliases = dict(SYNTHETIC_ALIASES)
+    realiases = {value: key for key, value in aliases.items() if isinstance(value, str) and value}
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    codes = (f'{first}{second}{third}' for first in 'ZYW' for second in letters for third in letters)
+
+    for lineage in lineages:
+        parts = lineage.split('.')
+        unaliased = aliases.get(parts[0])
+        if isinstance(unaliased, str) and unaliased:
+            parts = unaliased.split('.') + parts[1:]
+        # compress() looks up the first 3*k+1 components of a name for every level of indirection
+        for end in range(4, len(parts), 3):
+            prefix = '.'.join(parts[:end])
+            if prefix not in realiases:
+                code = next(codes)
+                aliases[code] = prefix
+                realiases[prefix] = code
+
+    with open(path, 'w') as alias_key:
+        json.dump(aliases, alias_key)
+    return path
@@ -2,7 +2,7 @@
 
 import os
 import sys
-import glob
+import shutil
 import argparse
 
 
@@ -61,9 +61,77 @@ def parse_args(args=None):
         default=1,
         help="After splitting FastQ file name by --sanitise_name_delimiter all elements before this index (1-based) will be joined to create final sample name.",
     )
+    parser.add_argument(
+        "-ms",
+        "--min_file_size",
+        type=int,
+        dest="MIN_FILE_SIZE",
+        default=0,
+        help="Samples with a FastQ file smaller than this many bytes are left out of the samplesheet as failed samples (e.g. 1000000 for 1MB). Disabled by default.",
+    )
+    parser.add_argument(
+        "-fd",
+        "--failed_dir",
+        type=str,
+        dest="FAILED_DIR",
+        default=None,
+        help="Move the FastQ files of failed samples to this directory.",
+    )
     return parser.parse_args(args)
 
 
+def scan_fastqs(
+    fastq_dir,
+    read1_extension="_R1_001.fastq.gz",
+    read2_extension="_R2_001.fastq.gz",
+    single_end=False,
+    sample_name=None,
+    with_sizes=False,
+):
+    """
+    List the FastQ directory once with os.scandir and pair read 1 and read 2 files by sample.
+
+    Hidden files are skipped, as with glob('*'). File sizes are only requested when with_sizes is set, as every stat is a network call on a NAS mount.
+    Returns a dict {sample: {"R1": [(path, size)], "R2": [(path, size)]}} with the reads of each sample sorted
+    by path, so R1 and R2 stay in the same order when merging technical replicates.
+    """
+    sample_name = sample_name or (lambda filename, extension: filename[: -len(extension)])
+    read_dict = {}
+    with os.scandir(fastq_dir) as entries:
+        for entry in entries:
+            # Hidden files, e.g. the macOS AppleDouble '._<name>' files on the NAS, are not FastQ files
+            if entry.name.startswith("."):
+                continue
+            if entry.name.endswith(read1_extension):
+                read, extension = "R1", read1_extension
+            elif entry.name.endswith(read2_extension) and not single_end:
+                read, extension = "R2", read2_extension
+            else:
+                continue
+            if not entry.is_file():
+                continue
+            size = entry.stat().st_size if with_sizes else None
+            sample = sample_name(entry.name, extension)
+            reads = read_dict.setdefault(sample, {"R1": [], "R2": []})
+            reads[read].append((os.path.join(fastq_dir, entry.name), size))
+
+    for reads in read_dict.values():
+        reads["R1"].sort()
+        reads["R2"].sort()
+    return read_dict
+
+
+def split_failed_samples(read_dict, min_file_size):
+    """Separate the samples with any FastQ file smaller than min_file_size bytes."""
+    failed = {
+        sample: reads
+        for sample, reads in read_dict.items()
+        if any(size < min_file_size for _, size in reads["R1"] + reads["R2"])
+    }
+    passed = {sample: reads for sample, reads in read_dict.items() if sample not in failed}
+    return passed, failed
+
+
 def fastq_dir_to_samplesheet(
     fastq_dir,
     samplesheet_file,
@@ -73,43 +141,60 @@ def fastq_dir_to_samplesheet(
     sanitise_name=False,
     sanitise_name_delimiter="_",
     sanitise_name_index=1,
+    min_file_size=0,
+    failed_dir=None,
 ):
-    def sanitize_sample(path, extension):
+    def sanitize_sample(filename, extension):
         """Retrieve sample id from filename"""
-        sample = os.path.basename(path).replace(extension, "")
+        sample = filename.replace(extension, "")
         if sanitise_name:
             sample = sanitise_name_delimiter.join(
-                os.path.basename(path).split(sanitise_name_delimiter)[
-                    :sanitise_name_index
-                ]
+                filename.split(sanitise_name_delimiter)[:sanitise_name_index]
             )
         return sample
 
-    def get_fastqs(extension):
-        """
-        Needs to be sorted to ensure R1 and R2 are in the same order
-        when merging technical replicates. Glob is not guaranteed to produce
-        sorted results.
-        See also https://stackoverflow.com/questions/6773584/how-is-pythons-glob-glob-ordered
-        """
-        return sorted(
-            glob.glob(os.path.join(fastq_dir, f"*{extension}"), recursive=False)
-        )
-
-    read_dict = {}
-
-    ## Get read 1 files
-    for read1_file in get_fastqs(read1_extension):
-        sample = sanitize_sample(read1_file, read1_extension)
-        if sample not in read_dict:
-            read_dict[sample] = {"R1": [], "R2": []}
-        read_dict[sample]["R1"].append(read1_file)
+    ## Get read 1 and read 2 files in a single directory listing
+    read_dict = scan_fastqs(
+        fastq_dir,
+        read1_extension,
+        read2_extension,
+        single_end,
+        sanitize_sample,
+        with_sizes=min_file_size > 0,
+    )
 
-    ## Get read 2 files
+    ## Report read 2 files without a read 1 file instead of failing on them
+    orphans = sorted(sample for sample, reads in read_dict.items() if not reads["R1"])
+    if orphans:
+        print(
+            f"WARNING: {len(orphans)} samples have read 2 but no read 1 FastQ files and are left out of the samplesheet: "
+            + ", ".join(orphans)
+        )
+        for sample in orphans:
+            del read_dict[sample]
     if not single_end:
-        for read2_file in get_fastqs(read2_extension):
-            sample = sanitize_sample(read2_file, read2_extension)
-            read_dict[sample]["R2"].append(read2_file)
+        unpaired = sorted(
+            sample for sample, reads in read_dict.items() if len(reads["R2"]) < len(reads["R1"])
+        )
+        if unpaired:
+            print(
+                f"WARNING: {len(unpaired)} samples are missing read 2 FastQ files and are written as single-end: "
+                + ", ".join(unpaired)
+            )
+
+    ## Leave out samples with FastQ files below the minimum size
+    if min_file_size > 0:
+        read_dict, failed = split_failed_samples(read_dict, min_file_size)
+        if failed:
+            print(
+                f"WARNING: {len(failed)} samples have FastQ files smaller than {min_file_size} bytes and are left out of the samplesheet: "
+                + ", ".join(sorted(failed))
+            )
+            if failed_dir:
+                os.makedirs(failed_dir, exist_ok=True)
+                for reads in failed.values():
+                    for path, _ in reads["R1"] + reads["R2"]:
+                        shutil.move(path, os.path.join(failed_dir, os.path.basename(path)))
 
     ## Write to file
     if len(read_dict) > 0:
@@ -121,10 +206,10 @@ def fastq_dir_to_samplesheet(
             header = ["sample", "fastq_1", "fastq_2"]
             fout.write(",".join(header) + "\n")
             for sample, reads in sorted(read_dict.items()):
-                for idx, read_1 in enumerate(reads["R1"]):
+                for idx, (read_1, _) in enumerate(reads["R1"]):
                     read_2 = ""
                     if idx < len(reads["R2"]):
-                        read_2 = reads["R2"][idx]
+                        read_2 = reads["R2"][idx][0]
                     sample_info = ",".join([sample, read_1, read_2])
                     fout.write(f"{sample_info}\n")
     else:
@@ -151,6 +236,8 @@ def main(args=None):
         sanitise_name=args.SANITISE_NAME,
         sanitise_name_delimiter=args.SANITISE_NAME_DELIMITER,
         sanitise_name_index=args.SANITISE_NAME_INDEX,
+        min_file_size=args.MIN_FILE_SIZE,
+        failed_dir=args.FAILED_DIR,
     )
 
 
@@ -23,6 +23,8 @@ echo "$USAGE"
 
 raw_run=$1 # Sequecning Output folder name
 
+script_dir='/Volumes/NGS/Bioinformatics/ww_analysis_scripts/Wastewater-genomic-analysis'
+
 # Check if the fastq gen step is completed for the new WW run
 run_date=$(echo $raw_run | rev | cut -f 2 -d "/" | rev | cut -f 1 -d "_")
 run_instrument=$(echo $raw_run | rev | cut -f 2 -d "/" | rev | cut -f 2 -d "_")
@@ -50,7 +52,11 @@ fi
     fi
 
  # Checking for wastewater samples
-    wastewater_check=$(grep -i wastewater $sample_sheet | head -n 1)
+    # The sample sheet is parsed by section and samples are classified as clinical or wastewater on their exact Sample_ID
+    wastewater_check=""
+    if python $script_dir/utils/samplesheet.py $sample_sheet --check; then
+      wastewater_check="yes"
+    fi
 
     # Checking to see if the analysis has already been run for wastewater samples
 if [ ! -d "/Volumes/NGS_2/wastewater_sequencing/$run_name" ] && [ -n "$wastewater_check" ]
@@ -69,18 +75,9 @@ if [ ! -d "/Volumes/NGS_2/wastewater_sequencing/$run_name" ] && [ -n "$wastewate
     echo "$(date) : Generating list of wastewater samples from the run sample sheet. Used to fetch matching fastq files in the next step"
     # grep -i 'Wastewater' $sample_sheet | cut -f 1 -d ',' > $analysis_dir/${run_name}_wastewater_sample_list.csv
 
-    # Getting a list of all clinical (covid and flu) samples, used to generate wastewater sample sheet
-    grep -iE  'patient|covidseq|flu|influenza|RSV|measles' $sample_sheet | cut -f 1 -d ',' > $analysis_dir/${run_name}_clinical_sample_list.txt
-
-    # Getting a wastewater sample sheet
-    grep -Ff $analysis_dir/${run_name}_clinical_sample_list.txt -v $sample_sheet > $analysis_dir/${run_name}_Samplesheet_ww.csv
-
-    # Getting list of all wastewater samples. Used to fetch matching fastq files in the next steps. 
-    awk -F, '/^\[Cloud_Data\]/,EOF { if ($1 != "Sample_ID" && $1 !~ /^\[/) print $1 }' \
-                                            $analysis_dir/${run_name}_Samplesheet_ww.csv > $analysis_dir/tmp_ww_list_raw.txt
-
-    # Remove any empty rows
-    grep -v '^[[:space:]]*$' $analysis_dir/tmp_ww_list_raw.txt > $analysis_dir/${run_name}_wastewater_sample_list.csv
+    # Getting the list of all clinical (covid, flu, RSV and measles) samples, the wastewater sample sheet without the clinical samples and
+    # the list of all wastewater samples in [Cloud_Data], used to fetch matching fastq files in the next steps.
+    python $script_dir/utils/samplesheet.py $sample_sheet $analysis_dir $run_name
 
     # Set directory structure/paths for the fastq files
     mkdir -p $analysis_dir/raw_data/fastq
@@ -95,19 +92,14 @@ if [ ! -d "/Volumes/NGS_2/wastewater_sequencing/$run_name" ] && [ -n "$wastewate
     # Fastq files directory destination
     ww_fastq=$analysis_dir/raw_data/fastq
 
-    echo "$(date) : Copying fastq files from $fastq_dir to $ww_fastq directory to run with viralrecon"
-    find $fastq_dir -type f -name '*.fastq.gz' -print0 | grep -zf $analysis_dir/${run_name}_wastewater_sample_list.csv| grep -zviE 'patient|covidseq|flu|influenza|RSV|measles'| parallel -0 "cp {} $ww_fastq/"
-
-    echo "$(date) : Fastq files copied successfully to $ww_fastq"
-
     echo "$(date) : Creating sub directories for downstream analysis"
     mkdir -p ${analysis_dir}/{ncbi_submission,analysis,failed_samples,results,logs}
 
-    cd $ww_fastq
-
-    # Samples that fail after the run are excluded from downstream analysis. This step is nececssary for running samples with viralrecon otherwise oftentimes, the pipeline fails
-    echo "$(date) : Moving failed samples from raw_data directory to another directory (failed_samples) based on file size < 1MB"
-    find $ww_fastq -type f -name "*.fastq.gz" -size -1M -print0 | parallel -0 mv {} $analysis_dir/failed_samples/ 
+    # Copy the fastq files matching the wastewater sample list on their exact sample ID to $ww_fastq with the run name added for downstream analysis,
+    # move samples that fail the FASTQ pre-QC (read count and mean base quality, see ${run_name}_fastq_qc.csv) to failed_samples, and hard link (or copy) the fastq files without controls to the NCBI submission directory.
+    # Samples that fail are excluded from downstream analysis. This step is nececssary for running samples with viralrecon otherwise oftentimes, the pipeline fails
+    echo "$(date) : Staging fastq files from $fastq_dir to $ww_fastq, failed_samples and ncbi_submission directories to run with viralrecon"
+    python $script_dir/utils/stage_fastqs.py ${run_name} ${fastq_dir} ${analysis_dir} --sample-list $analysis_dir/${run_name}_wastewater_sample_list.csv --copy --qc
 
     # If there are two files (_L001 and _L002) per sample as in the case of P3 flow cell then this step is needed to merge the fastqs from two lanes
 
@@ -126,47 +118,8 @@ if [ ! -d "/Volumes/NGS_2/wastewater_sequencing/$run_name" ] && [ -n "$wastewate
       #    done
       # done
 
-    # Rename fastq files for bioinformatics analysis. Also copy fastq files to NCBI submission directory and rename.
-    echo "$(date) : Rename fastq files for downstream analysis and for NCBI submission"
-
-      for file in *.fastq.gz; do
-              echo "$(date) : This is a NextSeq run. Copy fastq files to NCBI submission directory ater removing Lane and Set identifiers"
-              ncbi_file_name=$(echo "${file}" | sed -E 's/_S[0-9]+/-UT/') # for fastqs copied directly from Output folder
-              # ncbi_file_name=$(echo "${file}" | sed -E 's/_S[0-9]+_L[0-9]+/-UT/')" #for fastqs processed via dragen
-
-              cp "${file}" "${analysis_dir}/ncbi_submission/${ncbi_file_name}"
-
-              echo "$(date) : Rename fastq files by removing the lane and Set identifiers and adding $run_name for downstream analysis"
-              new_name=$(echo "${file}" | sed -E "s/_S[0-9]+_/-${run_name}_/") # for fastqs copied directly from Output folder
-              # new_name=$(echo "${file}" | sed -E "s/_S[0-9]+_L[0-9]+_/-${run_name}_/") #for fastqs processed via dragen
-
-              echo "$(date) : ${file} is renamed as ${new_name}"
-              mv "${file}" "${new_name}"
-        done
-
-      # Remove controls from NCBI submission directory prior to submission
-      echo "$(date) : Removing positive and negative control fastqs from the NCBI submission directory."
-      find "${analysis_dir}/ncbi_submission/" -type f -name "CPC*.fastq.gz" -print0 | xargs -0 -r rm --
-      find "${analysis_dir}/ncbi_submission/" -type f -name "NTC*.fastq.gz" -print0 | xargs -0 -r rm --
-
       echo "$(date) : Fastq files ready for NCBI submission. Fastq filenames have been cleaned"
-
-      # Create a CSV file with NCBI submission ID and associated fastq file names, used later in Data-flo for creating NCBI submission template
-      echo "$(date) : Create a csv file with NCBI submission ID and associated fastq file names which gets uploaded to Data-flo for generating NCBI submission templates"
-        for file1 in ${analysis_dir}/ncbi_submission/*_R1_001.fastq.gz
-        do
-          sample_id=$(basename "$file1" _R1_001.fastq.gz)
-          echo $sample_id
-          file2="${file1%_R1_001.fastq.gz}_R2_001.fastq.gz"
-
-          if [ -f "$file2" ]; then  # if the file exists
-            echo "Found paired-end fastq file"
-            echo "${sample_id},${file1##*/},${file2##*/}" >> ${analysis_dir}/${run_name}_ncbi_submission_info.csv
-          else
-            echo "Found single-end fastq file"
-            echo "${sample_id},${file1##*/}," >> ${analysis_dir}/${run_name}_ncbi_submission_info.csv
-          fi
-        done
+      echo "$(date) : ${run_name}_ncbi_submission_info.csv with NCBI submission ID and associated fastq file names is ready to be uploaded to Data-flo for generating NCBI submission templates"
 
       echo "$(date) : Fastq files names are now cleaned. Folders and files are in place. You are now ready for downstream bioinformatics analysis and NCBI submission."   
   
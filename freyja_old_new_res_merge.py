@@ -8,18 +8,27 @@ This script aggregates lineage data from wastewater sequencing. It takes the lat
 cleans it up (add collection date, lat-long data) and merges them with previous lineage abundance results,
 to output an aggregated output CSV file that can be uploaded into Microreact project.
 
-Usage: freyja_old_new_res_merge.py <new_run_name_dir> <old_res_date>
+Usage: freyja_old_new_res_merge.py <new_run_name_dir> <old_res_date> [--chunksize N]
 """
 
 # Import the required libraries
 import argparse
 import logging
+import numpy as np
 import pandas as pd
 import os
 import glob
 import sys
 from datetime import datetime
 
+# Helper modules shared with the Freyja post-processing scripts live in utils/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils'))
+from lineage_store import LineageStore, KEY_COLUMNS
+from site_registry import SiteRegistry
+from instrumentation import RunMetrics, timed
+from lineage_schema import read_long_df, read_lineage_abundance, to_compact, to_export, harmonize_categories
+from lineage_rollup import update_rollup, SAMPLE_GROUPS_SUFFIX, CUBE_SUFFIX
+
 
 # Some custom helper functions
 
@@ -34,28 +43,72 @@ def set_up_logger():
     return logger
 logger = set_up_logger()  # Call the logger setup function
 
-def check_abundance_sum(df):
+def abundance_stats(df, is_duplicate):
+    """
+    Aggregate the lineage abundances by group (sample_id, collection_date).
+
+    Parameters:
+    df (pd.DataFrame): Input DataFrame containing the lineage data.
+    is_duplicate (array-like): Flags the rows repeating a (sample_id, collection_date, lineage) key.
+
+    Returns:
+    pd.DataFrame: Abundance sum, number of lineages, number of duplicate lineages and the abundance sum once
+    duplicates are dropped, indexed by (sample_id, collection_date). The columns are additive, so stats of
+    separate chunks of the data can be combined by summing them per group.
+    """
+    group_columns = ['sample_id', 'collection_date']
+    return (df[group_columns + ['lineage', 'abundance']]
+            .assign(is_duplicate=is_duplicate, dedup_abundance=df['abundance'].where(~is_duplicate, 0))
+            .groupby(group_columns, observed=True)
+            .agg(abundance_sum=('abundance', 'sum'),
+                 n_lineages=('lineage', 'size'),
+                 n_duplicate_lineages=('is_duplicate', 'sum'),
+                 dedup_abundance_sum=('dedup_abundance', 'sum')))
+
+def report_abundance_sum(stats, threshold=1.01):
+    """
+    Report the groups of abundance_stats whose abundances sum to more than the threshold.
+    One summary line is logged instead of a warning per group.
+
+    Parameters:
+    stats (pd.DataFrame): Output of abundance_stats.
+    threshold (float): Largest accepted abundance sum, allowing for minor floating-point inaccuracies.
+
+    Returns:
+    pd.DataFrame: One row per offending group with its abundance sum, number of lineages, number of duplicate
+    lineages, the abundance sum once duplicates are dropped and whether the duplicates explain the excess.
+    """
+    report = stats[stats['abundance_sum'] > threshold].reset_index()
+    report['duplicates_explain_excess'] = report['dedup_abundance_sum'] <= threshold
+
+    if report.empty:
+        logger.info(f"Lineage abundances sum to at most {threshold} for all {stats.shape[0]} sample groups.")
+    else:
+        logger.warning(f"Abundance sum is greater than 1 for {report.shape[0]} of {stats.shape[0]} sample groups "
+                       f"({int(report['duplicates_explain_excess'].sum())} explained by duplicate lineages). "
+                       "There might be duplicate entries or other inconsistencies. See the abundance sum report for details.")
+
+    return report
+
+@timed('check_abundance_sum', rows=lambda result, df, *args, **kwargs: len(df))
+def check_abundance_sum(df, threshold=1.01):
     """
     Check if the abundance values by group (sample_id, collection_date) sum to 1.
-    If the sum of abundances is greater than 1, print a message indicating potential duplicates or other inconsistencies.
+    All groups are validated in a single groupby-aggregate pass.
     
     Parameters:
     df (pd.DataFrame): Input DataFrame containing the lineage data.
+    threshold (float): Largest accepted abundance sum, allowing for minor floating-point inaccuracies.
     
     Returns:
-    None
+    pd.DataFrame: Abundance sum report, see report_abundance_sum.
     """
-    # Group by sample_id and collection_date
-    grouped = df.groupby(['sample_id', 'collection_date'])
-
-    # Check if the abundances sum to 1 for each group
-    for name, group in grouped:
-        abundance_sum = group['abundance'].sum()
-        if abundance_sum > 1.01:  # Allowing for minor floating-point inaccuracies
-            logger.warning(f"Abundance sum for group {name} is greater than 1 (sum = {abundance_sum}). "
-               "There might be duplicate entries or other inconsistencies.")
+    # Flag repeated lineages within a group so their contribution to the sum can be separated out
+    is_duplicate = df.duplicated(subset=['sample_id', 'collection_date', 'lineage'], keep='first')
+    return report_abundance_sum(abundance_stats(df, is_duplicate), threshold)
 
 
+@timed('remove_duplicates')
 def remove_duplicates(df):
     """
     Remove duplicate entries based on sample_id, collection_date, and lineages columns.
@@ -74,21 +127,166 @@ def remove_duplicates(df):
 
     return df
 
+@timed('save_output', rows=lambda result, df, *args, **kwargs: len(df))
 def save_output(df, output_dir, output_file):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
     output_path = os.path.join(output_dir, output_file)
-    df.to_csv(output_path, index=False)
+    to_export(df).to_csv(output_path, index=False)
+
+@timed('merge_into_store', rows=lambda result, merged_df, *args, **kwargs: len(merged_df))
+def merge_into_store(merged_df, store_file, run_name, old_filepath, output_file):
+    """
+    Upsert the new run into the persistent lineage store and export the Microreact CSV from it.
+
+    Only the collection-month partitions touched by the new run are validated. An empty store is
+    seeded from the old lineage abundance CSV in old_filepath when one is available.
+
+    Parameters:
+    merged_df (pd.DataFrame): Cleaned lineage data of the new run with lat/long columns.
+    store_file (str): Path to the SQLite lineage store.
+    run_name (str): Name of the new sequencing run.
+    old_filepath (str): Directory with the previous results, or None.
+    output_file (str): Path of the exported CSV.
+    
+    Returns:
+    pd.DataFrame: Abundance sum report for the touched partitions.
+    """
+    with LineageStore(store_file) as store:
+        if store.is_empty() and old_filepath:
+            old_files = glob.glob(os.path.join(old_filepath, '*lineage_abundance_cln.csv'))
+            for lin_abund in old_files:
+                print(lin_abund)
+            if old_files:
+                n_rows = store.import_csv(old_files[-1])
+                logger.info(f"Seeded lineage store {store_file} with {n_rows} rows from {old_files[-1]}")
+
+        months = store.upsert(merged_df, run_name)
+        logger.info(f"Upserted {merged_df.shape[0]} rows from run {run_name} into {store_file}. "
+                    f"Touched partitions: {', '.join(months)}")
+
+        # Check if the sum of lineage abundances equals 1 for each sample and date in the touched partitions
+        abundance_report = check_abundance_sum(store.fetch_partitions(months))
+
+        n_rows = store.export_csv(output_file)
+        logger.info(f"Total number of rows in the lineage store: {n_rows}")
+
+    return abundance_report
+
+def _key_hashes(df):
+    # 64-bit hashes of the exact (sample_id, collection_date, lineage) keys, independent of the categories of each frame
+    keys = df[KEY_COLUMNS].astype({'sample_id': object, 'lineage': object})
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+@timed('stream_merge', rows=lambda result, *args, **kwargs: result[2])
+def stream_merge(merged_df, old_file, output_file, chunksize=100000, threshold=1.01):
+    """
+    Merge the new run with the old lineage abundance CSV without loading the history into memory.
+
+    The new run is written first, then the history is read in chunks and every row whose key
+    (sample_id, collection_date, lineage) was already written, from the new run or an earlier row of the history,
+    is dropped before the chunk is appended to the output. Histories written before duplicates were removed can
+    repeat a key across chunks, so a set of 64-bit hashes of the written keys is kept. Memory is bounded by the
+    new run, that set (8 bytes of hash per key plus the set overhead) and one chunk.
+
+    Abundance stats are accumulated per chunk and summed per (sample_id, collection_date) group, so the
+    abundance sum report matches the one of the in-memory merge.
 
-def parse_arguments():
+    Parameters:
+    merged_df (pd.DataFrame): Cleaned lineage data of the new run with lat/long columns.
+    old_file (str): Path to the old '*lineage_abundance_cln.csv' file.
+    output_file (str): Path of the merged CSV. It may be the same file as old_file.
+    chunksize (int): Number of history rows read per chunk.
+    threshold (float): Largest accepted abundance sum.
+
+    Returns:
+    tuple: Abundance sum report, number of rows read and number of rows written.
+    """
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    # Write next to the output and rename at the end, so the old file can be the output file
+    tmp_file = output_file + '.tmp'
+
+    is_duplicate = merged_df.duplicated(subset=KEY_COLUMNS, keep='first')
+    stats = [abundance_stats(merged_df, is_duplicate)]
+    # 'idx_name' numbers the rows of the new run followed by the history, before duplicates are dropped
+    new_rows = merged_df.reset_index(drop=True)
+    new_rows.insert(0, 'idx_name', new_rows.index)
+    new_rows = new_rows[~is_duplicate.to_numpy()]
+    written_keys = set(_key_hashes(new_rows).tolist())
+
+    columns = list(new_rows.columns)
+    to_export(new_rows).to_csv(tmp_file, index=False)
+    n_read, n_written = merged_df.shape[0], new_rows.shape[0]
+
+    for chunk in read_lineage_abundance(old_file, chunksize=chunksize):
+        keys = _key_hashes(chunk)
+        is_written = np.fromiter((key in written_keys for key in keys.tolist()), dtype=bool, count=len(keys))
+        is_duplicate = is_written | pd.Series(keys).duplicated(keep='first').to_numpy()
+        written_keys.update(keys[~is_duplicate].tolist())
+        stats.append(abundance_stats(chunk, is_duplicate))
+
+        chunk['idx_name'] = range(n_read, n_read + chunk.shape[0])
+        rows = chunk[~is_duplicate].reindex(columns=columns)
+        to_export(rows).to_csv(tmp_file, index=False, mode='a', header=False)
+        n_read += chunk.shape[0]
+        n_written += rows.shape[0]
+
+    os.replace(tmp_file, output_file)
+
+    # Group keys can be categoricals with different categories in each chunk, so combine them as plain values
+    stats = pd.concat([frame.reset_index().astype({'sample_id': object}) for frame in stats])
+    stats = stats.groupby(['sample_id', 'collection_date']).sum()
+    return report_abundance_sum(stats, threshold), n_read, n_written
+
+def save_rollup(new_run_df, sites, previous_dir, new_filepath, date_str, merged_df=None, merged_file=None,
+                chunksize=100000):
+    """
+    Update the site x ISO week x lineage group rollup with the new run and save it with the merged results.
+
+    Only the samples of the new run and their (site, week) cells are recomputed from the merged table; the rest is
+    taken from the rollup in previous_dir. Without a previous rollup it is built from the full merged table.
+
+    Parameters:
+    new_run_df (pd.DataFrame): Cleaned lineage data of the new run.
+    sites (pd.DataFrame): Site table indexed by site code.
+    previous_dir (str): Results directory of the previous merge, or None.
+    new_filepath (str): Results directory of this merge.
+    date_str (str): Date prefix of the output files.
+    merged_df (pd.DataFrame): The merged table when it is in memory, otherwise merged_file is read in chunks.
+    merged_file (str): Path of the merged CSV.
+    chunksize (int): Number of rows read per chunk from merged_file.
+    """
+    new_keys = pd.MultiIndex.from_frame(new_run_df[['sample_id', 'collection_date']]
+                                        .astype({'sample_id': object}).drop_duplicates())
+    groups, cube, incremental = update_rollup(new_keys, sites, previous_dir, merged_df, merged_file, chunksize)
+    save_output(groups, new_filepath, f'{date_str}_{SAMPLE_GROUPS_SUFFIX}')
+    save_output(cube, new_filepath, f'{date_str}_{CUBE_SUFFIX}')
+    logger.info(f"Lineage rollup {'updated with' if incremental else 'rebuilt including'} {len(new_keys)} samples of the new run: "
+                f"{cube.shape[0]} site x week x lineage group rows")
+
+def latest_results_dir(all_results_dir, suffix=CUBE_SUFFIX):
+    # Dated result directories sort chronologically by name
+    files = sorted(glob.glob(os.path.join(all_results_dir, '*', f'*{suffix}')))
+    return os.path.dirname(files[-1]) if files else None
+
+def parse_arguments(args=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('new_run_name_dir', help='Directory of the new run')
-    parser.add_argument('old_res_date', help='Date of the old results')
-    return parser.parse_args()
-
-def main(config):
-    args = parse_arguments()
+    parser.add_argument('old_res_date', nargs='?', default=None,
+                        help='Date of the old results. Optional with --store, where it is only used to seed an empty store')
+    parser.add_argument('--store', default=None,
+                        help='SQLite lineage store to upsert the new run into instead of re-merging the full CSV history')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='Stream the old results in chunks of this many rows instead of loading them into memory')
+    parsed_args = parser.parse_args(args)
+    if parsed_args.store is None and parsed_args.old_res_date is None:
+        parser.error('old_res_date is required unless --store is given')
+    return parsed_args
+
+def merge_new_run(config, args, metrics):
     run_name = args.new_run_name_dir
     old_res_date = args.old_res_date
 
@@ -105,20 +303,40 @@ def main(config):
     for lineage_file in source_files:
         print(lineage_file)
 
-    # Read in the data from the latest sequencing run
-    long_df = pd.read_csv(lineage_file, sep=',')
-    long_df[['collection_date', 'msd_shrtnm']] = long_df['sample_id'].str.split('_', n=1, expand=True)
-    long_df['collection_date'] = pd.to_datetime(long_df['collection_date'], format='%y%m%d')
+    # Read in the data from the latest sequencing run, with categorical lineage columns
+    long_df = read_long_df(lineage_file)
 
+    # Get the current date
+    today = datetime.today()
+    date_str = today.strftime('%Y-%m-%d')
 
-    # Read in the latitude and longitude data
-    lat_long_df = pd.read_csv(config['lat_long_file'], sep=',')
-
-    # Merge the sequencing run data with the latitude and longitude data
-    merged_df = pd.merge(long_df, lat_long_df, on='msd_shrtnm')
-
-    # Extract the date of the old results from the command line arguments
-    old_res_date = old_res_date
+    # Set the file path for the new results
+    new_filepath = os.path.join(config['all_freyja_results_dir'], date_str)
+    output_file = os.path.join(new_filepath, f'{date_str}_WW_feyja_varaints_SC2_lineage_abundance_cln.csv')
+
+    # Write the stage metrics of this run next to the results
+    metrics.output_file = os.path.join(new_filepath, f'{date_str}_merge_metrics.json')
+
+    # Parse the collection date and site code from the sample IDs and add the site name, latitude and longitude
+    site_registry = SiteRegistry(config['lat_long_file'])
+    merged_df, unmatched_report = site_registry.annotate(long_df)
+    merged_df = to_compact(merged_df)
+
+    if not unmatched_report.empty:
+        save_output(unmatched_report, new_filepath, f'{date_str}_unmatched_sites_report.csv')
+        logger.warning(f"{unmatched_report.shape[0]} samples ({int(unmatched_report['n_rows'].sum())} rows) have a sample ID "
+                       f"that could not be parsed or a site code missing from {config['lat_long_file']}: "
+                       f"{', '.join(unmatched_report['msd_shrtnm'].dropna().astype(str).unique())}. "
+                       "See the unmatched sites report for details.")
+
+    if args.store:
+        old_filepath = os.path.join(config['all_freyja_results_dir'], old_res_date) if old_res_date else None
+        abundance_report = merge_into_store(merged_df, args.store, run_name, old_filepath, output_file)
+        save_output(abundance_report, new_filepath, f'{date_str}_abundance_sum_report.csv')
+        save_rollup(merged_df, site_registry.sites, old_filepath or latest_results_dir(config['all_freyja_results_dir']),
+                    new_filepath, date_str, merged_file=output_file)
+        logger.info("Post-processing of freyja results is complete and the lineage store has been updated. The output file can now be uploaded in Microreact for visualization.")
+        return
 
     # Set the working directory to the directory with the old WW sequencing run results
     old_filepath = os.path.join(config['all_freyja_results_dir'], old_res_date)
@@ -131,25 +349,32 @@ def main(config):
     for lin_abund in old_files:
         print(lin_abund)
 
-    # Read in the old results
-    old_df = pd.read_csv(lin_abund, sep=',')
-    old_df['collection_date'] = pd.to_datetime(old_df['collection_date'])
-
-    # Combine the old and new results
-    merged_df_old_new = pd.concat([merged_df, old_df], ignore_index=True)
-    merged_df_old_new.reset_index(drop=True, inplace=True)
-    merged_df_old_new['idx_name'] = merged_df_old_new.index
-
-    # Get the current date
-    today = datetime.today()
-    date_str = today.strftime('%Y-%m-%d')
-
-    # Set the file path for the new results
-    new_filepath = os.path.join(config['all_freyja_results_dir'], date_str)
+    if args.chunksize:
+        # Streaming merge: the old results are deduplicated against the new run chunk by chunk
+        abundance_report, n_read, n_written = stream_merge(merged_df, lin_abund, output_file, args.chunksize)
+        save_output(abundance_report, new_filepath, f'{date_str}_abundance_sum_report.csv')
+        save_rollup(merged_df, site_registry.sites, old_filepath, new_filepath, date_str, merged_file=output_file,
+                    chunksize=args.chunksize)
+        logger.info(f"Total number of rows in the original data: {n_read}")
+        logger.info(f"Total number of rows after removing duplicates: {n_written}")
+        logger.warning(f"Number of rows removed: {n_read - n_written}")
+        logger.info("Post-processing of freyja results is complete including aggregating results from previous runs. The output file can now be uploaded in Microreact for visualization.")
+        return
+
+    # Read in the old results with explicit dtypes and parsed collection dates
+    old_df = read_lineage_abundance(lin_abund)
+
+    # Combine the old and new results, sharing one set of categories so the lineage columns stay categorical
+    with metrics.stage('concat') as stage:
+        merged_df_old_new = pd.concat(harmonize_categories([merged_df, old_df]), ignore_index=True)
+        merged_df_old_new.reset_index(drop=True, inplace=True)
+        merged_df_old_new.insert(0, 'idx_name', merged_df_old_new.index)
+        stage['rows'] = merged_df_old_new.shape[0]
 
 
     # Check if the sum of lineage abundances equals 1 for each sample and date
-    check_abundance_sum(merged_df_old_new)
+    abundance_report = check_abundance_sum(merged_df_old_new)
+    save_output(abundance_report, new_filepath, f'{date_str}_abundance_sum_report.csv')
     # Print the total number of rows in the original data
     logger.info(f"Total number of rows in the original data: {merged_df_old_new.shape[0]}")
 
@@ -165,8 +390,18 @@ def main(config):
     # Save the processed data to a CSV file with today's date as directory name
     save_output(merged_df_old_new_no_dups,new_filepath,f'{date_str}_WW_feyja_varaints_SC2_lineage_abundance_cln.csv')
 
+    # Update the site x week x lineage group rollup used by the dashboards and reports
+    save_rollup(merged_df, site_registry.sites, old_filepath, new_filepath, date_str, merged_df=merged_df_old_new_no_dups)
+
     logger.info("Post-processing of freyja results is complete including aggregating results from previous runs. The output file can now be uploaded in Microreact for visualization.")
 
+def main(config, args=None):
+    args = parse_arguments(args)
+    # Stage timings, peak memory and row counts are written to '<date>_merge_metrics.json' with the results
+    with RunMetrics('freyja_old_new_res_merge', run_name=args.new_run_name_dir,
+                    mode='store' if args.store else 'stream' if args.chunksize else 'csv') as metrics:
+        merge_new_run(config, args, metrics)
+
 if __name__ == '__main__':
     config = {
         'wastewater_seq_dir': '/Volumes/NGS_2/wastewater_sequencing/',
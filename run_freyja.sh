@@ -10,9 +10,19 @@ Purpose:
 1) Run Freyja tool with wastewater sequencing data. 
 2) Retrieve BAM files for each sample generated by Viralrecon and perform Freyja analysis
 3) Note the input data are the bam files after ivar primer trimming step.
+4) The variants and demix steps run in parallel through utils/freyja_scheduler.py. Samples whose BAM, reference,
+   Freyja and barcode versions are unchanged since the last run are reused from its cache manifest, so a re-run
+   after an ECOS or NAS failure only processes the samples that did not finish.
 
 Usage:
-run_freyja.sh <wastewater sequencing run_name> | tee -a freyja.log
+run_freyja.sh <wastewater sequencing run_name> [--serial] | tee -a freyja.log
+
+--serial                  Run the variants and demix steps one sample at a time in this script, without the cache.
+
+Environment variables:
+FREYJA_WORKERS            Maximum number of samples processed at the same time (default: half of the CPUs).
+FREYJA_THREADS_PER_JOB    Threads given to each Freyja job through OMP/OPENBLAS/MKL_NUM_THREADS (default: 2).
+                          Keep FREYJA_WORKERS x FREYJA_THREADS_PER_JOB at or below the number of CPUs.
 Last updated on: September 18,2023
 "
 ###########################
@@ -20,6 +30,10 @@ Last updated on: September 18,2023
 echo "$USAGE"
 
 run_name=$1
+serial=false
+if [ "$2" == "--serial" ]; then
+    serial=true
+fi
 script_dir='/Volumes/NGS/Bioinformatics/ww_analysis_scripts/Wastewater-genomic-analysis'
 
 echo "$(date): Set paths to run directory and freyja post-processing script."
@@ -46,86 +60,100 @@ status_file="/Volumes/NGS_2/wastewater_sequencing/$run_name/logs/freyja_demix_st
 # Create the status file if it does not exist
 touch "$status_file"
 
+freyja_image=staphb-freyja-latest.simg
+
 echo "$(date): Pull in the latest Freyja container with updated barcodes." >> $status_file
-singularity pull -F --name staphb-freyja-latest.simg docker://quay.io/staphb/freyja:latest
+singularity pull -F --name ${freyja_image} docker://quay.io/staphb/freyja:latest
 
 echo "$(date): Starting Freyja" >> $status_file 
-singularity exec --bind ${analysis_dir} staphb-freyja-latest.simg freyja demix --version >> $status_file
+singularity exec --bind ${analysis_dir} ${freyja_image} freyja demix --version >> $status_file
 echo "$(date): Getting the input variants and depth file from bam files for Freyja analysis" >> $status_file
 
-# Function to retrieve genome coverage from csv
-get_coverage() {
-    local file="$1"
-    grep -E "^$file," "${coverage_file}" | awk -F',' '{print $10}'
-}
-
 coverage_threshold=40  # Set 40% as the threshold
 
-# Loop over each BAM file in input directory, perform Freyja variant analysis, and demultiplex each sample to get lineages
+# Sample manifest built from the MultiQC metrics, looking the coverage column up by its header name
+manifest_file=$workdir/${run_name}_freyja_sample_manifest.csv
+
+if [ "$serial" == false ]; then
+    # Run the variants and demix steps on a pool of workers; the scheduler writes the sample manifest and skips
+    # the samples whose results are up to date in its cache manifest. The worker and thread settings are logged
+    # to the status file by the scheduler.
+    if ! python $script_dir/utils/freyja_scheduler.py ${run_name} --analysis-dir ${analysis_dir} \
+            --coverage-threshold ${coverage_threshold} --status-file ${status_file} --ref ${scov2} \
+            --freyja-cmd "singularity exec --bind ${analysis_dir} ${freyja_image} freyja" \
+            ${FREYJA_WORKERS:+--workers $FREYJA_WORKERS} --threads-per-job ${FREYJA_THREADS_PER_JOB:-2}; then
+        echo "$(date): Freyja scheduler failed. Please check $status_file and try again."
+        exit 1
+    fi
+else
+    echo "$(date): Running the variants and demix steps serially" >> $status_file
+    python $script_dir/utils/sample_qc.py ${coverage_file} ${in_dir} ${manifest_file} --coverage-threshold ${coverage_threshold}
+
+    # Function to retrieve genome coverage from the sample manifest (columns: sample,identifier,bam,coverage,median_depth,passed)
+    get_coverage() {
+        local file="$1"
+        awk -F',' -v id="$file" '$2 == id {print $4}' "${manifest_file}"
+    }
 
-for bam in ${in_dir}/*.ivar_trim.sorted.bam; 
-do
-    # Extracting just the identifier from the bam filename
-    identifier=$(basename "$bam" .ivar_trim.sorted.bam)
+    # Loop over each BAM file in input directory, perform Freyja variant analysis, and demultiplex each sample to get lineages
+
+    for bam in ${in_dir}/*.ivar_trim.sorted.bam; 
+    do
+        # Extracting just the identifier from the bam filename
+        identifier=$(basename "$bam" .ivar_trim.sorted.bam)
     
-    coverage=$(get_coverage "$identifier")
+        coverage=$(get_coverage "$identifier")
 
-    # Ensure coverage is an integer for comparison 
-    coverage=${coverage%.*} # Remove decimal part if present
+        # Ensure coverage is an integer for comparison 
+        coverage=${coverage%.*} # Remove decimal part if present
     
-    if (( $(echo "$coverage >= $coverage_threshold") )); then
-        echo "$(date): input file name is $bam"
-        sample=${identifier%-UT*} 
-        echo "$(date): base name is $sample" >> $status_file
-        echo "$(date): Running Freyja variants step for $sample" >> $status_file
-
-        singularity exec --bind ${analysis_dir} staphb-freyja-latest.simg freyja variants ${bam} --variants $workdir/${sample}_out_variants --depths $workdir/${sample}_out_depths --ref ${scov2}
-    else
-        echo "$(date): Skipping $bam due to insufficient genome coverage." >> $status_file
-    fi
+        if (( $(echo "$coverage >= $coverage_threshold") )); then
+            echo "$(date): input file name is $bam"
+            sample=${identifier%-UT*} 
+            echo "$(date): base name is $sample" >> $status_file
+            echo "$(date): Running Freyja variants step for $sample" >> $status_file
+
+            singularity exec --bind ${analysis_dir} ${freyja_image} freyja variants ${bam} --variants $workdir/${sample}_out_variants --depths $workdir/${sample}_out_depths --ref ${scov2}
+        else
+            echo "$(date): Skipping $bam due to insufficient genome coverage." >> $status_file
+        fi
 
-    depth=${sample}_out_depths
-    var=${sample}_out_variants.tsv
+        depth=${sample}_out_depths
+        var=${sample}_out_variants.tsv
 
-    #output_file="$outdir${sample}_lin_out.tsv"
-    echo "$(date): Running Demultiplexing step for $sample" >> $status_file
-    singularity exec --bind ${analysis_dir} staphb-freyja-latest.simg freyja demix $workdir/${var} $workdir/${depth} --eps 0.01 --covcut 10 --confirmedonly --output $outdir${sample}_lin_out.tsv
+        #output_file="$outdir${sample}_lin_out.tsv"
+        echo "$(date): Running Demultiplexing step for $sample" >> $status_file
+        singularity exec --bind ${analysis_dir} ${freyja_image} freyja demix $workdir/${var} $workdir/${depth} --eps 0.01 --covcut 10 --confirmedonly --output $outdir${sample}_lin_out.tsv
 
-    #echo "$(date): Boostrap analysis step running for $sample" | tee -a $log_file
-    #freyja boot $workdir/${var} $workdir/${depth} --nt 8 --nb 500 --eps 0.01 --output_base $outdir${sample}_boot.tsv
+        #echo "$(date): Boostrap analysis step running for $sample" | tee -a $log_file
+        #freyja boot $workdir/${var} $workdir/${depth} --nt 8 --nb 500 --eps 0.01 --output_base $outdir${sample}_boot.tsv
 
-    # Check the exit status of the 'freyja demix' command. This is useful for tracking which samples failed at the demultiplex stage.
-    if [ $? -eq 0 ]; then
-        if [ -f "${outdir}/${sample}_lin_out.tsv" ]; then
-        echo "Run $run_name: Sample $sample processed successfully." >> $status_file
+        # Check the exit status of the 'freyja demix' command. This is useful for tracking which samples failed at the demultiplex stage.
+        if [ $? -eq 0 ]; then
+            if [ -f "${outdir}/${sample}_lin_out.tsv" ]; then
+            echo "Run $run_name: Sample $sample processed successfully." >> $status_file
+            fi
+        else
+            echo "Run $run_name: Sample $sample did not process successfully. SolverError: Solver 'ECOS' failed. Skipping this sample." >> $status_file
         fi
-    else
-        echo "Run $run_name: Sample $sample did not process successfully. SolverError: Solver 'ECOS' failed. Skipping this sample." >> $status_file
-    fi
 
-done
+    done
+fi
 
 echo "$(date): Demultiplexing step completed and results are stored in $outdir" >> $status_file
-echo "$(date): Running lineage aggregation step in Freyja"
+echo "$(date): Reading the per-sample demix results directly, converting them to a long dataframe for downstream processing and writing the lineage aggregate to $results using the python script freyja_custom_lin_processing.py"
 
-singularity exec --bind ${analysis_dir} staphb-freyja-latest.simg freyja aggregate $outdir --output $outdir${run_name}_lineages_aggregate.tsv --ext tsv
+#singularity exec --bind ${analysis_dir} staphb-freyja-latest.simg freyja aggregate $outdir --output $outdir${run_name}_lineages_aggregate.tsv --ext tsv
 
 #echo "$(date): Plotting lineage aggregate output from Frejya"
 #singularity exec --bind ${analysis_dir} uphl-freyja-latest.simg freyja plot ${outdir}${run_name}_lineages_aggregate.tsv --output $outdir${run_name}_lineages_aggregate_plot.png --lineages
 
-# Check if Freyja analysis completed successfully and the aggregate output file is generated
-if [ -f "${outdir}${run_name}_lineages_aggregate.tsv" ]; then
-    echo "$(date): Lineage aggregration completed and aggregrated tsv is stored in $outdir. Freyja analysis completed"
+# Check if the post-processing completed successfully and the aggregate output file is generated
+if python ${freyja_cln_tsv} ${run_name} --seq-dir ${analysis_dir} --from-demix && [ -f "${results}/${run_name}_lineages_aggregate.tsv" ]; then
+    echo "$(date): Lineage aggregration completed and aggregrated tsv is stored in $results. Freyja analysis completed"
 else
     echo "$(date): Lineage aggregration failed. Please check the input files and try again."
     exit 1
 fi
 
-echo "$(date) : Copying Freyja aggregate lineage results to $results"
-#cd $outdir
-cp $outdir*lineages_aggregate.tsv $results
-
-echo "$(date): Extracting freyja lineage dictionary results and converting it to a long dataframe for downstream processing using the python script freyja_custom_lin_processing.py"
-python ${freyja_cln_tsv} ${run_name}
-
 echo "$(date): Freyja analysis post-processing completed. Next step would be to aggregate result from this sequencing run with the previous run results using another python script freyja_old_new_res_merge.py <new_run_directory> <old_results_date>"
@@ -53,14 +53,18 @@ freyja update
 echo "$(date): Starting Freyja" >> $status_file
 echo "$(date): Getting the input variants and depth file from bam files for Freyja analysis" >> $status_file
 
-# Function to retrieve genome coverage from csv
+coverage_threshold=40  # Set 40% as the threshold
+
+# Build the sample manifest once from the MultiQC metrics, looking the coverage column up by its header name
+manifest_file=$workdir/${run_name}_freyja_sample_manifest.csv
+python $script_dir/utils/sample_qc.py ${coverage_file} ${in_dir} ${manifest_file} --coverage-threshold ${coverage_threshold}
+
+# Function to retrieve genome coverage from the sample manifest (columns: sample,identifier,bam,coverage,median_depth,passed)
 get_coverage() {
     local file="$1"
-    grep -E "^$file," "${coverage_file}" | awk -F',' '{print $10}'
+    awk -F',' -v id="$file" '$2 == id {print $4}' "${manifest_file}"
 }
 
-coverage_threshold=40  # Set 40% as the threshold
-
 # Loop over each BAM file in input directory, perform Freyja variant analysis, and demultiplex each sample to get lineages
 
 for bam in ${in_dir}/*.ivar_trim.sorted.bam;
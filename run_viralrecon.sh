@@ -78,6 +78,12 @@ fi
 echo "$(date) : Copying variant long table result file to $results folder"
 cp $out_dir/variants/ivar/variants_long_table.csv $results/${run_name}_variants_long_table.csv
 
+# Build the sparse sample x mutation allele frequency matrix used for cross-run mutation queries. A failure here only warns:
+# no later step of the run reads the matrix, and it can be rebuilt from the long table copied above with 'variant_matrix.py build'.
+echo "$(date) : Building the variant allele frequency matrix ${run_name}_variant_af_matrix.npz"
+python $script_dir/utils/variant_matrix.py build $results/${run_name}_variants_long_table.csv $results/${run_name}_variant_af_matrix.npz --run-name ${run_name} \
+    || echo "$(date) : WARNING: the variant allele frequency matrix could not be built"
+
 echo "$(date) : Copying multiqc result files to the results folder"
 cp $out_dir/multiqc/multiqc_report.html $results/${run_name}_multiqc_report.html
 cp $out_dir/multiqc/summary_variants_metrics_mqc.csv $results/${run_name}_summary_variants_metrics_mqc.csv
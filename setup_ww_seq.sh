@@ -23,6 +23,8 @@ echo "$USAGE"
 
 run_name=$1
 
+script_dir='/Volumes/NGS/Bioinformatics/ww_analysis_scripts/Wastewater-genomic-analysis'
+
 # Get directory structure/paths for the new WW run
 analysis_dir=/Volumes/NGS_2/wastewater_sequencing/${run_name}
 echo "$(date) : Analysis directory is $analysis_dir."
@@ -57,18 +59,14 @@ fastq_dir=$analysis_dir/raw_data
 # Fastq files directory destination
 ww_fastq=$analysis_dir/raw_data/fastq
 
-echo "$(date) : Copying fastq files from $fastq_dir to $ww_fastq directory"
-find $fastq_dir -type f -name '*.fastq.gz' -print0 | grep -zf $analysis_dir/${run_name}_wastewater_sample_list.txt| parallel -0 "mv {} $ww_fastq/"
-
-echo "$(date) : Fastq files copied successfully to $ww_fastq"
-cd $ww_fastq
-
-# Samples that fail after the run are excluded from downstream analysis. This step is nececssary for running samples with viralrecon otherwise oftentimes, the pipeline fails
-echo "$(date) : Moving failed samples from raw_data directory to another directory (failed_samples) based on file size < 1MB"
-find $ww_fastq -type f -name "*.fastq.gz" -size -1M -print0 | parallel -0 mv {} $analysis_dir/failed_samples/ 
+# Match the fastq files to the wastewater sample list on their exact sample ID, move them to $ww_fastq with the run name added for downstream analysis,
+# move samples that fail the FASTQ pre-QC (read count and mean base quality, see ${run_name}_fastq_qc.csv) to failed_samples, and hard link (or copy) the fastq files without controls to the NCBI submission directory.
+# Samples that fail are excluded from downstream analysis. This step is nececssary for running samples with viralrecon otherwise oftentimes, the pipeline fails
+echo "$(date) : Staging fastq files from $fastq_dir to $ww_fastq, failed_samples and ncbi_submission directories"
+python $script_dir/utils/stage_fastqs.py ${run_name} ${fastq_dir} ${analysis_dir} --sample-list $analysis_dir/${run_name}_wastewater_sample_list.txt --qc
 
-# Rename fastq files for bioinformatics analysis. Also copy fastq files to NCBI submission directory and rename.
-echo "$(date) : Rename fastq files for downstream analysis and for NCBI submission"
+echo "$(date) : Fastq files ready for NCBI submission. Fastq filenames have been cleaned"
+echo "$(date) : ${run_name}_ncbi_submission_info.csv with NCBI submission ID and associated fastq file names is ready to be uploaded to Data-flo for generating NCBI submission templates"
 
 # If there are two files (_L001 and _L002) per sample as in the case of P3 flow cell then this step is needed to merge the fastqs from two lanes
 
@@ -82,58 +80,4 @@ echo "$(date) : Rename fastq files for downstream analysis and for NCBI submissi
 #    done
 #done
 
-for file in *.fastq.gz; do
-
-    # Check if the file contains the run_name (True for NovaSeq runs but not for NextSeq 2000 runs)
-    if [[ "${file}" == *"${run_name}"* ]]; then
-
-        echo "$(date) : This is a NovaSeq run. Rename fastq files by removing the lane and Set identifiers for downstream analysis"
-        new_name=$(echo "${file}" | sed -E "s/_S[0-9]+_L[0-9]+//")
-
-        echo "$(date) : ${file} is renamed as ${new_name}"
-        mv "${file}" "${new_name}"
-
-        echo "$(date) : Rename and copy fastq files to NCBI submission directory"
-        ncbi_file_name=$(echo "${new_name}" | sed -E "s/-${run_name}+/-UT/")
-
-        cp "${new_name}" "${analysis_dir}/ncbi_submission/${ncbi_file_name}"
-
-    else
-        echo "$(date) : This is a NextSeq run. Copy fastq files to NCBI submission directory ater removing Lane and Set identifiers"
-        ncbi_file_name=$(echo "${file}" | sed -E 's/_S[0-9]+_L[0-9]+/-UT/')
-
-        cp "${file}" "${analysis_dir}/ncbi_submission/${ncbi_file_name}"
-
-        echo "$(date) : Rename fastq files by removing the lane and Set identifiers and adding $run_name for downstream analysis"
-        new_name=$(echo "${file}" | sed -E "s/_S[0-9]+_L[0-9]+_/-${run_name}_/")
-
-        echo "$(date) : ${file} is renamed as ${new_name}"
-        mv "${file}" "${new_name}"
-    fi
-done
-
-# Remove controls from NCBI submission directory prior to submission
-echo "$(date) : Removing positive and negative control fastqs from the NCBI submission directory."
-find "${analysis_dir}/ncbi_submission/" -type f -name "CPC*.fastq.gz" -print0 | xargs -0 -r rm --
-find "${analysis_dir}/ncbi_submission/" -type f -name "NTC*.fastq.gz" -print0 | xargs -0 -r rm --
-
-echo "$(date) : Fastq files ready for NCBI submission. Fastq filenames have been cleaned"
-
-# Create a CSV file with NCBI submission ID and associated fastq file names, used later in Data-flo for creating NCBI submission template
-echo "$(date) : Create a csv file with NCBI submission ID and associated fastq file names which gets uploaded to Data-flo for generating NCBI submission templates"
-for file1 in ${analysis_dir}/ncbi_submission/*_R1_001.fastq.gz
-do
-  sample_id=$(basename "$file1" _R1_001.fastq.gz)
-  echo $sample_id
-  file2="${file1%_R1_001.fastq.gz}_R2_001.fastq.gz"
-
-  if [ -f "$file2" ]; then  # if the file exists
-    echo "Found paired-end fastq file"
-    echo "${sample_id},${file1##*/},${file2##*/}" >> ${analysis_dir}/${run_name}_ncbi_submission_info.csv
-  else
-    echo "Found single-end fastq file"
-    echo "${sample_id},${file1##*/}," >> ${analysis_dir}/${run_name}_ncbi_submission_info.csv
-  fi
-done
-
 echo "$(date) : Fastq files names are now cleaned. Folders and files are in place. You are now ready for downstream bioinformatics analysis and NCBI submission."   
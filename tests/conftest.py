@@ -0,0 +1,8 @@
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The scripts import each other by module name, as when they are run from their own directory
+for script_dir in ('', 'conf-files', 'utils'):
+    sys.path.insert(0, os.path.join(REPO_DIR, script_dir))
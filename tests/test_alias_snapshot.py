@@ -0,0 +1,59 @@
+import json
+import os
+
+import pytest
+
+from alias_snapshot import build_snapshot, latest_snapshot, load_aliasor, load_snapshot
+
+# Excerpt of the pango-designation alias key
+ALIAS_KEY = {
+    'A': '',
+    'B': '',
+    'BA': 'B.1.1.529',
+    'BQ': 'B.1.1.529.5.3.1.1.1.1',
+    'JN': 'B.1.1.529.2.86.1',
+    'KP': 'B.1.1.529.2.86.1.1.11.1',
+    'XBB': ['BJ.1', 'BM.1.1.1'],
+    'EG': 'XBB.1.9.2',
+}
+
+
+@pytest.fixture
+def snapshot_file(tmp_path):
+    alias_file = tmp_path / 'alias_key.json'
+    alias_file.write_text(json.dumps(ALIAS_KEY))
+    return build_snapshot(str(alias_file), str(tmp_path / 'alias_key'))
+
+
+def test_snapshot_aliases_known_lineages(snapshot_file):
+    aliasor, info = load_snapshot(snapshot_file)
+
+    assert os.path.basename(snapshot_file) == f"alias_key_{info['version']}.json"
+    assert aliasor.uncompress('JN.1.7') == 'B.1.1.529.2.86.1.1.7'
+    assert aliasor.uncompress('KP.2') == 'B.1.1.529.2.86.1.1.11.1.2'
+    assert aliasor.uncompress('EG.5.1') == 'XBB.1.9.2.5.1'
+    assert aliasor.uncompress('XBB.1.5') == 'XBB.1.5'
+    assert aliasor.compress('B.1.1.529.2.86.1.1.7') == 'JN.1.7'
+    assert aliasor.compress('B.1.1.529.5.3.1.1.1.1.1.1') == 'BQ.1.1'
+
+
+def test_same_alias_key_is_not_snapshot_twice(tmp_path, snapshot_file):
+    alias_file = tmp_path / 'alias_key_copy.json'
+    with open(snapshot_file) as snapshot:
+        alias_file.write_text(snapshot.read())
+
+    assert build_snapshot(str(alias_file), os.path.dirname(snapshot_file)) == snapshot_file
+    assert latest_snapshot(os.path.dirname(snapshot_file)) == snapshot_file
+
+
+def test_modified_snapshot_is_rejected(snapshot_file):
+    with open(snapshot_file, 'a') as snapshot:
+        snapshot.write(' ')
+
+    with pytest.raises(ValueError):
+        load_snapshot(snapshot_file)
+
+
+def test_missing_snapshot_is_an_error(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        load_aliasor(snapshot_dir=str(tmp_path / 'alias_key'))
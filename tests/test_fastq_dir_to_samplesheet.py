@@ -0,0 +1,33 @@
+import csv
+
+from fastq_dir_to_samplesheet import fastq_dir_to_samplesheet, scan_fastqs
+
+
+def touch(directory, name):
+    path = directory / name
+    path.write_bytes(b'')
+    return str(path)
+
+
+def test_scan_fastqs_skips_appledouble_files(tmp_path):
+    r1 = touch(tmp_path, 'A_S1_R1_001.fastq.gz')
+    r2 = touch(tmp_path, 'A_S1_R2_001.fastq.gz')
+    touch(tmp_path, '._A_S1_R1_001.fastq.gz')
+    touch(tmp_path, '._A_S1_R2_001.fastq.gz')
+
+    read_dict = scan_fastqs(str(tmp_path))
+
+    assert read_dict == {'A_S1': {'R1': [(r1, None)], 'R2': [(r2, None)]}}
+
+
+def test_samplesheet_has_no_appledouble_sample(tmp_path):
+    fastq_dir = tmp_path / 'fastqs'
+    fastq_dir.mkdir()
+    for name in ('A_S1_R1_001.fastq.gz', 'A_S1_R2_001.fastq.gz', '._A_S1_R1_001.fastq.gz', '._A_S1_R2_001.fastq.gz'):
+        touch(fastq_dir, name)
+    samplesheet = tmp_path / 'samplesheet.csv'
+
+    fastq_dir_to_samplesheet(str(fastq_dir), str(samplesheet))
+
+    with open(samplesheet) as rows:
+        assert [row['sample'] for row in csv.DictReader(rows)] == ['A_S1']
@@ -0,0 +1,86 @@
+import csv
+import gzip
+
+import pytest
+
+from fastq_qc import fastq_stats, main, qc_samples
+
+READ_LENGTH = 10
+
+
+def write_fastq(path, n_reads, quality='I', newline_at_end=True):
+    # 'I' is Phred 40 and '+' is Phred 10 with the +33 offset
+    sequence = ('ACGT' * READ_LENGTH)[:READ_LENGTH]
+    records = [f'@read{i}\n{sequence}\n+\n{quality * READ_LENGTH}' for i in range(n_reads)]
+    text = '\n'.join(records) + ('\n' if newline_at_end else '')
+    with gzip.open(path, 'wt') as fastq:
+        fastq.write(text)
+    return str(path)
+
+
+def sample_files(tmp_path, sample, r1_reads, r2_reads=None, quality='I'):
+    r2_reads = r1_reads if r2_reads is None else r2_reads
+    return {'R1': write_fastq(tmp_path / f'{sample}_S1_L001_R1_001.fastq.gz', r1_reads, quality),
+            'R2': write_fastq(tmp_path / f'{sample}_S1_L001_R2_001.fastq.gz', r2_reads, quality)}
+
+
+@pytest.mark.parametrize('block_size', [7, 64, 4 * 1024 * 1024])
+@pytest.mark.parametrize('newline_at_end', [True, False])
+def test_fastq_stats_counts_reads_across_blocks(tmp_path, block_size, newline_at_end):
+    path = write_fastq(tmp_path / 'A_S1_R1_001.fastq.gz', 25, newline_at_end=newline_at_end)
+
+    stats = fastq_stats(path, block_size)
+
+    assert (stats['reads'], stats['bases'], stats['quality_sum'], stats['error']) == (25, 250, 250 * 40, None)
+
+
+def test_qc_samples(tmp_path):
+    files = {
+        'pass': sample_files(tmp_path, 'pass', 20),
+        'few_reads': sample_files(tmp_path, 'few_reads', 5),
+        'low_quality': sample_files(tmp_path, 'low_quality', 20, quality='+'),
+        'mismatch': sample_files(tmp_path, 'mismatch', 20, 18),
+        'truncated': sample_files(tmp_path, 'truncated', 20),
+    }
+    truncated = files['truncated']['R2']
+    with open(truncated, 'rb') as fastq:
+        data = fastq.read()
+    with open(truncated, 'wb') as fastq:
+        fastq.write(data[:len(data) // 2])
+
+    rows = {row['sample']: row for row in qc_samples(files, workers=2, min_reads=10, min_mean_quality=20)}
+
+    assert rows['pass']['status'] == 'pass'
+    assert (rows['pass']['reads_r1'], rows['pass']['reads_r2'], rows['pass']['bases'], rows['pass']['mean_quality'],
+            rows['pass']['reason']) == (20, 20, 400, 40.0, '')
+    assert rows['few_reads']['status'] == 'fail'
+    assert rows['few_reads']['reason'] == '5 reads < 10'
+    assert rows['low_quality']['status'] == 'fail'
+    assert rows['low_quality']['reason'] == 'mean quality 10.0 < 20'
+    assert rows['mismatch']['status'] == 'fail'
+    assert rows['mismatch']['reason'] == 'R1 and R2 read counts differ (20 / 18)'
+    assert rows['truncated']['status'] == 'fail'
+    assert rows['truncated']['reason'].startswith('truncated_S1_L001_R2_001.fastq.gz: ')
+
+
+def test_missing_r1_fails(tmp_path):
+    files = {'only_r2': {'R2': write_fastq(tmp_path / 'only_r2_S1_R2_001.fastq.gz', 20)}}
+
+    row, = qc_samples(files, workers=1, min_reads=10)
+
+    assert row['status'] == 'fail'
+    assert row['reason'] == 'no R1 file'
+
+
+def test_main_writes_qc_table(tmp_path):
+    fastq_dir = tmp_path / 'fastq'
+    fastq_dir.mkdir()
+    sample_files(fastq_dir, 'pass', 20)
+    sample_files(fastq_dir, 'few_reads', 5)
+    output = tmp_path / 'fastq_qc.csv'
+
+    assert main([str(fastq_dir), '--output', str(output), '--min-reads', '10', '--workers', '2']) == 0
+
+    with open(output, newline='') as qc_table:
+        rows = list(csv.DictReader(qc_table))
+    assert [(row['sample'], row['status']) for row in rows] == [('few_reads', 'fail'), ('pass', 'pass')]
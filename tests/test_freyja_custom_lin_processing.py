@@ -0,0 +1,68 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from freyja_custom_lin_processing import main, process_runs
+
+MAPPING_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'lineage_mapping.json')
+ALIAS_KEY = {'A': '', 'B': '', 'BA': 'B.1.1.529', 'JN': 'B.1.1.529.2.86.1', 'KP': 'B.1.1.529.2.86.1.1.11.1',
+             'XBB': ['BJ.1', 'BM.1.1.1'], 'EG': 'XBB.1.9.2'}
+AGGREGATES = {
+    'UT-VH00770-240101': [
+        ('240101-ACSSD32-UT-VH00770-240101_lin_out.tsv', 'JN.1.7 KP.2 XBB.1.5', '0.5 0.3 0.2'),
+        ('240101-BCSD20-UT-VH00770-240101_lin_out.tsv', 'EG.5.1 JN.1', '0.6 0.4'),
+        ('NTC-UT-VH00770-240101_lin_out.tsv', 'JN.1', '1.0'),
+    ],
+    'UT-VH00770-240108': [
+        ('240108-ACSSD32-UT-VH00770-240108_lin_out.tsv', 'KP.2 KP.2.3', '0.7 0.3'),
+        ('240108-BCSD20-UT-VH00770-240108_lin_out.tsv', '', ''),
+    ],
+}
+
+
+@pytest.fixture
+def seq_dir(tmp_path):
+    seq_dir = tmp_path / 'separate'
+    for run_name, rows in AGGREGATES.items():
+        results = seq_dir / run_name / 'results'
+        results.mkdir(parents=True)
+        lines = ['\tsummarized\tlineages\tabundances\tresid\tcoverage']
+        lines += [f"{sample}\t[('Omicron', 1.0)]\t{lineages}\t{abundances}\t1.5\t95.0"
+                  for sample, lineages, abundances in rows]
+        (results / f'{run_name}_lineages_aggregate.tsv').write_text('\n'.join(lines) + '\n')
+    return seq_dir
+
+
+@pytest.fixture
+def alias_file(tmp_path):
+    alias_file = tmp_path / 'alias_key.json'
+    alias_file.write_text(json.dumps(ALIAS_KEY))
+    return str(alias_file)
+
+
+def test_runs_processed_together_match_separate_runs(tmp_path, seq_dir, alias_file):
+    together = tmp_path / 'together'
+    shutil.copytree(seq_dir, together)
+
+    for run_name in AGGREGATES:
+        main(run_name, str(seq_dir), alias_file, MAPPING_FILE)
+    results = process_runs(list(AGGREGATES), str(together), workers=2, alias_file=alias_file,
+                           mapping_file=MAPPING_FILE)
+
+    assert results == {'UT-VH00770-240101': 5, 'UT-VH00770-240108': 2}
+    for run_name in AGGREGATES:
+        for output in (f'{run_name}_freyja_lin_dict_long_df_lingrps_final.csv', f'{run_name}_lineage_counts.csv'):
+            assert (together / run_name / 'results' / output).read_text() == \
+                (seq_dir / run_name / 'results' / output).read_text()
+
+
+def test_failed_run_does_not_stop_the_others(tmp_path, seq_dir, alias_file):
+    (seq_dir / 'UT-VH00770-240108' / 'results' / 'UT-VH00770-240108_lineages_aggregate.tsv').write_text(
+        '\tsummarized\tlineages\tabundances\tresid\tcoverage\nsample\t[]\tJN.1 KP.2\tnot-a-number 0.5\t1\t2\n')
+
+    results = process_runs(list(AGGREGATES) + ['UT-VH00770-240115'], str(seq_dir), workers=2, alias_file=alias_file,
+                           mapping_file=MAPPING_FILE)
+
+    assert results == {'UT-VH00770-240101': 5, 'UT-VH00770-240108': None, 'UT-VH00770-240115': None}
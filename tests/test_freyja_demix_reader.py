@@ -0,0 +1,84 @@
+import glob
+import json
+import os
+
+import pandas as pd
+import pytest
+from pango_aliasor.aliasor import Aliasor
+
+from freyja_custom_lin_processing import _read_demix_run, process_aggregate, read_aggregate
+from freyja_demix_reader import read_demix_dir, write_aggregate
+from utils import CachedAliasor, LineageClassifier
+
+RUN_NAME = 'UT-VH00770-240101'
+
+DEMIX_FILES = {
+    f'WW1-{RUN_NAME}_lin_out.tsv': [('summarized', "[('Omicron', 0.95)]"), ('lineages', 'JN.1.7 KP.2 XBB.1.5'),
+                                     ('abundances', '0.50000000 0.30000000 0.15000000'), ('resid', '3.21'),
+                                     ('coverage', '98.5')],
+    f'WW2-{RUN_NAME}_lin_out.tsv': [('summarized', "[('Omicron', 1.0)]"), ('lineages', 'EG.5.1'),
+                                     ('abundances', '1.00000000'), ('resid', '0.5'), ('coverage', '91.0')],
+    # A sample name containing '_out' is cut at that '_out' by the sample_id cleanup
+    f'WW_outfall-{RUN_NAME}_lin_out.tsv': [('summarized', "[('Omicron', 1.0)]"), ('lineages', 'KP.2'),
+                                            ('abundances', '1.00000000'), ('resid', '0.1'), ('coverage', '88.0')],
+    # Failed demix without lineages
+    f'WW3-{RUN_NAME}_lin_out.tsv': [('summarized', '[]'), ('lineages', ''), ('abundances', ''), ('resid', ''),
+                                     ('coverage', '2.0')],
+    f'NTC-{RUN_NAME}_lin_out.tsv': [('summarized', "[('Omicron', 1.0)]"), ('lineages', 'JN.1'),
+                                     ('abundances', '1.00000000'), ('resid', '0.2'), ('coverage', '5.0')],
+}
+
+ALIAS_KEY = {'A': '', 'B': '', 'BA': 'B.1.1.529', 'JN': 'B.1.1.529.2.86.1', 'KP': 'B.1.1.529.2.86.1.1.11.1',
+             'XBB': ['BJ.1', 'BM.1.1.1'], 'EG': 'XBB.1.9.2'}
+MAPPING_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'lineage_mapping.json')
+
+
+def freyja_aggregate(results, output):
+    # Same steps as the 'freyja aggregate --ext _lin_out.tsv' command
+    dfs_demix = [pd.read_csv(fn, skipinitialspace=True, sep='\t', index_col=0)
+                 for fn in sorted(glob.glob(results + '*_lin_out.tsv'))]
+    df_demix = pd.concat(dfs_demix, axis=1).T
+    df_demix.to_csv(output, sep='\t')
+    return output
+
+
+@pytest.fixture
+def lineage_out(tmp_path):
+    lineage_out_dir = tmp_path / RUN_NAME / 'analysis' / 'freyja' / 'lineage_out'
+    lineage_out_dir.mkdir(parents=True)
+    for name, fields in DEMIX_FILES.items():
+        # 'freyja demix' writes the output file name in the header line
+        lines = [f'\t{name}'] + [f'{field}\t{value}' for field, value in fields]
+        (lineage_out_dir / name).write_text('\n'.join(lines) + '\n')
+    return str(lineage_out_dir) + os.sep
+
+
+@pytest.fixture
+def helpers(tmp_path):
+    alias_file = tmp_path / 'alias_key.json'
+    alias_file.write_text(json.dumps(ALIAS_KEY))
+    return CachedAliasor(Aliasor(alias_file=str(alias_file))), LineageClassifier.from_json(MAPPING_FILE)
+
+
+def test_write_aggregate_matches_freyja_aggregate(tmp_path, lineage_out):
+    _, records, empty = read_demix_dir(lineage_out)
+
+    written = write_aggregate(records, str(tmp_path / 'reader_aggregate.tsv'))
+    expected = freyja_aggregate(lineage_out, str(tmp_path / 'freyja_aggregate.tsv'))
+
+    with open(written) as reader_file, open(expected) as freyja_file:
+        assert reader_file.read() == freyja_file.read()
+    assert empty == [f'WW3-{RUN_NAME}_lin_out.tsv']
+
+
+def test_demix_run_matches_aggregate_processing(tmp_path, lineage_out, helpers):
+    aliasor, classifier = helpers
+    agg_file = freyja_aggregate(lineage_out, str(tmp_path / 'freyja_aggregate.tsv'))
+
+    expected = process_aggregate(read_aggregate(agg_file), aliasor, classifier).reset_index(drop=True)
+    long_df = _read_demix_run(RUN_NAME, lineage_out, str(tmp_path / 'results'), aliasor, classifier)
+
+    pd.testing.assert_frame_equal(long_df.reset_index(drop=True), expected)
+    # Both paths cut the demix file name at its first '_out' and drop the failed demix and the control sample
+    run_id = RUN_NAME.replace('-', '_')
+    assert sorted(long_df['sample_id'].unique()) == ['WW', f'WW1_{run_id}_lin', f'WW2_{run_id}_lin']
@@ -0,0 +1,131 @@
+import os
+
+import pandas as pd
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAT_LONG_FILE = os.path.join(REPO_DIR, 'data', 'msd_short_names_lat_long.csv')
+
+# Abundances with more digits than float32 keeps
+OLD_ROWS = [
+    ('240101_ACSSD32', 'BA.2', 0.08723783678435533, '2024-01-01'),
+    ('240101_ACSSD32', 'XBB.1.5', 0.9127621632156447, '2024-01-01'),
+    ('240108_BCSD20', 'JN.1', 0.3333333333333333, '2024-01-08'),
+    ('240108_BCSD20', 'BA.2.86', 0.6666666666666666, '2024-01-08'),
+]
+NEW_ROWS = [
+    ('240115_ACSSD32', 'JN.1.7', 0.1234567890123456),
+    ('240115_ACSSD32', 'KP.2', 0.8765432109876544),
+]
+
+
+def write_inputs(tmp_path, old_rows=OLD_ROWS):
+    run_dir = tmp_path / 'wastewater_seq' / 'UT-VH00770-240120' / 'results'
+    run_dir.mkdir(parents=True)
+    new_df = pd.DataFrame(NEW_ROWS, columns=['sample_id', 'lineage', 'abundance'])
+    new_df['uncompress_lineage'] = new_df['parent_lineage'] = new_df['summarized_lineage'] = new_df['lineage']
+    new_df.insert(0, 'idx_name', range(len(new_df)))
+    new_df.to_csv(run_dir / 'UT-VH00770-240120_lingrps_final.csv', index=False)
+
+    sites = pd.read_csv(LAT_LONG_FILE).set_index('msd_shrtnm')
+    old_dir = tmp_path / 'all_freyja_results' / '2000-01-01'
+    old_dir.mkdir(parents=True)
+    old_df = pd.DataFrame(old_rows, columns=['sample_id', 'lineage', 'abundance', 'collection_date'])
+    old_df['uncompress_lineage'] = old_df['parent_lineage'] = old_df['summarized_lineage'] = old_df['lineage']
+    old_df['msd_shrtnm'] = old_df['sample_id'].str.split('_').str[1]
+    old_df = old_df.join(sites, on='msd_shrtnm')
+    old_df = old_df[['sample_id', 'lineage', 'abundance', 'uncompress_lineage', 'parent_lineage',
+                     'summarized_lineage', 'collection_date', 'msd_shrtnm', 'msd_name', 'longitutde', 'latitude']]
+    old_df.insert(0, 'idx_name', range(len(old_df)))
+    old_df.to_csv(old_dir / '2000-01-01_WW_feyja_varaints_SC2_lineage_abundance_cln.csv', index=False)
+
+    return {
+        'wastewater_seq_dir': str(tmp_path / 'wastewater_seq'),
+        'lat_long_file': LAT_LONG_FILE,
+        'all_freyja_results_dir': str(tmp_path / 'all_freyja_results'),
+    }
+
+
+def run_merge(tmp_path, monkeypatch, options, old_rows=OLD_ROWS):
+    """
+    Returns:
+    tuple: Paths of the merged CSV and of the abundance sum report.
+    """
+    # The merge script logs to app.log in the working directory
+    tmp_path.mkdir(exist_ok=True)
+    monkeypatch.chdir(tmp_path)
+    import freyja_old_new_res_merge
+
+    config = write_inputs(tmp_path, old_rows)
+    freyja_old_new_res_merge.main(config, ['UT-VH00770-240120', '2000-01-01'] + options)
+
+    date_str = pd.Timestamp.today().strftime('%Y-%m-%d')
+    output_dir = os.path.join(config['all_freyja_results_dir'], date_str)
+    return (os.path.join(output_dir, f'{date_str}_WW_feyja_varaints_SC2_lineage_abundance_cln.csv'),
+            os.path.join(output_dir, f'{date_str}_abundance_sum_report.csv'))
+
+
+@pytest.mark.parametrize('options', [[], ['--chunksize', '2'], ['--store', 'lineage_store.sqlite']])
+def test_merged_csv_keeps_abundances(tmp_path, monkeypatch, options):
+    output_file, _ = run_merge(tmp_path, monkeypatch, options)
+    merged = pd.read_csv(output_file, dtype={'abundance': str})
+
+    expected = {(sample, lineage): repr(abundance) for sample, lineage, abundance, *_ in OLD_ROWS + NEW_ROWS}
+    assert dict(zip(zip(merged['sample_id'], merged['lineage']), merged['abundance'])) == expected
+
+
+@pytest.mark.parametrize('chunksize', ['1', '2'])
+def test_stream_merge_drops_duplicates_across_chunks(tmp_path, monkeypatch, chunksize):
+    # A legacy history repeating a key in rows that end up in different chunks, plus a key of the new run
+    old_rows = OLD_ROWS[:2] + [('240101_ACSSD32', 'JN.1', 0.1, '2024-01-01')] + OLD_ROWS[2:] + [
+        ('240101_ACSSD32', 'BA.2', 0.2, '2024-01-01'),
+        ('240115_ACSSD32', 'KP.2', 0.5, '2024-01-15'),
+        ('240101_ACSSD32', 'JN.1', 0.3, '2024-01-01'),
+    ]
+    output_file, report_file = run_merge(tmp_path / 'csv', monkeypatch, [], old_rows)
+    stream_output_file, stream_report_file = run_merge(tmp_path / 'stream', monkeypatch, ['--chunksize', chunksize],
+                                                       old_rows)
+
+    merged = pd.read_csv(output_file)
+    assert not merged.duplicated(subset=['sample_id', 'collection_date', 'lineage']).any()
+    pd.testing.assert_frame_equal(pd.read_csv(stream_output_file), merged)
+    # The report rows are grouped in category order in memory and in value order when streaming
+    group_columns = ['sample_id', 'collection_date']
+    pd.testing.assert_frame_equal(pd.read_csv(stream_report_file).sort_values(group_columns, ignore_index=True),
+                                  pd.read_csv(report_file).sort_values(group_columns, ignore_index=True))
+
+
+def test_check_abundance_sum_reports_groups_over_the_threshold(tmp_path, monkeypatch, caplog):
+    monkeypatch.chdir(tmp_path)
+    from freyja_old_new_res_merge import check_abundance_sum
+
+    df = pd.DataFrame([
+        ('240101_ACSSD32', '2024-01-01', 'JN.1', 0.6),
+        ('240101_ACSSD32', '2024-01-01', 'KP.2', 0.4),
+        # Over 1 only because KP.2 is listed twice
+        ('240108_ACSSD32', '2024-01-08', 'JN.1', 0.7),
+        ('240108_ACSSD32', '2024-01-08', 'KP.2', 0.3),
+        ('240108_ACSSD32', '2024-01-08', 'KP.2', 0.3),
+        # Over 1 without any duplicate
+        ('240108_BCSD20', '2024-01-08', 'JN.1', 0.7),
+        ('240108_BCSD20', '2024-01-08', 'KP.2', 0.5),
+        # Within the floating-point allowance
+        ('240115_BCSD20', '2024-01-15', 'JN.1', 0.505),
+        ('240115_BCSD20', '2024-01-15', 'KP.2', 0.5),
+    ], columns=['sample_id', 'collection_date', 'lineage', 'abundance'])
+
+    with caplog.at_level('INFO', logger='freyja_old_new_res_merge'):
+        report = check_abundance_sum(df)
+
+    assert list(report['sample_id']) == ['240108_ACSSD32', '240108_BCSD20']
+    assert list(report['abundance_sum']) == pytest.approx([1.3, 1.2])
+    assert list(report['n_lineages']) == [3, 2]
+    assert list(report['n_duplicate_lineages']) == [1, 0]
+    assert list(report['dedup_abundance_sum']) == pytest.approx([1.0, 1.2])
+    assert list(report['duplicates_explain_excess']) == [True, False]
+    assert 'greater than 1 for 2 of 4 sample groups (1 explained by duplicate lineages)' in caplog.text
+
+    caplog.clear()
+    with caplog.at_level('INFO', logger='freyja_old_new_res_merge'):
+        assert check_abundance_sum(df[df['sample_id'] == '240101_ACSSD32']).empty
+    assert 'at most 1.01 for all 1 sample groups' in caplog.text
@@ -0,0 +1,184 @@
+import os
+import sys
+import threading
+
+import pytest
+
+import freyja_scheduler
+from freyja_scheduler import main
+
+RUN_NAME = 'UT-VH00770-240120'
+
+# Stand-in for 'freyja': prints the versions from the environment, writes the variants, depths and demix outputs
+# and appends every call to calls.txt
+STUB_FREYJA = '''#!{python}
+import os
+import sys
+
+args = sys.argv[1:]
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calls.txt'), 'a') as calls:
+    calls.write(' '.join(args) + '\\n')
+if args == ['--version']:
+    print(os.environ.get('STUB_FREYJA_VERSION', '1.5.0'))
+elif args == ['demix', '--version']:
+    print(os.environ.get('STUB_BARCODE_VERSION', '2024-01-20'))
+elif args[0] == 'variants':
+    open(args[args.index('--variants') + 1] + '.tsv', 'w').close()
+    open(args[args.index('--depths') + 1], 'w').close()
+elif args[0] == 'demix':
+    with open(args[args.index('--output') + 1], 'w') as output:
+        output.write('summarized\\t[]\\n')
+'''
+
+
+@pytest.fixture
+def run(tmp_path):
+    """
+    A run with samples A and B above the coverage threshold, C below it, and a stub Freyja command.
+    """
+    run_dir = tmp_path / RUN_NAME
+    bam_dir = run_dir / 'analysis' / 'viralrecon' / 'variants' / 'bowtie2'
+    bam_dir.mkdir(parents=True)
+    (run_dir / 'results').mkdir()
+    metrics = ['Sample,Coverage median,% Coverage > 10x']
+    for sample, coverage in (('A', 95), ('B', 80), ('C', 10)):
+        (bam_dir / f'{sample}-{RUN_NAME}.ivar_trim.sorted.bam').write_bytes(f'bam {sample}'.encode())
+        metrics.append(f'{sample}-{RUN_NAME},100,{coverage}')
+    (run_dir / 'results' / f'{RUN_NAME}_summary_variants_metrics_mqc.csv').write_text('\n'.join(metrics) + '\n')
+
+    stub = tmp_path / 'freyja'
+    stub.write_text(STUB_FREYJA.format(python=sys.executable))
+    stub.chmod(0o755)
+    (tmp_path / 'ref.fasta').write_text('>MN908947.3\nACGT\n')
+    return tmp_path
+
+
+def schedule(run, *options):
+    return main([RUN_NAME, '--analysis-dir', str(run), '--freyja-cmd', str(run / 'freyja'),
+                 '--ref', str(run / 'ref.fasta'), '--workers', '2'] + list(options))
+
+
+def demixed_samples(run):
+    # Samples whose demix step ran since the calls file was last cleared
+    calls_file = run / 'calls.txt'
+    calls = calls_file.read_text().splitlines() if calls_file.exists() else []
+    calls_file.unlink(missing_ok=True)
+    return sorted(os.path.basename(call.split()[-1]).split('_lin_out')[0]
+                  for call in calls if call.startswith('demix ') and '--output' in call)
+
+
+def status_lines(run):
+    return (run / RUN_NAME / 'logs' / 'freyja_demix_status.txt').read_text().splitlines()
+
+
+def test_scheduler_runs_samples_above_the_coverage_threshold(run):
+    assert schedule(run) == 0
+
+    assert demixed_samples(run) == ['A', 'B']
+    lineage_out = run / RUN_NAME / 'analysis' / 'freyja' / 'lineage_out'
+    assert sorted(os.listdir(lineage_out)) == ['A_lin_out.tsv', 'B_lin_out.tsv']
+    lines = status_lines(run)
+    assert f'Run {RUN_NAME}: Sample A processed successfully.' in lines
+    assert f'Run {RUN_NAME}: Sample B processed successfully.' in lines
+    assert any('Skipping' in line and f'C-{RUN_NAME}' in line for line in lines)
+
+
+def test_bam_checksums_are_computed_in_the_workers(run, monkeypatch):
+    threads = []
+    sample_key = freyja_scheduler.FreyjaCache.sample_key
+
+    def recording_sample_key(self, sample, bam):
+        threads.append(threading.current_thread())
+        return sample_key(self, sample, bam)
+
+    monkeypatch.setattr(freyja_scheduler.FreyjaCache, 'sample_key', recording_sample_key)
+    assert schedule(run) == 0
+
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+
+
+def test_missing_freyja_command_fails_clearly(run, capsys):
+    assert main([RUN_NAME, '--analysis-dir', str(run), '--freyja-cmd', str(run / 'no_such_freyja'),
+                 '--ref', str(run / 'ref.fasta')]) == 1
+
+    assert 'Freyja is not available' in capsys.readouterr().out
+    assert not (run / RUN_NAME / 'analysis' / 'freyja' / 'lineage_out' / 'A_lin_out.tsv').exists()
+
+
+def test_failing_version_command_fails_clearly(run, capsys):
+    failing = run / 'failing_freyja'
+    failing.write_text('#!/bin/sh\necho "singularity: image not found"\nexit 255\n')
+    failing.chmod(0o755)
+
+    assert main([RUN_NAME, '--analysis-dir', str(run), '--freyja-cmd', str(failing),
+                 '--ref', str(run / 'ref.fasta')]) == 1
+
+    output = capsys.readouterr().out
+    assert 'exited with status 255' in output
+    assert 'image not found' in output
+
+
+def test_second_run_reuses_cached_samples(run):
+    assert schedule(run) == 0
+    assert demixed_samples(run) == ['A', 'B']
+
+    assert schedule(run) == 0
+
+    assert demixed_samples(run) == []
+    assert status_lines(run)[-1].endswith('0 succeeded, 2 reused from cache, 0 failed, 1 skipped')
+
+
+def test_changed_bam_reruns_only_that_sample(run):
+    assert schedule(run) == 0
+    demixed_samples(run)
+
+    (run / RUN_NAME / 'analysis' / 'viralrecon' / 'variants' / 'bowtie2' / f'B-{RUN_NAME}.ivar_trim.sorted.bam').write_bytes(b'new bam B')
+    assert schedule(run) == 0
+
+    assert demixed_samples(run) == ['B']
+
+
+def test_missing_output_reruns_the_sample(run):
+    assert schedule(run) == 0
+    demixed_samples(run)
+
+    (run / RUN_NAME / 'analysis' / 'freyja' / 'lineage_out' / 'A_lin_out.tsv').unlink()
+    assert schedule(run) == 0
+
+    assert demixed_samples(run) == ['A']
+
+
+@pytest.mark.parametrize('change', ['reference', 'freyja_version', 'barcode_version', 'demix_options', 'no_cache'])
+def test_changed_inputs_rerun_every_sample(run, monkeypatch, change):
+    assert schedule(run) == 0
+    demixed_samples(run)
+
+    options = []
+    if change == 'reference':
+        (run / 'ref.fasta').write_text('>MN908947.3\nACGTT\n')
+    elif change == 'freyja_version':
+        monkeypatch.setenv('STUB_FREYJA_VERSION', '1.5.1')
+    elif change == 'barcode_version':
+        monkeypatch.setenv('STUB_BARCODE_VERSION', '2024-02-01')
+    elif change == 'demix_options':
+        monkeypatch.setattr(freyja_scheduler, 'DEMIX_OPTIONS', ['--eps', '0.001', '--covcut', '10', '--confirmedonly'])
+    else:
+        options = ['--no-cache']
+    assert schedule(run, *options) == 0
+
+    assert demixed_samples(run) == ['A', 'B']
+
+
+def test_failed_sample_is_not_cached(run):
+    failing_demix = run / 'freyja_failing_demix'
+    failing_demix.write_text(f'#!/bin/sh\nif [ "$1" = demix ] && [ "$2" != --version ]; then exit 1; fi\n'
+                             f'exec {run / "freyja"} "$@"\n')
+    failing_demix.chmod(0o755)
+    assert main([RUN_NAME, '--analysis-dir', str(run), '--freyja-cmd', str(failing_demix),
+                 '--ref', str(run / 'ref.fasta')]) == 0
+    demixed_samples(run)
+
+    assert schedule(run) == 0
+
+    assert demixed_samples(run) == ['A', 'B']
@@ -0,0 +1,93 @@
+import os
+
+import pandas as pd
+import pytest
+
+from lineage_rollup import CUBE_SUFFIX, SAMPLE_GROUPS_SUFFIX, read_cube, read_sample_groups, update_rollup
+from lineage_schema import to_export
+from lineage_store import STORE_COLUMNS
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAT_LONG_FILE = os.path.join(REPO_DIR, 'data', 'msd_short_names_lat_long.csv')
+
+# Samples 1 and 2 and the new sample 4 share the ACSSD32 cell of ISO week 2024-W01
+OLD_ROWS = [
+    ('240101_ACSSD32', 'JN.1', 'JN.1', 0.6, '2024-01-01'),
+    ('240101_ACSSD32', 'XBB.1.5', 'XBB', 0.3, '2024-01-01'),
+    ('240101_ACSSD32', 'XBB.1.9', 'XBB', 0.1, '2024-01-01'),
+    ('240103_ACSSD32', 'XBB.1.5', 'XBB', 0.8, '2024-01-03'),
+    ('240103_ACSSD32', 'JN.1', 'JN.1', 0.2, '2024-01-03'),
+    ('240108_BCSD20', 'JN.1', 'JN.1', 1.0, '2024-01-08'),
+]
+# Sample 2 is replaced (its XBB group disappears), samples 4 and 5 are added
+NEW_ROWS = [
+    ('240103_ACSSD32', 'JN.1.7', 'JN.1', 0.9, '2024-01-03'),
+    ('240103_ACSSD32', 'KP.2', 'KP.2', 0.1, '2024-01-03'),
+    ('240102_ACSSD32', 'XBB.1.5', 'XBB', 0.5, '2024-01-02'),
+    ('240102_ACSSD32', 'JN.1', 'JN.1', 0.5, '2024-01-02'),
+    ('240115_BCSD20', 'KP.2', 'KP.2', 1.0, '2024-01-15'),
+]
+
+
+@pytest.fixture
+def sites():
+    return pd.read_csv(LAT_LONG_FILE).drop_duplicates(subset='msd_shrtnm').set_index('msd_shrtnm')
+
+
+def lineage_table(rows, sites):
+    df = pd.DataFrame(rows, columns=['sample_id', 'lineage', 'summarized_lineage', 'abundance', 'collection_date'])
+    df['uncompress_lineage'] = df['parent_lineage'] = df['lineage']
+    df['collection_date'] = pd.to_datetime(df['collection_date'])
+    df['msd_shrtnm'] = df['sample_id'].str.split('_').str[1]
+    return df.join(sites, on='msd_shrtnm')[STORE_COLUMNS]
+
+
+def sample_keys(df):
+    return pd.MultiIndex.from_frame(df[['sample_id', 'collection_date']].drop_duplicates())
+
+
+def save_rollup(groups, cube, results_dir):
+    os.makedirs(results_dir, exist_ok=True)
+    groups.to_csv(os.path.join(results_dir, f'2024-01-10_{SAMPLE_GROUPS_SUFFIX}'), index=False)
+    cube_file = os.path.join(results_dir, f'2024-01-10_{CUBE_SUFFIX}')
+    cube.to_csv(cube_file, index=False)
+    # Compare the rollups as they are read back by the next merge and by the reports
+    return read_sample_groups(os.path.join(results_dir, f'2024-01-10_{SAMPLE_GROUPS_SUFFIX}')), read_cube(cube_file)
+
+
+@pytest.mark.parametrize('from_csv', [False, True])
+def test_incremental_rollup_matches_rebuild(tmp_path, sites, from_csv):
+    old_df = lineage_table(OLD_ROWS, sites)
+    new_df = lineage_table(NEW_ROWS, sites)
+    new_keys = sample_keys(new_df)
+
+    old_groups, old_cube, _ = update_rollup(sample_keys(old_df), sites, merged_df=old_df)
+    save_rollup(old_groups, old_cube, str(tmp_path / 'previous'))
+
+    # New run rows replace the stored rows of the same samples, as in the merge
+    kept = old_df[~pd.MultiIndex.from_frame(old_df[['sample_id', 'collection_date']]).isin(new_keys)]
+    merged_df = pd.concat([new_df, kept], ignore_index=True)
+    merged = {'merged_df': merged_df}
+    if from_csv:
+        merged_file = str(tmp_path / 'merged.csv')
+        to_export(merged_df).to_csv(merged_file, index=False)
+        merged = {'merged_file': merged_file, 'chunksize': 2}
+
+    groups, cube, incremental = update_rollup(new_keys, sites, str(tmp_path / 'previous'), **merged)
+    full_groups, full_cube, rebuilt = update_rollup(new_keys, sites, None, **merged)
+
+    assert incremental and not rebuilt
+    groups, cube = save_rollup(groups, cube, str(tmp_path / 'incremental'))
+    full_groups, full_cube = save_rollup(full_groups, full_cube, str(tmp_path / 'full'))
+    pd.testing.assert_frame_equal(groups, full_groups)
+    pd.testing.assert_frame_equal(cube, full_cube)
+
+    cell = cube[(cube['msd_shrtnm'] == 'ACSSD32') & (cube['iso_week'] == 1)].set_index('summarized_lineage')
+    assert set(cell['n_site_samples']) == {3}
+    assert cell.loc['XBB', 'n_samples'] == 2
+    assert cell.loc['XBB', 'mean_abundance'] == pytest.approx((0.4 + 0.5) / 3)
+    assert cell.loc['XBB', 'max_abundance'] == pytest.approx(0.5)
+    assert cell.loc['JN.1', 'mean_abundance'] == pytest.approx((0.6 + 0.9 + 0.5) / 3)
+    assert cell.loc['JN.1', 'max_abundance'] == pytest.approx(0.9)
+    assert cell.loc['KP.2', 'n_samples'] == 1
+    assert cube[cube['msd_shrtnm'] == 'BCSD20']['iso_week'].tolist() == [2, 3]
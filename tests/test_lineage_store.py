@@ -0,0 +1,81 @@
+import sqlite3
+
+import pandas as pd
+
+from lineage_store import LineageStore, STORE_COLUMNS
+
+SITE = {'msd_shrtnm': 'ACSSD32', 'msd_name': '(ACSSD) Ash Creek SSD', 'longitutde': -113.3190102,
+        'latitude': 37.19146247}
+
+
+def lineage_rows(rows):
+    df = pd.DataFrame(rows, columns=['sample_id', 'lineage', 'abundance', 'collection_date'])
+    df['uncompress_lineage'] = df['parent_lineage'] = df['summarized_lineage'] = df['lineage']
+    df = df.assign(**SITE)
+    df['collection_date'] = pd.to_datetime(df['collection_date'])
+    return df[STORE_COLUMNS]
+
+
+def write_history(path, rows):
+    history = lineage_rows(rows)
+    history.insert(0, 'idx_name', range(len(history)))
+    history.to_csv(path, index=False)
+    return str(path)
+
+
+def test_import_upsert_export_round_trip(tmp_path):
+    history = write_history(tmp_path / 'history.csv', [
+        ('231215_ACSSD32', 'BA.2', 0.4, '2023-12-15'),
+        ('231215_ACSSD32', 'JN.1', 0.6, '2023-12-15'),
+        ('240101_ACSSD32', 'JN.1', 0.7, '2024-01-01'),
+        ('240101_ACSSD32', 'KP.2', 0.3, '2024-01-01'),
+        # A repeated key: the first occurrence is kept on import
+        ('240101_ACSSD32', 'KP.2', 0.9, '2024-01-01'),
+    ])
+    new_run = lineage_rows([
+        # A changed abundance for a stored key replaces the stored row
+        ('240101_ACSSD32', 'KP.2', 0.25, '2024-01-01'),
+        ('240108_ACSSD32', 'KP.2', 1.0, '2024-01-08'),
+        # Within the new run the first occurrence of a key wins
+        ('240108_ACSSD32', 'KP.2', 0.5, '2024-01-08'),
+    ])
+    store_file = str(tmp_path / 'lineage_store.sqlite')
+
+    with LineageStore(store_file) as store:
+        assert store.import_csv(history, chunksize=2) == 4
+        assert store.upsert(new_run, 'UT-VH00770-240110') == ['2024-01']
+        assert store.count_rows() == 5
+
+        january = store.fetch_partitions(['2024-01'])
+        assert sorted(zip(january['sample_id'], january['lineage'], january['abundance'])) == [
+            ('240101_ACSSD32', 'JN.1', 0.7), ('240101_ACSSD32', 'KP.2', 0.25), ('240108_ACSSD32', 'KP.2', 1.0)]
+        assert store.fetch_partitions([]).empty
+
+        assert store.export_csv(str(tmp_path / 'export.csv'), chunksize=2) == 5
+
+    exported = pd.read_csv(tmp_path / 'export.csv')
+    assert list(exported.columns) == ['idx_name'] + STORE_COLUMNS
+    assert exported['idx_name'].tolist() == list(range(5))
+    # Newest collection dates first, then by sample and lineage
+    assert list(zip(exported['sample_id'], exported['lineage'], exported['abundance'])) == [
+        ('240108_ACSSD32', 'KP.2', 1.0),
+        ('240101_ACSSD32', 'JN.1', 0.7),
+        ('240101_ACSSD32', 'KP.2', 0.25),
+        ('231215_ACSSD32', 'BA.2', 0.4),
+        ('231215_ACSSD32', 'JN.1', 0.6),
+    ]
+
+    with sqlite3.connect(store_file) as conn:
+        assert conn.execute("SELECT run_name, n_rows FROM loaded_runs").fetchall() == [('UT-VH00770-240110', 2)]
+
+
+def test_upserting_a_run_again_does_not_duplicate_rows(tmp_path):
+    new_run = lineage_rows([('240101_ACSSD32', 'JN.1', 0.7, '2024-01-01'),
+                            ('240101_ACSSD32', 'KP.2', 0.3, '2024-01-01')])
+
+    with LineageStore(str(tmp_path / 'lineage_store.sqlite')) as store:
+        store.upsert(new_run, 'UT-VH00770-240110')
+        store.upsert(new_run.assign(abundance=[0.6, 0.4]), 'UT-VH00770-240110')
+
+        assert store.count_rows() == 2
+        assert sorted(store.fetch_partitions(['2024-01'])['abundance']) == [0.4, 0.6]
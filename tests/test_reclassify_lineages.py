@@ -0,0 +1,99 @@
+import json
+
+import pandas as pd
+import pytest
+
+from lineage_store import LineageStore, STORE_COLUMNS
+from reclassify_lineages import main
+
+JN_1 = 'B.1.1.529.2.86.1.1'
+KP_2 = 'B.1.1.529.2.86.1.1.11.1.2'
+KP_2_3 = 'B.1.1.529.2.86.1.1.11.1.2.3'
+BA_2 = 'B.1.1.529.2'
+
+OLD_MAPPING = [{'name': 'JN.1', 'prefixes': [JN_1]}, {'name': 'BA.2', 'prefixes': [BA_2]}]
+# KP.2 and its sublineages get their own group, listed before JN.1
+NEW_MAPPING = [{'name': 'KP.2', 'prefixes': [KP_2]}] + OLD_MAPPING
+
+ROWS = [
+    ('231215_ACSSD32', 'BA.2', BA_2, 0.4, '2023-12-15'),
+    ('231215_ACSSD32', 'JN.1', JN_1, 0.6, '2023-12-15'),
+    ('240101_ACSSD32', 'KP.2', KP_2, 0.3, '2024-01-01'),
+    ('240101_ACSSD32', 'KP.2.3', KP_2_3, 0.5, '2024-01-01'),
+    ('240101_ACSSD32', 'JN.1', JN_1, 0.2, '2024-01-01'),
+    ('240108_ACSSD32', 'KP.2', KP_2, 0.7, '2024-01-08'),
+    ('240108_ACSSD32', 'XBB.1.5', 'XBB.1.5', 0.3, '2024-01-08'),
+]
+
+EXPECTED_MOVES = [(KP_2, 'JN.1', 'KP.2', 2), (KP_2_3, 'JN.1', 'KP.2', 1)]
+EXPECTED_GROUPS = ['BA.2', 'JN.1', 'KP.2', 'KP.2', 'JN.1', 'KP.2', 'Recombinant']
+
+
+@pytest.fixture
+def lineage_csv(tmp_path):
+    df = pd.DataFrame(ROWS, columns=['sample_id', 'lineage', 'uncompress_lineage', 'abundance', 'collection_date'])
+    df['parent_lineage'] = df['lineage']
+    df['summarized_lineage'] = ['BA.2', 'JN.1', 'JN.1', 'JN.1', 'JN.1', 'JN.1', 'Recombinant']
+    df = df.assign(msd_shrtnm='ACSSD32', msd_name='(ACSSD) Ash Creek SSD', longitutde=-113.3190102,
+                   latitude=37.19146247)[STORE_COLUMNS]
+    df.insert(0, 'idx_name', range(len(df)))
+    csv_file = tmp_path / 'lineage_abundance_cln.csv'
+    df.to_csv(csv_file, index=False)
+    return str(csv_file)
+
+
+@pytest.fixture
+def mapping_file(tmp_path):
+    mapping_file = tmp_path / 'lineage_mapping.json'
+    mapping_file.write_text(json.dumps(NEW_MAPPING))
+    return str(mapping_file)
+
+
+def read_moves(report):
+    moves = pd.read_csv(report).sort_values('uncompress_lineage')
+    return list(moves.itertuples(index=False, name=None))
+
+
+def test_reclassify_csv(tmp_path, lineage_csv, mapping_file):
+    output = tmp_path / 'reclassified.csv'
+    report = tmp_path / 'moves.csv'
+
+    assert main(['--csv', lineage_csv, '--output', str(output), '--lineage-mapping', mapping_file,
+                 '--report', str(report), '--chunksize', '3']) == 0
+
+    original = pd.read_csv(lineage_csv, dtype=str)
+    reclassified = pd.read_csv(output, dtype=str)
+    assert list(reclassified['summarized_lineage']) == EXPECTED_GROUPS
+    pd.testing.assert_frame_equal(reclassified.drop(columns='summarized_lineage'),
+                                  original.drop(columns='summarized_lineage'))
+    assert read_moves(report) == EXPECTED_MOVES
+
+
+def test_reclassify_store(tmp_path, lineage_csv, mapping_file):
+    store_file = str(tmp_path / 'lineage_store.sqlite')
+    with LineageStore(store_file) as store:
+        store.import_csv(lineage_csv)
+    export = tmp_path / 'export.csv'
+    report = tmp_path / 'moves.csv'
+
+    assert main(['--store', store_file, '--export', str(export), '--lineage-mapping', mapping_file,
+                 '--report', str(report)]) == 0
+
+    exported = pd.read_csv(export)
+    groups = dict(zip(zip(exported['sample_id'], exported['lineage']), exported['summarized_lineage']))
+    assert groups == {(sample_id, lineage): group for (sample_id, lineage, *_), group in zip(ROWS, EXPECTED_GROUPS)}
+    assert read_moves(report) == EXPECTED_MOVES
+
+    # A second run finds nothing left to move
+    assert main(['--store', store_file, '--lineage-mapping', mapping_file, '--report', str(report)]) == 0
+    assert read_moves(report) == []
+
+
+@pytest.mark.parametrize('options', [['--store', 'lineage_store.sqlite', '--output', 'out.csv'],
+                                     ['--csv', 'lineage_abundance_cln.csv', '--export', 'out.csv']])
+def test_output_options_of_the_other_mode_are_rejected(options, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        main(options)
+
+    assert exit_info.value.code == 2
+    assert 'can only be used with' in capsys.readouterr().err
@@ -0,0 +1,56 @@
+import sys
+
+from run_watcher import JobQueue, Watcher
+
+
+def test_stage_that_cannot_start_fails_its_run(tmp_path):
+    job_queue = JobQueue(str(tmp_path / 'queue.sqlite'))
+    stages = [
+        ('setup', [str(tmp_path / 'missing_script.sh'), 'RUN1'], None),
+        ('viralrecon', [sys.executable, '-c', 'pass'], None),
+    ]
+    job_queue.enqueue_run('RUN1', 'RUN1', 'fastqgen_complete.txt', stages)
+    watcher = Watcher(job_queue, output_dir=None, ww_dir=None, log_dir=str(tmp_path))
+
+    watcher.start_jobs()
+
+    assert watcher.running == {}
+    assert [(job['stage'], job['status']) for job in job_queue.jobs()] == [('setup', 'failed'), ('viralrecon', 'pending')]
+    assert 'Could not start setup' in (tmp_path / 'RUN1_setup.log').read_text()
+    # The next stage of the run is never started
+    assert job_queue.next_ready() is None
+    job_queue.close()
+
+
+def make_ww_run(ww_dir, run_name):
+    run_dir = ww_dir / run_name
+    run_dir.mkdir(parents=True)
+    (run_dir / 'fastqgen_complete.txt').write_text('')
+    return run_dir
+
+
+def test_first_scan_does_not_enqueue_existing_runs(tmp_path):
+    ww_dir = tmp_path / 'wastewater_sequencing'
+    make_ww_run(ww_dir, 'UT-VH00770-240101')
+    job_queue = JobQueue(str(tmp_path / 'queue.sqlite'))
+    watcher = Watcher(job_queue, output_dir=None, ww_dir=str(ww_dir), log_dir=str(tmp_path))
+
+    assert watcher.scan() == 0
+    assert job_queue.jobs() == []
+    assert job_queue.is_known(str(ww_dir / 'UT-VH00770-240101'))
+
+    # Runs completed after the first scan are enqueued
+    make_ww_run(ww_dir, 'UT-VH00770-240108')
+    assert watcher.scan() == 1
+    assert {job['run_name'] for job in job_queue.jobs()} == {'UT-VH00770-240108'}
+    job_queue.close()
+
+
+def test_existing_queue_enqueues_new_runs(tmp_path):
+    ww_dir = tmp_path / 'wastewater_sequencing'
+    JobQueue(str(tmp_path / 'queue.sqlite')).close()
+    make_ww_run(ww_dir, 'UT-VH00770-240101')
+    job_queue = JobQueue(str(tmp_path / 'queue.sqlite'))
+
+    assert Watcher(job_queue, output_dir=None, ww_dir=str(ww_dir), log_dir=str(tmp_path)).scan() == 1
+    job_queue.close()
@@ -0,0 +1,56 @@
+import pytest
+
+from sample_qc import SampleQCIndex, main, read_manifest
+
+RUN_NAME = 'UT-VH00770-240101'
+
+
+def write_metrics(path, header, rows):
+    path.write_text('\n'.join([header] + rows) + '\n')
+    return str(path)
+
+
+@pytest.mark.parametrize('header, rows', [
+    ('Sample,# Input reads,Coverage median,% Coverage > 1x,% Coverage > 10x',
+     [f'A-{RUN_NAME},1000,250.0,99.0,95.5', f'B-{RUN_NAME},900,12.0,60.0,35.0', f'C-{RUN_NAME},10,NA,1.0,NA']),
+    # Columns moved by MultiQC, with other header spacing and case
+    ('Sample,% coverage > 10x , # Input reads,% Coverage > 1x, coverage MEDIAN',
+     [f'A-{RUN_NAME},95.5,1000,99.0,250.0', f'B-{RUN_NAME},35.0,900,60.0,12.0', f'C-{RUN_NAME},NA,10,1.0,NA']),
+])
+def test_columns_are_found_by_header(tmp_path, header, rows):
+    index = SampleQCIndex(write_metrics(tmp_path / 'metrics.csv', header, rows))
+
+    assert index.get_coverage(f'A-{RUN_NAME}') == 95.5
+    assert index.get_median_depth(f'A-{RUN_NAME}') == 250.0
+    assert index.get_coverage(f'B-{RUN_NAME}') == 35.0
+    assert index.get_coverage(f'C-{RUN_NAME}') is None
+    assert [index.passes(f'{sample}-{RUN_NAME}') for sample in 'ABC'] == [True, False, False]
+    assert index.passes(f'B-{RUN_NAME}', coverage_threshold=30)
+    assert f'D-{RUN_NAME}' not in index and not index.passes(f'D-{RUN_NAME}')
+
+
+def test_missing_column_is_an_error(tmp_path):
+    metrics_file = write_metrics(tmp_path / 'metrics.csv', 'Sample,Coverage median,% Coverage > 1x',
+                                 [f'A-{RUN_NAME},250.0,99.0'])
+
+    with pytest.raises(ValueError, match='% Coverage > 10x'):
+        SampleQCIndex(metrics_file)
+
+
+def test_manifest(tmp_path):
+    metrics_file = write_metrics(tmp_path / 'metrics.csv', 'Sample,Coverage median,% Coverage > 10x',
+                                 [f'A-{RUN_NAME},250.0,95.5', f'B-{RUN_NAME},12.0,35.0'])
+    bam_dir = tmp_path / 'bowtie2'
+    bam_dir.mkdir()
+    for sample in 'ABD':
+        (bam_dir / f'{sample}-{RUN_NAME}.ivar_trim.sorted.bam').write_bytes(b'bam')
+    manifest_file = tmp_path / 'manifest.csv'
+
+    assert main([metrics_file, str(bam_dir), str(manifest_file)]) == 0
+
+    manifest = read_manifest(str(manifest_file))
+    assert [(row['sample'], row['identifier'], row['coverage'], row['median_depth'], row['passed'])
+            for row in manifest] == [('A', f'A-{RUN_NAME}', 95.5, 250.0, True),
+                                     ('B', f'B-{RUN_NAME}', 35.0, 12.0, False),
+                                     ('D', f'D-{RUN_NAME}', None, None, False)]
+    assert manifest[0]['bam'] == str(bam_dir / f'A-{RUN_NAME}.ivar_trim.sorted.bam')
@@ -0,0 +1,50 @@
+from samplesheet import SampleSheet, main
+
+HEADER_ONLY_SHEET = """[Header]
+FileFormatVersion,2
+RunName,UT-VH00770-240120 Wastewater
+Description,Wastewater SARS-CoV-2 surveillance
+
+[BCLConvert_Data]
+Sample_ID,Index,Index2
+240115_ACSSD32,AAAAAAAA,CCCCCCCC
+240115_BCSD20,GGGGGGGG,TTTTTTTT
+
+[Cloud_Data]
+Sample_ID,ProjectName,LibraryName
+240115_ACSSD32,UPHL_SC2,240115_ACSSD32_AAAAAAAA_CCCCCCCC
+240115_BCSD20,UPHL_SC2,240115_BCSD20_GGGGGGGG_TTTTTTTT
+"""
+
+CLINICAL_SHEET = """[Header]
+FileFormatVersion,2
+RunName,UT-VH00770-240121
+
+[BCLConvert_Data]
+Sample_ID,Index,Index2
+24-000001,AAAAAAAA,CCCCCCCC
+
+[Cloud_Data]
+Sample_ID,ProjectName,LibraryName
+24-000001,covidseq,24-000001_AAAAAAAA_CCCCCCCC
+"""
+
+
+def write_sheet(tmp_path, text):
+    path = tmp_path / 'SampleSheet.csv'
+    path.write_text(text)
+    return str(path)
+
+
+def test_wastewater_only_in_header(tmp_path):
+    sample_sheet = write_sheet(tmp_path, HEADER_ONLY_SHEET)
+
+    assert SampleSheet(sample_sheet).has_wastewater()
+    assert main([sample_sheet, '--check']) == 0
+
+
+def test_no_wastewater(tmp_path):
+    sample_sheet = write_sheet(tmp_path, CLINICAL_SHEET)
+
+    assert not SampleSheet(sample_sheet).has_wastewater()
+    assert main([sample_sheet, '--check']) == 1
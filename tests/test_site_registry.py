@@ -0,0 +1,61 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+from site_registry import SiteRegistry, parse_sample_id
+
+
+@pytest.fixture
+def registry(tmp_path):
+    lat_long_file = tmp_path / 'msd_short_names_lat_long.csv'
+    lat_long_file.write_text('msd_name,msd_shrtnm,longitutde,latitude\n'
+                             '(ACSSD) Ash Creek SSD,ACSSD32,-113.3190102,37.19146247\n'
+                             '(BCSD) Brigham City SD,BCSD20,-112.0248354,41.50292145\n'
+                             # A site code listed twice resolves to its first row
+                             '(BCSD) Brigham City SD old name,BCSD20,-112.0,41.5\n')
+    return SiteRegistry(str(lat_long_file))
+
+
+@pytest.mark.parametrize('sample_id, expected', [
+    ('240101_ACSSD32', (datetime.datetime(2024, 1, 1), 'ACSSD32')),
+    ('240101_SITE_WITH_UNDERSCORES', (datetime.datetime(2024, 1, 1), 'SITE_WITH_UNDERSCORES')),
+    ('241399_ACSSD32', (None, 'ACSSD32')),
+    ('NTC_1', (None, None)),
+    (None, (None, None)),
+])
+def test_parse_sample_id(sample_id, expected):
+    assert parse_sample_id(sample_id) == expected
+
+
+def test_lookup(registry):
+    assert 'BCSD20' in registry and 'NEW1' not in registry
+    assert registry.lookup('BCSD20') == {'msd_name': '(BCSD) Brigham City SD', 'longitutde': -112.0248354,
+                                         'latitude': 41.50292145}
+    assert registry.lookup('NEW1') is None
+
+
+@pytest.mark.parametrize('categorical', [False, True])
+def test_annotate_reports_unmatched_samples(registry, categorical):
+    df = pd.DataFrame({'sample_id': ['240101_ACSSD32', '240101_ACSSD32', '240102_NEW1', 'NTC_1', 'NTC_1',
+                                     '241399_BCSD20'],
+                       'lineage': ['JN.1', 'KP.2', 'JN.1', 'JN.1', 'KP.2', 'JN.1']})
+    if categorical:
+        df['sample_id'] = df['sample_id'].astype('category')
+
+    annotated, report = registry.annotate(df)
+
+    # Unknown sites are kept with empty site columns, unparsable sample IDs are dropped
+    assert list(annotated['sample_id'].astype(object)) == ['240101_ACSSD32', '240101_ACSSD32', '240102_NEW1']
+    assert list(annotated['collection_date']) == [pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-01'),
+                                                  pd.Timestamp('2024-01-02')]
+    assert list(annotated['msd_shrtnm']) == ['ACSSD32', 'ACSSD32', 'NEW1']
+    assert list(annotated['msd_name'].iloc[:2]) == ['(ACSSD) Ash Creek SSD'] * 2
+    assert annotated[['msd_name', 'longitutde', 'latitude']].iloc[2].isna().all()
+
+    report = report.astype({'sample_id': object}).sort_values('sample_id').reset_index(drop=True)
+    assert list(zip(report['sample_id'], report['reason'], report['n_rows'])) == [
+        ('240102_NEW1', 'unknown_site', 1), ('241399_BCSD20', 'unparsed_sample_id', 1),
+        ('NTC_1', 'unparsed_sample_id', 2)]
+    assert list(report['msd_shrtnm'].iloc[:2]) == ['NEW1', 'BCSD20']
+    assert pd.isna(report['msd_shrtnm'].iloc[2])
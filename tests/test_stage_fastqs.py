@@ -0,0 +1,123 @@
+import os
+import re
+
+import pytest
+
+from stage_fastqs import main, parse_fastq_name, plan_staging, staged_names
+
+RUN_NAME = 'UT-VH00770-240101'
+
+
+def sed_names(filename, run_name):
+    # Renaming rules of setup_ww_seq.sh (NovaSeq and NextSeq with lanes) and detect_new_ww_VHrun.sh (no lanes)
+    if run_name in filename:
+        analysis_name = re.sub(r'_S[0-9]+_L[0-9]+', '', filename)
+        return analysis_name, re.sub(f'-{run_name}+', '-UT', analysis_name)
+    if re.search(r'_S[0-9]+_L[0-9]+_', filename):
+        return (re.sub(r'_S[0-9]+_L[0-9]+_', f'-{run_name}_', filename, count=1),
+                re.sub(r'_S[0-9]+_L[0-9]+', '-UT', filename, count=1))
+    return re.sub(r'_S[0-9]+_', f'-{run_name}_', filename, count=1), re.sub(r'_S[0-9]+', '-UT', filename, count=1)
+
+
+@pytest.mark.parametrize('filename', [
+    f'240101_ACSSD32-{RUN_NAME}_S12_L001_R1_001.fastq.gz',
+    f'240101_ACSSD32-{RUN_NAME}_S12_L001_R2_001.fastq.gz',
+    f'CPC_1-{RUN_NAME}_S96_L002_R1_001.fastq.gz',
+    '240101_ACSSD32_S12_L001_R1_001.fastq.gz',
+    '240101_BCSD20_S3_L001_R2_001.fastq.gz',
+    '240101_ACSSD32_S12_R1_001.fastq.gz',
+    'NTC_2_S95_R2_001.fastq.gz',
+])
+def test_staged_names_match_sed_rules(filename):
+    sample, read = parse_fastq_name(filename)
+
+    assert staged_names(sample, read, RUN_NAME) == sed_names(filename, RUN_NAME)
+
+
+@pytest.fixture
+def run_dirs(tmp_path):
+    fastq_dir = tmp_path / 'fastq'
+    (fastq_dir / 'Sample_Project').mkdir(parents=True)
+    files = {
+        '240101_ACSSD32_S1_L001_R1_001.fastq.gz': 200,
+        '240101_ACSSD32_S1_L001_R2_001.fastq.gz': 200,
+        # Under the size limit, moved to failed_samples
+        '240101_BCSD20_S2_L001_R1_001.fastq.gz': 50,
+        '240101_BCSD20_S2_L001_R2_001.fastq.gz': 200,
+        'CPC_1_S3_L001_R1_001.fastq.gz': 200,
+        # Not a wastewater sample of the list
+        'patient_1_S4_L001_R1_001.fastq.gz': 200,
+    }
+    for name, size in files.items():
+        (fastq_dir / 'Sample_Project' / name).write_bytes(b'@' * size)
+    sample_list = tmp_path / f'{RUN_NAME}_wastewater_sample_list.txt'
+    sample_list.write_text('240101_ACSSD32\n240101_BCSD20\nCPC_1\n240101_MISSING\n')
+    return fastq_dir, sample_list, tmp_path / 'analysis'
+
+
+def list_files(directory):
+    return sorted(os.path.relpath(os.path.join(root, name), directory)
+                  for root, _, names in os.walk(directory) for name in names)
+
+
+@pytest.mark.parametrize('min_size, failed', [(100, ['240101_BCSD20_S2_L001_R1_001.fastq.gz']), (0, []),
+                                              (300, ['240101_ACSSD32_S1_L001_R1_001.fastq.gz',
+                                                     '240101_ACSSD32_S1_L001_R2_001.fastq.gz',
+                                                     '240101_BCSD20_S2_L001_R1_001.fastq.gz',
+                                                     '240101_BCSD20_S2_L001_R2_001.fastq.gz',
+                                                     'CPC_1_S3_L001_R1_001.fastq.gz'])])
+def test_min_size_routes_small_files_to_failed_samples(run_dirs, min_size, failed):
+    fastq_dir, _, analysis_dir = run_dirs
+
+    plan, missing = plan_staging(str(fastq_dir), {'240101_ACSSD32', '240101_BCSD20', 'CPC_1', '240101_MISSING'},
+                                 RUN_NAME, str(analysis_dir), min_size)
+
+    assert sorted(os.path.basename(item['source']) for item in plan if item['status'] == 'failed') == failed
+    assert all(item['destination'] == str(analysis_dir / 'failed_samples' / os.path.basename(item['source']))
+               and item['ncbi_path'] is None for item in plan if item['status'] == 'failed')
+    assert len(plan) == 5
+    assert missing == ['240101_MISSING']
+
+
+def test_dry_run_only_prints_the_plan(run_dirs, capsys):
+    fastq_dir, sample_list, analysis_dir = run_dirs
+    before = list_files(fastq_dir)
+
+    assert main([RUN_NAME, str(fastq_dir), str(analysis_dir), '--sample-list', str(sample_list),
+                 '--min-size', '100', '--dry-run']) == 0
+
+    assert list_files(fastq_dir) == before
+    assert not analysis_dir.exists()
+    output = capsys.readouterr().out
+    source = fastq_dir / 'Sample_Project'
+    assert (f"[dry-run] staged: move {source / '240101_ACSSD32_S1_L001_R1_001.fastq.gz'} to "
+            f"{analysis_dir / 'raw_data' / 'fastq' / f'240101_ACSSD32-{RUN_NAME}_R1_001.fastq.gz'} and link to "
+            f"{analysis_dir / 'ncbi_submission' / '240101_ACSSD32-UT_R1_001.fastq.gz'}") in output
+    assert (f"[dry-run] failed: move {source / '240101_BCSD20_S2_L001_R1_001.fastq.gz'} to "
+            f"{analysis_dir / 'failed_samples' / '240101_BCSD20_S2_L001_R1_001.fastq.gz'}\n") in output
+    assert (f"[dry-run] staged: move {source / 'CPC_1_S3_L001_R1_001.fastq.gz'} to "
+            f"{analysis_dir / 'raw_data' / 'fastq' / f'CPC_1-{RUN_NAME}_R1_001.fastq.gz'}\n") in output
+    assert 'patient_1' not in output
+    assert '1 samples of the sample list have no FASTQ file: 240101_MISSING' in output
+
+
+def test_staging_moves_and_links_files(run_dirs):
+    fastq_dir, sample_list, analysis_dir = run_dirs
+
+    assert main([RUN_NAME, str(fastq_dir), str(analysis_dir), '--sample-list', str(sample_list),
+                 '--min-size', '100']) == 0
+
+    assert list_files(fastq_dir) == [os.path.join('Sample_Project', 'patient_1_S4_L001_R1_001.fastq.gz')]
+    assert list_files(analysis_dir) == sorted([
+        f'{RUN_NAME}_ncbi_submission_info.csv',
+        os.path.join('failed_samples', '240101_BCSD20_S2_L001_R1_001.fastq.gz'),
+        os.path.join('ncbi_submission', '240101_ACSSD32-UT_R1_001.fastq.gz'),
+        os.path.join('ncbi_submission', '240101_ACSSD32-UT_R2_001.fastq.gz'),
+        os.path.join('ncbi_submission', '240101_BCSD20-UT_R2_001.fastq.gz'),
+        os.path.join('raw_data', 'fastq', f'240101_ACSSD32-{RUN_NAME}_R1_001.fastq.gz'),
+        os.path.join('raw_data', 'fastq', f'240101_ACSSD32-{RUN_NAME}_R2_001.fastq.gz'),
+        os.path.join('raw_data', 'fastq', f'240101_BCSD20-{RUN_NAME}_R2_001.fastq.gz'),
+        os.path.join('raw_data', 'fastq', f'CPC_1-{RUN_NAME}_R1_001.fastq.gz'),
+    ])
+    assert (analysis_dir / f'{RUN_NAME}_ncbi_submission_info.csv').read_text() == (
+        '240101_ACSSD32-UT,240101_ACSSD32-UT_R1_001.fastq.gz,240101_ACSSD32-UT_R2_001.fastq.gz\n')
@@ -0,0 +1,94 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import LineageClassifier, parse_lineage_aggregate
+
+
+@pytest.mark.parametrize('agg_df', [
+    pd.DataFrame({'sample_id': ['A', 'B'], 'lineages': [np.nan, np.nan], 'abundances': ['0.5 0.5', np.nan]}),
+    pd.DataFrame({'sample_id': ['A'], 'lineages': ['BA.2 XBB'], 'abundances': [np.nan]}),
+    pd.DataFrame(columns=['sample_id', 'lineages', 'abundances']),
+])
+def test_parse_lineage_aggregate_without_lineages(agg_df):
+    long_df = parse_lineage_aggregate(agg_df)
+
+    assert long_df.empty
+    assert list(long_df.columns) == ['sample_id', 'lineage', 'abundance']
+
+
+def test_parse_lineage_aggregate():
+    agg_df = pd.DataFrame({'sample_id': ['A', 'B'], 'lineages': ['BA.2 XBB', np.nan],
+                           'abundances': ['0.25 0.75', np.nan]})
+
+    long_df = parse_lineage_aggregate(agg_df)
+
+    assert long_df.to_dict('records') == [{'sample_id': 'A', 'lineage': 'BA.2', 'abundance': 0.25},
+                                          {'sample_id': 'A', 'lineage': 'XBB', 'abundance': 0.75}]
+
+
+MAPPING_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'lineage_mapping.json')
+
+
+def regex_parent_lineage(lineage, lineage_mapping):
+    # Per-prefix matching of get_parent_lineage before the LineageClassifier
+    if lineage.startswith("X"):
+        return "Recombinant"
+    for parent_lineage_dict in lineage_mapping:
+        if any(re.match(f"^{prefix}(\\.|$)", lineage) for prefix in parent_lineage_dict["prefixes"]):
+            return parent_lineage_dict["name"]
+    return 'NA'
+
+
+@pytest.fixture(scope='module')
+def lineage_mapping():
+    with open(MAPPING_FILE) as mapping:
+        return json.load(mapping)
+
+
+def test_classifier_matches_regex_matching(lineage_mapping):
+    classifier = LineageClassifier(lineage_mapping)
+    prefixes = [prefix for group in lineage_mapping for prefix in group['prefixes']]
+    # Every prefix, its sublineages and names that only share the first characters of a component
+    lineages = [lineage for prefix in prefixes
+                for lineage in (prefix, f'{prefix}.1', f'{prefix}.12.3', f'{prefix}0', f'{prefix}0.1')]
+    lineages += ['B', 'A', 'BA', 'BQ.1.1', 'JN.1.7', 'XBB.1.5', 'B.1.1.529.2.86.1.1', 'B.1.1.529.5.3.1.1.1.1.1']
+
+    assert [classifier.classify(lineage) for lineage in lineages] == \
+           [regex_parent_lineage(lineage, lineage_mapping) for lineage in lineages]
+
+
+@pytest.mark.parametrize('lineage, group', [
+    # The first group of the mapping wins: 'BA.2' is both an Omicron (BA.2) and an Omicron prefix
+    ('B.1.1.529.2.75', 'Omicron (BA.2)'),
+    ('B.1.1.529', 'Omicron'),
+    ('B.1.1.529.8', 'Omicron'),
+    ('B.1.617.2.1', 'Delta'),
+    ('B.1.2', 'B.1'),
+    # Prefixes match whole components
+    ('BA.2.75', 'Omicron (BA.2)'),
+    ('BA.21', 'NA'),
+    ('B.1.1.7', 'Alpha'),
+    ('B.1.1.70', 'B.1'),
+    ('B.10', 'NA'),
+    # The regex prefixes were not escaped, so 'A.1' also matched 'AY1.1'; the trie matches the dots literally
+    ('AY1.1', 'NA'),
+    # Recombinants and missing lineages
+    ('XBB.1.5', 'Recombinant'),
+    ('X', 'Recombinant'),
+    ('A.2', 'NA'),
+])
+def test_classifier_groups(lineage_mapping, lineage, group):
+    assert LineageClassifier(lineage_mapping).classify(lineage) == group
+
+
+def test_classify_series_missing_lineages(lineage_mapping):
+    classifier = LineageClassifier(lineage_mapping)
+    lineages = pd.Series(['B.1.1.7', np.nan, None, 'XBB.1', 'B.1.1.7'])
+
+    assert classifier.classify(np.nan) == 'NA'
+    assert classifier.classify_series(lineages).tolist() == ['Alpha', 'NA', 'NA', 'Recombinant', 'Alpha']
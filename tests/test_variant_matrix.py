@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from variant_matrix import VariantMatrix, load_matrices
+
+COLUMNS = ['SAMPLE', 'CHROM', 'POS', 'REF', 'ALT', 'FILTER', 'DP', 'AF', 'GENE', 'HGVS_P_1LETTER']
+RUN1_ROWS = [
+    ('240101-ACSSD32-UT-VH00770-240101', 'MN908947.3', 241, 'C', 'T', 'PASS', 100, 0.95, 'orf1ab', '.'),
+    ('240101-ACSSD32-UT-VH00770-240101', 'MN908947.3', 23063, 'A', 'T', 'PASS', 80, 0.40, 'S', 'p.N501Y'),
+    # The same sample and mutation listed again, with a lower and a higher allele frequency
+    ('240101-ACSSD32-UT-VH00770-240101', 'MN908947.3', 23063, 'A', 'T', 'PASS', 80, 0.30, 'S', 'p.N501Y'),
+    ('240102-BCSD20-UT-VH00770-240101', 'MN908947.3', 23063, 'A', 'T', 'PASS', 50, 0.20, 'S', 'p.N501Y'),
+    ('240101-ACSSD32-UT-VH00770-240101', 'MN908947.3', 23063, 'A', 'T', 'PASS', 80, 0.60, 'S', 'p.N501Y'),
+    # Left out: failed the ivar filters, no allele frequency, low depth
+    ('240102-BCSD20-UT-VH00770-240101', 'MN908947.3', 3037, 'C', 'T', 'ft', 100, 0.99, 'orf1ab', 'p.F924F'),
+    ('240102-BCSD20-UT-VH00770-240101', 'MN908947.3', 3037, 'C', 'T', 'PASS', 100, 0.0, 'orf1ab', 'p.F924F'),
+    ('240102-BCSD20-UT-VH00770-240101', 'MN908947.3', 28881, 'G', 'A', 'PASS', 5, 0.50, 'N', 'p.R203K'),
+    ('240102-BCSD20-UT-VH00770-240101', 'MN908947.3', 241, 'C', 'T', 'PASS', 100, 0.90, 'orf1ab', '.'),
+]
+# Mutations first seen in another order than in run 1, and one mutation only found in run 2
+RUN2_ROWS = [
+    ('240108-ACSSD32-UT-VH00770-240108', 'MN908947.3', 28881, 'G', 'A', 'PASS', 100, 0.70, 'N', 'p.R203K'),
+    ('240108-ACSSD32-UT-VH00770-240108', 'MN908947.3', 241, 'C', 'T', 'PASS', 100, 1.00, 'orf1ab', '.'),
+    ('240108-BCSD20-UT-VH00770-240108', 'MN908947.3', 23063, 'A', 'T', 'PASS', 100, 0.10, 'S', 'p.N501Y'),
+]
+
+
+def build(tmp_path, name, rows, chunksize=2):
+    variants_file = tmp_path / f'{name}_variants_long_table.csv'
+    pd.DataFrame(rows, columns=COLUMNS).to_csv(variants_file, index=False)
+    matrix = VariantMatrix.from_csv(str(variants_file), name, chunksize=chunksize, min_dp=10)
+    return matrix.save(str(tmp_path / f'{name}_variant_af_matrix.npz'))
+
+
+def entries(matrix):
+    # {(sample_id, mutation): AF} of the non-zero entries
+    return {(matrix.samples[row], matrix.mutations[col]): af for row, col, af in zip(matrix.row, matrix.col, matrix.af)}
+
+
+@pytest.mark.parametrize('chunksize', [1, 2, 100])
+def test_matrix_round_trip(tmp_path, chunksize):
+    matrix = VariantMatrix.load(build(tmp_path, 'run1', RUN1_ROWS, chunksize))
+
+    assert list(matrix.samples) == ['240101_ACSSD32', '240102_BCSD20']
+    assert list(matrix.sample_dates) == ['2024-01-01', '2024-01-02']
+    assert list(matrix.sample_sites) == ['ACSSD32', 'BCSD20']
+    assert list(matrix.sample_runs) == ['run1', 'run1']
+    assert list(matrix.mutations) == ['C241T', 'A23063T']
+    assert list(matrix.amino_acids) == ['', 'S:N501Y']
+    assert entries(matrix) == {('240101_ACSSD32', 'C241T'): pytest.approx(0.95),
+                               ('240101_ACSSD32', 'A23063T'): pytest.approx(0.60),
+                               ('240102_BCSD20', 'A23063T'): pytest.approx(0.20),
+                               ('240102_BCSD20', 'C241T'): pytest.approx(0.90)}
+    assert (matrix.row.dtype, matrix.col.dtype, matrix.af.dtype) == (np.int32, np.int32, np.float32)
+
+
+def test_combine_aligns_mutations(tmp_path):
+    run1 = VariantMatrix.load(build(tmp_path, 'run1', RUN1_ROWS))
+    run2 = VariantMatrix.load(build(tmp_path, 'run2', RUN2_ROWS))
+
+    combined = load_matrices([str(tmp_path / 'run1_variant_af_matrix.npz'), str(tmp_path / 'run2_variant_af_matrix.npz')])
+
+    assert combined.shape == (4, 3)
+    assert list(combined.mutations) == ['C241T', 'A23063T', 'G28881A']
+    assert list(combined.amino_acids) == ['', 'S:N501Y', 'N:R203K']
+    assert list(combined.sample_runs) == ['run1', 'run1', 'run2', 'run2']
+    assert entries(combined) == {**entries(run1), **entries(run2)}
+
+    query = combined.query(['S:N501Y'])
+    assert list(zip(query['sample_id'], query['run_name'])) == [
+        ('240101_ACSSD32', 'run1'), ('240102_BCSD20', 'run1'), ('240108_BCSD20', 'run2')]
+    assert list(query['af']) == pytest.approx([0.6, 0.2, 0.1])
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Versioned local snapshots of the Pango alias key.
+
+pango_aliasor's Aliasor() downloads the latest alias key from pango-designation every time it is created, so
+the lineage aliasing of a run depends on the network and on whatever alias key was current. A snapshot is an
+unchanged copy of the alias key saved as 'data/alias_key/alias_key_<date>_<sha256 prefix>.json' and loaded with
+Aliasor(alias_file=...). The snapshot version (its date and checksum) is recorded with the outputs of every run.
+Runs fail when no snapshot is found, unless downloading the latest alias key is explicitly allowed.
+
+Usage: alias_snapshot.py [--alias-key alias_key.json] [--output-dir data/alias_key]
+       Without --alias-key, the latest alias key is downloaded from pango-designation.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import urllib.request
+from datetime import datetime
+
+from pango_aliasor.aliasor import Aliasor
+
+ALIAS_KEY_URL = 'https://raw.githubusercontent.com/cov-lineages/pango-designation/master/pango_designation/alias_key.json'
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'alias_key')
+SNAPSHOT_PATTERN = re.compile(r'^alias_key_(?P<created>\d{4}-\d{2}-\d{2})_(?P<sha>[0-9a-f]{12})\.json$')
+
+
+def fetch_alias_key(alias_file=None):
+    """
+    Returns:
+    tuple: (raw alias key bytes, source) from alias_file, or downloaded from pango-designation.
+    """
+    if alias_file:
+        with open(alias_file, 'rb') as alias_key:
+            return alias_key.read(), os.path.abspath(alias_file)
+    with urllib.request.urlopen(ALIAS_KEY_URL) as response:
+        return response.read(), ALIAS_KEY_URL
+
+
+def build_snapshot(alias_file=None, output_dir=SNAPSHOT_DIR):
+    """
+    Write a snapshot of the alias key to output_dir.
+
+    Parameters:
+    alias_file (str): Local alias_key.json. The latest alias key is downloaded when not given.
+    output_dir (str): Directory of the snapshots.
+
+    Returns:
+    str: Path of the snapshot file. An existing snapshot with the same checksum is returned as is.
+    """
+    raw, _ = fetch_alias_key(alias_file)
+    # Fail before writing anything when the alias key is not valid JSON
+    json.loads(raw)
+    sha256 = hashlib.sha256(raw).hexdigest()
+
+    existing = glob.glob(os.path.join(output_dir, f'alias_key_*_{sha256[:12]}.json'))
+    if existing:
+        return sorted(existing)[0]
+
+    os.makedirs(output_dir, exist_ok=True)
+    snapshot_file = os.path.join(output_dir, f"alias_key_{datetime.now().strftime('%Y-%m-%d')}_{sha256[:12]}.json")
+    with open(snapshot_file, 'wb') as output:
+        output.write(raw)
+    return snapshot_file
+
+
+def latest_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    # Snapshot names start with their creation date, so the last one in name order is the latest
+    snapshots = sorted(path for path in glob.glob(os.path.join(snapshot_dir, 'alias_key_*.json'))
+                       if SNAPSHOT_PATTERN.match(os.path.basename(path)))
+    return snapshots[-1] if snapshots else None
+
+
+def load_snapshot(snapshot_file):
+    """
+    Create an Aliasor from a snapshot.
+
+    The checksum of the file is checked against the one in its name, so an edited snapshot is not used silently.
+
+    Returns:
+    tuple: (Aliasor, version info dict with 'version', 'created', 'source', 'sha256' and 'snapshot')
+    """
+    match = SNAPSHOT_PATTERN.match(os.path.basename(snapshot_file))
+    if match is None:
+        raise ValueError(f"{snapshot_file} is not named like an alias key snapshot (alias_key_<date>_<sha256>.json)")
+    with open(snapshot_file, 'rb') as snapshot:
+        sha256 = hashlib.sha256(snapshot.read()).hexdigest()
+    if not sha256.startswith(match.group('sha')):
+        raise ValueError(f"The checksum of {snapshot_file} does not match its name, the snapshot was modified")
+
+    info = {
+        'version': f"{match.group('created')}_{match.group('sha')}",
+        'created': match.group('created'),
+        'source': os.path.abspath(snapshot_file),
+        'sha256': sha256,
+        'snapshot': os.path.abspath(snapshot_file),
+    }
+    return Aliasor(alias_file=snapshot_file), info
+
+
+def load_aliasor(alias_file=None, snapshot_file=None, snapshot_dir=SNAPSHOT_DIR, allow_download=False):
+    """
+    Create the Aliasor of a run and describe the alias key it uses.
+
+    In order of preference: the alias_file alias key, the snapshot_file snapshot and the latest snapshot of
+    snapshot_dir. The latest alias key is only downloaded when no snapshot exists and allow_download is set.
+
+    Returns:
+    tuple: (Aliasor, version info dict)
+
+    Raises:
+    FileNotFoundError: When there is no snapshot and allow_download is not set.
+    """
+    if alias_file:
+        with open(alias_file, 'rb') as alias_key:
+            sha256 = hashlib.sha256(alias_key.read()).hexdigest()
+        return Aliasor(alias_file), {'version': f'file_{sha256[:12]}', 'source': os.path.abspath(alias_file),
+                                     'sha256': sha256}
+
+    snapshot_file = snapshot_file or latest_snapshot(snapshot_dir)
+    if snapshot_file:
+        return load_snapshot(snapshot_file)
+
+    if not allow_download:
+        raise FileNotFoundError(f"No alias key snapshot found in {snapshot_dir}. Run utils/alias_snapshot.py to "
+                                f"create one, or allow downloading the latest alias key with --allow-download.")
+    print(f"WARNING: No alias key snapshot found in {snapshot_dir}, downloading the latest alias key.")
+    return Aliasor(), {'version': 'latest_download', 'source': ALIAS_KEY_URL,
+                       'downloaded': datetime.now().isoformat(timespec='seconds')}
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Create a versioned snapshot of the Pango alias key.')
+    parser.add_argument('--alias-key', default=None, help='Local alias_key.json instead of downloading the latest')
+    parser.add_argument('--output-dir', default=SNAPSHOT_DIR, help='Directory of the snapshots (default: data/alias_key)')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_arguments(args)
+    snapshot_file = build_snapshot(args.alias_key, args.output_dir)
+    aliasor, info = load_snapshot(snapshot_file)
+    print(f"Alias key snapshot {info['version']} with {len(aliasor.alias_dict)} aliases: {snapshot_file}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
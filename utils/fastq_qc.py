@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Pre-QC of gzipped FASTQ files before the viralrecon analysis.
+
+A sample was considered failed when its .fastq.gz was smaller than 1MB, which depends on the compression ratio
+and lets near-empty libraries through. Each FASTQ file is instead streamed through gzip (nothing is decompressed
+to disk) in a process pool, counting its reads, bases and the sum of its base qualities. The R1 and R2 counts are
+combined per sample and a sample fails when it has fewer than --min-reads read pairs, a mean base quality under
+--min-mean-quality, R1 and R2 files with different read counts, or a file that cannot be read.
+
+stage_fastqs.py --qc uses this to route failed samples to failed_samples/ and writes the per-sample QC table to
+'<run_name>_fastq_qc.csv' in the analysis directory.
+
+Usage: fastq_qc.py <fastq_dir or FASTQ files ...> [--output fastq_qc.csv] [--workers 4] [--min-reads 10000]
+                   [--min-mean-quality 20]
+"""
+
+import argparse
+import csv
+import gzip
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from stage_fastqs import parse_fastq_name
+
+MIN_READS = 10000
+MIN_MEAN_QUALITY = 20
+PHRED_OFFSET = 33
+
+# Decompressed bytes processed at a time by fastq_stats
+BLOCK_SIZE = 4 * 1024 * 1024
+
+QC_COLUMNS = ['sample', 'r1_file', 'r2_file', 'reads_r1', 'reads_r2', 'bases', 'mean_quality', 'status', 'reason']
+
+
+def _count_records(lines):
+    # Counts of complete 4-line records: (reads, bases, quality sum, whether every header starts with '@')
+    qualities = b''.join(lines[3::4])
+    return (len(lines) // 4, sum(map(len, lines[1::4])), sum(qualities) - PHRED_OFFSET * len(qualities),
+            all(header.startswith(b'@') for header in lines[0::4]))
+
+
+def fastq_stats(path, block_size=BLOCK_SIZE):
+    """
+    Stream a gzipped FASTQ file and count its reads, bases and base qualities.
+
+    The file is decompressed block by block and each block is split into lines at once, so only one block and
+    the incomplete record at its end are held in memory.
+
+    Parameters:
+    path (str): Path to a .fastq.gz file.
+    block_size (int): Number of decompressed bytes read at a time.
+
+    Returns:
+    dict: 'file', 'reads', 'bases', 'quality_sum' (sum of the Phred scores), 'compressed_bytes' and 'error'
+    (None, or the reason the file could not be read completely).
+    """
+    reads = bases = quality_sum = 0
+    error = None
+    remainder = b''
+    try:
+        with gzip.open(path, 'rb') as fastq:
+            while error is None:
+                block = fastq.read(block_size)
+                if not block:
+                    break
+                lines = (remainder + block.replace(b'\r', b'')).split(b'\n')
+                # Keep the lines of the last, incomplete record for the next block
+                n_complete = (len(lines) - 1) // 4 * 4
+                remainder = b'\n'.join(lines[n_complete:])
+                block_reads, block_bases, block_quality, well_formed = _count_records(lines[:n_complete])
+                reads += block_reads
+                bases += block_bases
+                quality_sum += block_quality
+                if not well_formed:
+                    error = f'malformed record after read {reads - block_reads}'
+    except (OSError, EOFError) as exception:
+        # Truncated or corrupt gzip stream
+        error = str(exception) or type(exception).__name__
+
+    # A last record without a trailing newline, or an incomplete one
+    lines = remainder.split(b'\n') if remainder.strip() else []
+    if error is None and lines:
+        if len(lines) == 4:
+            block_reads, block_bases, block_quality, well_formed = _count_records(lines)
+            reads, bases, quality_sum = reads + 1, bases + block_bases, quality_sum + block_quality
+            if not well_formed:
+                error = f'malformed record after read {reads - 1}'
+        else:
+            error = f'incomplete record after read {reads}'
+    return {'file': path, 'reads': reads, 'bases': bases, 'quality_sum': quality_sum,
+            'compressed_bytes': os.path.getsize(path), 'error': error}
+
+
+def qc_files(paths, workers=4):
+    """
+    Compute fastq_stats for every file in a process pool.
+
+    Returns:
+    dict: Stats keyed by path.
+    """
+    paths = list(paths)
+    if workers <= 1 or len(paths) <= 1:
+        return {path: fastq_stats(path) for path in paths}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(paths, executor.map(fastq_stats, paths)))
+
+
+def sample_qc(sample, read_files, stats, min_reads=MIN_READS, min_mean_quality=MIN_MEAN_QUALITY):
+    """
+    Combine the file stats of one sample and decide whether it passes.
+
+    Parameters:
+    sample (str): Sample ID.
+    read_files (dict): FASTQ path keyed by read ('R1', 'R2').
+    stats (dict): fastq_stats results keyed by path.
+    min_reads (int): Minimum number of reads (read pairs for paired samples).
+    min_mean_quality (float): Minimum mean Phred base quality.
+
+    Returns:
+    dict: QC table row with QC_COLUMNS.
+    """
+    r1, r2 = stats.get(read_files.get('R1')), stats.get(read_files.get('R2'))
+    files = [file_stats for file_stats in (r1, r2) if file_stats]
+    bases = sum(file_stats['bases'] for file_stats in files)
+    quality_sum = sum(file_stats['quality_sum'] for file_stats in files)
+    reads = min(file_stats['reads'] for file_stats in files) if files else 0
+    mean_quality = quality_sum / bases if bases else 0.0
+
+    reasons = [f"{os.path.basename(file_stats['file'])}: {file_stats['error']}" for file_stats in files if file_stats['error']]
+    if r1 is None:
+        reasons.append('no R1 file')
+    if r1 and r2 and r1['reads'] != r2['reads']:
+        reasons.append(f"R1 and R2 read counts differ ({r1['reads']} / {r2['reads']})")
+    if reads < min_reads:
+        reasons.append(f'{reads} reads < {min_reads}')
+    if mean_quality < min_mean_quality:
+        reasons.append(f'mean quality {mean_quality:.1f} < {min_mean_quality}')
+
+    return {
+        'sample': sample,
+        'r1_file': os.path.basename(r1['file']) if r1 else '',
+        'r2_file': os.path.basename(r2['file']) if r2 else '',
+        'reads_r1': r1['reads'] if r1 else 0,
+        'reads_r2': r2['reads'] if r2 else 0,
+        'bases': bases,
+        'mean_quality': round(mean_quality, 2),
+        'status': 'fail' if reasons else 'pass',
+        'reason': '; '.join(reasons),
+    }
+
+
+def qc_samples(sample_files, workers=4, min_reads=MIN_READS, min_mean_quality=MIN_MEAN_QUALITY):
+    """
+    Pre-QC several samples, streaming all their FASTQ files in one process pool.
+
+    Parameters:
+    sample_files (dict): For each sample ID, its FASTQ paths keyed by read ('R1', 'R2').
+
+    Returns:
+    list: QC table rows, sorted by sample ID.
+    """
+    stats = qc_files([path for read_files in sample_files.values() for path in read_files.values()], workers)
+    return [sample_qc(sample, read_files, stats, min_reads, min_mean_quality)
+            for sample, read_files in sorted(sample_files.items())]
+
+
+def write_qc_table(rows, output_file):
+    with open(output_file, 'w', newline='') as output:
+        writer = csv.DictWriter(output, fieldnames=QC_COLUMNS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+    return output_file
+
+
+def find_sample_files(inputs):
+    """
+    Group FASTQ files (or the *.fastq.gz files of directories) by sample ID and read.
+    """
+    sample_files = {}
+    for path in inputs:
+        if os.path.isdir(path):
+            paths = [entry.path for entry in os.scandir(path) if entry.name.endswith('.fastq.gz') and entry.is_file()]
+        else:
+            paths = [path]
+        for fastq in sorted(paths):
+            parsed = parse_fastq_name(os.path.basename(fastq))
+            if parsed is not None:
+                sample, read = parsed
+                sample_files.setdefault(sample, {})[read] = fastq
+    return sample_files
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Stream gzipped FASTQ files and write a per-sample QC table.')
+    parser.add_argument('inputs', nargs='+', help='FASTQ files or directories with *.fastq.gz files')
+    parser.add_argument('--output', default='fastq_qc.csv', help='Per-sample QC table')
+    parser.add_argument('--workers', type=int, default=4, help='Number of files streamed in parallel processes')
+    parser.add_argument('--min-reads', type=int, default=MIN_READS, help='Minimum number of reads (read pairs) per sample')
+    parser.add_argument('--min-mean-quality', type=float, default=MIN_MEAN_QUALITY, help='Minimum mean Phred base quality')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_arguments(args)
+    rows = qc_samples(find_sample_files(args.inputs), args.workers, args.min_reads, args.min_mean_quality)
+    write_qc_table(rows, args.output)
+    failed = [row['sample'] for row in rows if row['status'] == 'fail']
+    print(f"{len(rows) - len(failed)} of {len(rows)} samples passed the FASTQ pre-QC, table written to {args.output}")
+    if failed:
+        print(f"Failed samples: {', '.join(failed)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,138 +1,136 @@
-# Import required packages
-import pandas as pd
-import re
-import os
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Render one lineage abundance pie chart per sample from Freyja '*lineages_aggregate.tsv' files.
+
+The aggregate is parsed with the columnar parser from utils.py, a stable lineage -> color map is built once per
+dataset so a lineage keeps the same color in every chart, and samples are rendered in batches over a process
+pool. Each worker reuses a single figure with the non-interactive Agg backend.
+
+Usage: freyja_abundance_piechart.py [aggregate_dir] [--output-prefix freyja_sublin_pie_] [--summarized] [--workers N]
+"""
+
+import argparse
+import ast
 import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg')  # Render to files only, no display needed
 import matplotlib.pyplot as plt
+import pandas as pd
 
-# Function to prepare lineage dictionary
-def prepLineageDict(agg_d0):
-    # Split the 'lineages' and 'abundances' fields by spaces
-    agg_d0.loc[:, 'lineages'] = agg_d0['lineages'].apply(lambda x: re.sub(' +', ' ', x).split(' ')).copy()
-    agg_d0.loc[:, 'abundances'] = agg_d0['abundances'].apply(lambda x: re.sub(' +', ' ', x).split(' ')).copy()
-
-    # Create 'linDict' column with mapped lineages and abundances values
-    agg_d0.loc[:, 'linDict'] = [
-        {lin: float(abund) for lin, abund in zip(agg_d0.loc[samp, 'lineages'], agg_d0.loc[samp, 'abundances'])}
-        for samp in agg_d0.index
-    ]
-
-    return agg_d0  # Return the updated DataFrame
-
-def makePieCharts_simple(agg_df, lineages, outputFnBase, config, lineage_info=None):
-    # Prepare the lineage dictionary if lineages is given
-    if lineages:
-        queryType = 'linDict'
-        config = config.get('Lineages')
-        agg_df = prepLineageDict(agg_df, config=config, lineage_info=lineage_info)
-    else:
-        queryType = 'summarized'
-        config = config.get('VOC')
-        agg_df = prepSummaryDict(agg_df)
-
-    # Loop over all samples in the DataFrame
-    for i, sampLabel in enumerate(agg_df.index):
-        # Extract the lineage dictionary for the current sample
-        dat = agg_df.loc[sampLabel, queryType]
-        if isinstance(dat, list):
-            loc = pd.Series(dat[0])
-        else:
-            loc = pd.Series(dat)
-
-        # Create the pie chart
-        fig, ax = plt.subplots()
-        ax.pie(loc, labels=loc.index, autopct='%1.1f%%', startangle=90)
-        ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+from utils import parse_lineage_aggregate
 
-        # Use the sample name in the filename and the title
-        plt.title(sampLabel)
-        plt.savefig(outputFnBase + sampLabel + '.png')
-        plt.close()
+# Qualitative palettes combined to give 60 distinguishable colors before they repeat
+PALETTES = ['tab20', 'tab20b', 'tab20c']
 
-import matplotlib.pyplot as plt
 
-def makePieCharts_simple(agg_df, lineages, outputFnBase, config, lineage_info=None):
-    # Prepare the lineage dictionary if lineages is given
-    if lineages:
-        queryType = 'linDict'
-        config = config.get('Lineages')
-        agg_df = prepLineageDict(agg_df, config=config, lineage_info=lineage_info)
-    else:
-        queryType = 'summarized'
-        config = config.get('VOC')
-        agg_df = prepSummaryDict(agg_df)
-
-    # Default color scheme
-    default_cmap_dict = {
-        24: px.colors.qualitative.Dark24
-    }
-
-    # Loop over all samples in the DataFrame
-    for i, sampLabel in enumerate(agg_df.index):
-        # Extract the lineage dictionary for the current sample
-        dat = agg_df.loc[sampLabel, queryType]
-        if isinstance(dat, list):
-            loc = pd.Series(dat[0])
-        else:
-            loc = pd.Series(dat)
-
-        # Create color scheme for the pie chart
-        cmap_dict = get_color_scheme(loc.to_frame().T, default_cmap_dict, config)
-
-        # Map colors to labels
-        pie_colors = [cmap_dict[label] for label in loc.index]
-
-        # Create the pie chart
-        fig, ax = plt.subplots()
-        ax.pie(loc, labels=loc.index, colors=pie_colors, autopct='%1.1f%%', startangle=90)
-        ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+def build_color_map(labels):
+    """
+    Assign a fixed color to every lineage (or summarized group) of a dataset.
+
+    Labels are sorted before colors are assigned, so the mapping only depends on the set of labels.
+
+    Parameters:
+    labels (iterable): Lineage names appearing in the dataset.
+
+    Returns:
+    dict: Color keyed by label.
+    """
+    colors = [color for palette in PALETTES for color in plt.get_cmap(palette).colors]
+    return {label: colors[i % len(colors)] for i, label in enumerate(sorted(set(labels)))}
 
-        # Use the sample name in the filename and the title
-        plt.title(f'{sampLabel}_Variant Prevalence')
-        plt.savefig(outputFnBase + sampLabel + '_Variant Prevalence.png')
-        plt.close()
-
-# 3rd Iteration
-def makePieCharts_simple(agg_df, lineages, outputFn, config, lineage_info):
-    if lineages:
-        queryType = 'linDict'
-        config = config.get('Lineages')
-        agg_df = prepLineageDict(agg_df, config=config,
-                                 lineage_info=lineage_info)
-
-    else:
-        queryType = 'summarized'
-        config = config.get('VOC')
-        agg_df = prepSummaryDict(agg_df)
-
-    # Make piechart for each sample in the aggregated dataset
-    for i, sampLabel in enumerate(agg_df.index):
-        plt.figure(figsize=(10, 8))
-        dat = agg_df.loc[sampLabel, queryType]
-        if isinstance(dat, list):
-            dat = dat[0]
-        # Pie chart
-        labels = list(dat.keys())
-        sizes = list(dat.values())
-
-        default_colors = px.colors.qualitative.Dark24
-        color_scheme = get_color_scheme(pd.DataFrame([dat]), {len(default_colors): default_colors}, config)
-        colors = [color_scheme[label] for label in labels]
-        
-        plt.pie(sizes, labels=labels, autopct='%1.1f%%', colors=colors)
-        plt.title(f"{sampLabel}_Variant Prevalence", fontdict={'fontsize': 20})
-        outputFn_base, _ = os.path.splitext(outputFn)
-        plt.savefig(outputFn_base + f"_{sampLabel}_PieChart.png")
-        plt.close()
-
-
-# Gather all '*lineages_aggregate.tsv' files in the current directory
-source_files = glob.glob('*lineages_aggregate.tsv')
-for file in source_files:
-    print(file)
-    # Read the current file into a DataFrame
-    df = pd.read_csv(file, sep="\t", index_col=0)
-    # Create pie charts for each sample in the DataFrame
-    makePieCharts_simple(df, 'lineages', 'freyja_sublin_pie_')
 
+def parse_summarized(agg_df, sample_col='sample_id'):
+    """
+    Convert the 'summarized' column of a Freyja aggregate table, e.g. "[('Omicron', 0.95), ('Other', 0.05)]",
+    into a long DataFrame with 'sample_id', 'lineage' and 'abundance' columns.
+    """
+    summarized = agg_df.dropna(subset=['summarized'])
+    pairs = [(sample, lineage, abundance)
+             for sample, summary in zip(summarized[sample_col], summarized['summarized'])
+             for lineage, abundance in ast.literal_eval(summary)]
+    return pd.DataFrame(pairs, columns=['sample_id', 'lineage', 'abundance'])
 
+
+def read_aggregate(agg_file):
+    return pd.read_csv(agg_file, sep='\t', names=['sample_id', 'summarized', 'lineages', 'abundances', 'resid', 'coverage'],
+                       skiprows=1)
+
+
+def _render_batch(batch, color_map, output_base, figsize=(10, 8)):
+    # Render a batch of (sample, labels, sizes) on one reused figure
+    fig, ax = plt.subplots(figsize=figsize)
+    paths = []
+    for sample, labels, sizes in batch:
+        ax.clear()
+        ax.pie(sizes, labels=labels, colors=[color_map[label] for label in labels], autopct='%1.1f%%', startangle=90)
+        ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+        ax.set_title(f"{sample}_Variant Prevalence", fontdict={'fontsize': 20})
+        path = f"{output_base}{sample}.png"
+        fig.savefig(path)
+        paths.append(path)
+    plt.close(fig)
+    return paths
+
+
+def render_pie_charts(long_df, output_base, workers=None, batch_size=16):
+    """
+    Render a pie chart per sample of a long lineage abundance DataFrame.
+
+    Parameters:
+    long_df (pd.DataFrame): Data with 'sample_id', 'lineage' and 'abundance' columns.
+    output_base (str): Prefix of the output PNG files, '<output_base><sample_id>.png'.
+    workers (int): Number of rendering processes. 1 renders in the current process.
+    batch_size (int): Number of samples rendered by a worker per task.
+
+    Returns:
+    list: Paths of the written charts.
+    """
+    color_map = build_color_map(long_df['lineage'])
+    samples = [(sample, group['lineage'].tolist(), group['abundance'].tolist())
+               for sample, group in long_df.groupby('sample_id', sort=False)]
+    batches = [samples[i:i + batch_size] for i in range(0, len(samples), batch_size)]
+
+    if workers == 1 or len(batches) <= 1:
+        return [path for batch in batches for path in _render_batch(batch, color_map, output_base)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_render_batch, batch, color_map, output_base) for batch in batches]
+        return [path for future in futures for path in future.result()]
+
+
+def makePieCharts_simple(agg_df, lineages, outputFnBase, workers=None):
+    # Lineage-level charts when lineages is set, otherwise charts of the Freyja summarized groups
+    long_df = parse_lineage_aggregate(agg_df) if lineages else parse_summarized(agg_df)
+    return render_pie_charts(long_df, outputFnBase, workers=workers)
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Make a lineage abundance pie chart for every sample of Freyja aggregate files.')
+    parser.add_argument('aggregate_dir', nargs='?', default='.', help='Directory with *lineages_aggregate.tsv files')
+    parser.add_argument('--output-prefix', default='freyja_sublin_pie_', help='Prefix of the output PNG files')
+    parser.add_argument('--summarized', action='store_true', help='Plot the Freyja summarized groups instead of lineages')
+    parser.add_argument('--workers', type=int, default=None, help='Number of rendering processes')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_arguments(args)
+
+    # Gather all '*lineages_aggregate.tsv' files in the aggregate directory
+    source_files = glob.glob(os.path.join(args.aggregate_dir, '*lineages_aggregate.tsv'))
+    for agg_file in source_files:
+        print(agg_file)
+        # Create pie charts for each sample in the file
+        paths = makePieCharts_simple(read_aggregate(agg_file), not args.summarized, args.output_prefix, args.workers)
+        print(f"{len(paths)} pie charts written")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import argparse
 import pandas as pd
 from io import StringIO
 import re
@@ -7,8 +8,11 @@ import json
 import sys
 #import requests
 import datetime
-from pango_aliasor.aliasor import Aliasor  # Import the Aliasor class
-from utils import (prepLineageDict, expand_data, get_parent_lineage, custom_parent, save_output)
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from alias_snapshot import load_aliasor
+from utils import (parse_lineage_aggregate, LineageClassifier, CachedAliasor, save_output)
+from instrumentation import RunMetrics, timed
+from freyja_demix_reader import list_demix_files, read_demix_dir, write_aggregate
 
 
 # Define constants for file paths and patterns
@@ -19,71 +23,124 @@ def load_lineage_mapping(filepath):
     with open(filepath, 'r') as file:
         return json.load(file)
 
-def main(run_name):
-    dirpath = os.path.join(WASTEWATER_SEQ_DIR, run_name, 'results')
-    os.chdir(dirpath)
-
-    source_files = glob.glob(os.path.join(dirpath, '*lineages_aggregate.tsv'))
-
-    if not source_files:
-        print("No lineage aggregate files found.")
-        return
-
-    for agg_file in source_files:
-        print(agg_file)
-
+@timed('read_aggregate')
+def read_aggregate(agg_file):
     # Read the tsv file
     agg_df = pd.read_csv(agg_file, sep='\t', names=['sample_id', 'summarized', 'lineages', 'abundances', 'resid', 'coverage'],skiprows=1)
 
     # Filter out rows with empty 'lineages' values
-    agg_df = agg_df.dropna(subset=['lineages'])
+    return agg_df.dropna(subset=['lineages'])
 
-    # Create lineage_dictionary containing lineages and corresponding abundances in 'linDict' column
-    processed_data = prepLineageDict(agg_df)
+def process_aggregate(agg_df, aliasor, classifier):
+    """
+    Convert a Freyja aggregate table into the long lineage DataFrame with aliasing and lineage groups.
 
-    # Convert the df to long dataframe with lineages, abundances and summarized_lineage columns for each sample
-    long_df = expand_data(processed_data)
+    Parameters:
+    agg_df (pd.DataFrame): Freyja '*lineages_aggregate.tsv' table with the empty 'lineages' rows removed.
+    aliasor (CachedAliasor): Aliasor used to uncompress lineages and find their parents.
+    classifier (LineageClassifier): Classifier built from the lineage mapping.
 
+    Returns:
+    pd.DataFrame: Long DataFrame with one row per lineage for each wastewater sample.
+    """
+    # Convert the lineages and abundances columns straight to a long dataframe with one row per lineage for each sample
+    return process_long_df(parse_lineage_aggregate(agg_df), aliasor, classifier)
 
-    # Clean 'sample_id'. Replace hyphens with underscores in sample_id column. This is an optional step.
-    long_df['sample_id'] = long_df['sample_id'].apply(lambda x: x.split('_out')[0])
-    long_df.loc[:, 'sample_id'] = long_df['sample_id'].apply(lambda x: x.replace("-", "_"))
-    
-    long_df.index.name = 'idx_name'
-    
-    # Reset the index to make 'idx_name' a regular column
-    long_df.reset_index(inplace=True)
+def process_long_df(long_df, aliasor, classifier):
+    """
+    Add aliasing and lineage groups to a long lineage DataFrame and remove the control samples.
 
-    # Create an Aliasor instance
-    aliasor = Aliasor()
+    Parameters:
+    long_df (pd.DataFrame): Long DataFrame with 'sample_id' (Freyja demix file name), 'lineage' and 'abundance'.
+    aliasor (CachedAliasor): Aliasor used to uncompress lineages and find their parents.
+    classifier (LineageClassifier): Classifier built from the lineage mapping.
+
+    Returns:
+    pd.DataFrame: Long DataFrame with one row per lineage for each wastewater sample.
+    """
+    # The lineage table keeps the same columns whatever the source, demix 'resid' and 'coverage' are left out
+    long_df = long_df[['sample_id', 'lineage', 'abundance']].copy()
+
+    # Clean 'sample_id'. Replace hyphens with underscores in sample_id column. This is an optional step.
+    long_df['sample_id'] = long_df['sample_id'].str.split('_out').str[0].str.replace('-', '_', regex=False)
 
     # Create a new column 'compress_lineages' with compressed lineage values using the aliasor package mapping
-    long_df['uncompress_lineage'] = long_df['lineage'].apply(lambda x: aliasor.uncompress(x))
-    # print(dict_df_matrix_melt_noNA['Uncompress_lineages'].head())  # Print the first few values of the 'Uncompress_lineages' column
+    long_df['uncompress_lineage'] = aliasor.uncompress_series(long_df['lineage'])
 
     # Create a new column 'Parent_lineage' with compressed parent lineage values using a custom helper function derived from aliasor package
-    long_df['parent_lineage'] = long_df['lineage'].apply(lambda x: custom_parent(aliasor, x))
-
-    # print(long_df['Parent_lineage'].tail(20))  # Print the last few values of the 'Parent_lineage' column
+    long_df['parent_lineage'] = aliasor.custom_parent_series(long_df['lineage'])
 
     # Exclude some rows from the 'sample_id' column that are not wastewater samples
     for prefix in ['CPC', 'Positive', 'NTC', 'Negative', 'EmptyLane']:
-        long_df = long_df[~long_df['sample_id'].str.startswith(prefix)]    
+        long_df = long_df[~long_df['sample_id'].str.startswith(prefix)]
 
-    #Add a Parent_lineage_grp column using custom 'get_parent_lineage' function'
+    # Map the unique Uncompressed lineages to their parent lineage grp to create a new 'summarized_lineage' column
+    long_df['summarized_lineage'] = classifier.classify_series(long_df['uncompress_lineage'])
+    return long_df
 
-    LINEAGE_MAPPING_FILE_PATH = os.path.join(DATA_DIR, 'lineage_mapping.json')
-    
-    lineage_mapping = load_lineage_mapping(LINEAGE_MAPPING_FILE_PATH)
+def process_run(run_name, aliasor, classifier, seq_dir=WASTEWATER_SEQ_DIR, from_demix=False, workers=8):
+    """
+    Process every '*lineages_aggregate.tsv' file of a run, or its per-sample Freyja demix outputs, and save the long
+    lineage table and lineage counts in the run's results directory. Stage metrics are written to
+    '<run_name>_lin_processing_metrics.json'.
+
+    Parameters:
+    run_name (str): Name of the sequencing run directory in seq_dir.
+    aliasor (CachedAliasor): Aliasor shared between runs.
+    classifier (LineageClassifier): Classifier shared between runs.
+    seq_dir (str): Directory with the wastewater sequencing runs.
+    from_demix (bool): Read the '*_lin_out.tsv' files of 'analysis/freyja/lineage_out' instead of the aggregate
+    files. The aggregate table is then written to the results directory from the demix outputs.
+    workers (int): Number of demix files read in parallel.
+
+    Returns:
+    int: Number of rows in the long lineage table, or None when the run has no input file.
+    """
+    dirpath = os.path.join(seq_dir, run_name, 'results')
+
+    if from_demix:
+        lineage_out_dir = os.path.join(seq_dir, run_name, 'analysis', 'freyja', 'lineage_out')
+        source_files = list_demix_files(lineage_out_dir)
+    else:
+        source_files = sorted(glob.glob(os.path.join(dirpath, '*lineages_aggregate.tsv')))
+
+    if not source_files:
+        print(f"No {'Freyja demix' if from_demix else 'lineage aggregate'} files found for {run_name}.")
+        return None
 
-    # Get the unique lineages in the 'Parent_lineage' column
-    unique_lineages = long_df['uncompress_lineage'].unique()
+    metrics_file = os.path.join(dirpath, f'{run_name}_lin_processing_metrics.json')
+    sources = {'demix_dir': lineage_out_dir} if from_demix else {'aggregate_files': source_files}
+    # The alias key version is recorded with the metrics so every output can be traced to the alias table used
+    with RunMetrics('freyja_custom_lin_processing', metrics_file, run_name=run_name,
+                    alias_key=getattr(aliasor, 'alias_key', None), **sources):
+        if from_demix:
+            long_df = _read_demix_run(run_name, lineage_out_dir, dirpath, aliasor, classifier, workers)
+        else:
+            long_df = pd.concat([_read_aggregate_file(agg_file, aliasor, classifier) for agg_file in source_files],
+                                ignore_index=True)
+        return _save_run(run_name, long_df, dirpath)
 
-    # Map the unique Uncompressed lineages to their parent lineage grp using the 'get_parent_lineage()' function
-    parent_lineage_grp_mapping = {parent_lineage: get_parent_lineage(parent_lineage, lineage_mapping) for parent_lineage in unique_lineages}
+def _read_aggregate_file(agg_file, aliasor, classifier):
+    print(agg_file)
+    return process_aggregate(read_aggregate(agg_file), aliasor, classifier)
 
-    # Apply the mapping to the 'Parent_lineage' column to create a new 'Parent_lineage_grp' column
-    long_df['summarized_lineage'] = long_df['uncompress_lineage'].map(parent_lineage_grp_mapping)
+def _read_demix_run(run_name, lineage_out_dir, dirpath, aliasor, classifier, workers=8):
+    demix_df, records, empty = read_demix_dir(lineage_out_dir, workers=workers)
+    print(f"{len(records)} Freyja demix files read from {lineage_out_dir}")
+    if empty:
+        print(f"Demix files without lineages: {', '.join(empty)}")
+
+    # Keep the aggregate table in the results directory for the pie charts and the run archive
+    os.makedirs(dirpath, exist_ok=True)
+    write_aggregate(records, os.path.join(dirpath, f'{run_name}_lineages_aggregate.tsv'))
+    return process_long_df(demix_df, aliasor, classifier)
+
+def _save_run(run_name, long_df, dirpath):
+    long_df = long_df.reset_index(drop=True)
+    long_df.index.name = 'idx_name'
+
+    # Reset the index to make 'idx_name' a regular column
+    long_df.reset_index(inplace=True)
 
     # Save output #csv format in the run directory
 
@@ -98,8 +155,128 @@ def main(run_name):
 
     #unique_lineage_mapping = long_df[['uncompress_lineage', 'summarized_lineage']].drop_duplicates()
     #save_output(unique_lineage_mapping, dirpath, f'{run_name}_unique_lineage_mapping.csv')
+    return long_df.shape[0]
+
+def resolve_runs(run_patterns, seq_dir=WASTEWATER_SEQ_DIR):
+    """
+    Expand run names and glob patterns (e.g. 'UT-VH00770-2403*') over the sequencing directory.
+
+    Returns:
+    list: Sorted, de-duplicated run names with a 'results' directory.
+    """
+    runs = set()
+    for pattern in run_patterns:
+        for run_dir in glob.glob(os.path.join(seq_dir, pattern)):
+            if os.path.isdir(os.path.join(run_dir, 'results')):
+                runs.add(os.path.basename(os.path.normpath(run_dir)))
+    return sorted(runs)
+
+def load_shared_helpers(alias_file=None, mapping_file=None, snapshot_file=None, allow_download=False):
+    """
+    Build the aliasor and lineage classifier once, to be shared by every processed run.
+
+    Parameters:
+    alias_file (str): Local Pango alias key JSON. The latest snapshot of data/alias_key is used when not given.
+    mapping_file (str): Lineage mapping JSON, data/lineage_mapping.json by default.
+    snapshot_file (str): Alias key snapshot written by alias_snapshot.py, instead of the latest one.
+    allow_download (bool): Download the latest alias key when there is no snapshot, instead of failing.
+
+    Returns:
+    tuple: (CachedAliasor, LineageClassifier)
+    """
+    # Create an Aliasor instance wrapped in a cache so each unique lineage is only aliased once
+    aliasor, alias_key = load_aliasor(alias_file, snapshot_file, allow_download=allow_download)
+    print(f"Pango alias key: {alias_key['version']} ({alias_key['source']})")
+    aliasor = CachedAliasor(aliasor, alias_key=alias_key)
+
+    #Add a Parent_lineage_grp column using the custom 'LineageClassifier' built from the lineage mapping'
+    classifier = LineageClassifier.from_json(mapping_file or os.path.join(DATA_DIR, 'lineage_mapping.json'))
+    return aliasor, classifier
+
+# Aliasor and classifier of a process_runs worker process, set once by _init_worker
+_worker_helpers = None
+
+def _init_worker(aliasor, alias_key, classifier):
+    global _worker_helpers
+    # Every worker process keeps its own alias caches
+    _worker_helpers = CachedAliasor(aliasor, alias_key=alias_key), classifier
+
+def _process_run_in_worker(run_name, seq_dir, from_demix):
+    aliasor, classifier = _worker_helpers
+    return process_run(run_name, aliasor, classifier, seq_dir, from_demix)
+
+def process_runs(run_names, seq_dir=WASTEWATER_SEQ_DIR, workers=4, alias_file=None, mapping_file=None, from_demix=False,
+                 snapshot_file=None, allow_download=False):
+    """
+    Process several runs in parallel processes sharing one alias key, lineage mapping and classifier.
+
+    Parsing, aliasing and classifying lineages is Python code holding the GIL, so the runs are spread over worker
+    processes rather than threads. The aliasor and classifier are built once here and copied to every worker when
+    it starts; each worker then caches the lineages it aliases.
+
+    Returns:
+    dict: Number of rows written keyed by run name (None for runs without aggregate files or that failed).
+    """
+    aliasor, classifier = load_shared_helpers(alias_file, mapping_file, snapshot_file, allow_download)
+    results = {}
+    if workers <= 1 or len(run_names) <= 1:
+        for run_name in run_names:
+            try:
+                results[run_name] = process_run(run_name, aliasor, classifier, seq_dir, from_demix)
+            except Exception as error:
+                print(f"Processing {run_name} failed: {error}")
+                results[run_name] = None
+        print(f"Aliasor cache statistics: {aliasor.cache_info()}")
+        return results
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(run_names)), initializer=_init_worker,
+                             initargs=(aliasor.aliasor, aliasor.alias_key, classifier)) as executor:
+        futures = {executor.submit(_process_run_in_worker, run_name, seq_dir, from_demix): run_name
+                   for run_name in run_names}
+        for future in as_completed(futures):
+            run_name = futures[future]
+            try:
+                results[run_name] = future.result()
+            except Exception as error:
+                print(f"Processing {run_name} failed: {error}")
+                results[run_name] = None
+    return results
+
+def main(run_name, seq_dir=WASTEWATER_SEQ_DIR, alias_file=None, mapping_file=None):
+    aliasor, classifier = load_shared_helpers(alias_file, mapping_file)
+    process_run(run_name, aliasor, classifier, seq_dir)
+    print(f"Aliasor cache statistics: {aliasor.cache_info()}")
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Convert Freyja lineage aggregate files of one or more runs into long lineage tables.')
+    parser.add_argument('runs', nargs='+', help='Run names or glob patterns over the wastewater sequencing directory')
+    parser.add_argument('--seq-dir', default=WASTEWATER_SEQ_DIR, help='Directory with the wastewater sequencing runs')
+    parser.add_argument('--workers', type=int, default=4, help='Number of runs processed in parallel processes')
+    parser.add_argument('--alias-key', default=None, help='Local Pango alias key JSON instead of the alias key snapshot')
+    parser.add_argument('--alias-snapshot', default=None,
+                        help='Alias key snapshot written by alias_snapshot.py (default: the latest one in data/alias_key)')
+    parser.add_argument('--allow-download', action='store_true',
+                        help='Download the latest alias key when data/alias_key has no snapshot, instead of failing')
+    parser.add_argument('--lineage-mapping', default=None, help='Lineage mapping JSON (default: data/lineage_mapping.json)')
+    parser.add_argument('--from-demix', action='store_true',
+                        help="Read the per-sample '*_lin_out.tsv' files of analysis/freyja/lineage_out instead of the aggregate files")
+    return parser.parse_args(args)
 
 
 if __name__ == "__main__":
-    run_name = sys.argv[1]
-    main(run_name)
+    args = parse_arguments()
+    run_names = resolve_runs(args.runs, args.seq_dir)
+    if not run_names:
+        print("No runs matched.")
+        sys.exit(1)
+    try:
+        results = process_runs(run_names, args.seq_dir, args.workers, args.alias_key, args.lineage_mapping,
+                               args.from_demix, args.alias_snapshot, args.allow_download)
+    except FileNotFoundError as error:
+        print(error)
+        sys.exit(1)
+    failed = [run_name for run_name, n_rows in results.items() if n_rows is None]
+    print(f"Processed {len(results) - len(failed)} of {len(results)} runs.")
+    if failed:
+        print(f"Runs without output: {', '.join(sorted(failed))}")
+        sys.exit(1)
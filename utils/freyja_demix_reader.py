@@ -0,0 +1,109 @@
+"""
+Reader for the per-sample Freyja demix outputs ('*_lin_out.tsv').
+
+Each demix file is a two column TSV keyed by field name ('summarized', 'lineages', 'abundances', 'resid',
+'coverage'). The files of a run are parsed concurrently by a thread pool and turned straight into the long
+(sample_id, lineage, abundance, resid, coverage) frame, so 'freyja aggregate' does not have to be run in the
+container and its space-joined output does not have to be split again. The sample_id is the demix file name,
+as in the 'freyja aggregate' output.
+"""
+
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from instrumentation import timed
+
+DEMIX_PATTERN = '*_lin_out.tsv'
+AGGREGATE_FIELDS = ['summarized', 'lineages', 'abundances', 'resid', 'coverage']
+LONG_COLUMNS = ['sample_id', 'lineage', 'abundance', 'resid', 'coverage']
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_demix_file(path):
+    """
+    Parse one Freyja demix output file.
+
+    Parameters:
+    path (str): Path to a '*_lin_out.tsv' file.
+
+    Returns:
+    dict: 'sample_id' (the file name) and the raw string value of every field of the file.
+    """
+    record = {'sample_id': os.path.basename(path)}
+    with open(path) as demix:
+        for line in demix:
+            field, _, value = line.rstrip('\n').partition('\t')
+            # The first line only holds the file name in its second column
+            if field:
+                record[field.strip()] = value.strip()
+    return record
+
+
+def record_to_long(record):
+    """
+    Convert a demix record to long rows, pairing lineages and abundances like zip(). A lineage repeated within
+    the sample keeps its last abundance, as in parse_lineage_aggregate.
+
+    Returns:
+    list: (sample_id, lineage, abundance, resid, coverage) tuples.
+    """
+    lineages = record.get('lineages', '').split()
+    abundances = record.get('abundances', '').split()
+    pairs = dict(zip(lineages, (float(abundance) for abundance in abundances)))
+    resid = _to_float(record.get('resid'))
+    coverage = _to_float(record.get('coverage'))
+    return [(record['sample_id'], lineage, abundance, resid, coverage) for lineage, abundance in pairs.items()]
+
+
+def _read_long(path):
+    record = read_demix_file(path)
+    return record, record_to_long(record)
+
+
+def list_demix_files(lineage_out_dir, pattern=DEMIX_PATTERN):
+    return sorted(glob.glob(os.path.join(lineage_out_dir, pattern)))
+
+
+@timed('read_demix_dir')
+def read_demix_dir(lineage_out_dir, pattern=DEMIX_PATTERN, workers=8):
+    """
+    Read every demix output of a run directory with a thread pool.
+
+    Parameters:
+    lineage_out_dir (str): Freyja 'lineage_out' directory of the run.
+    pattern (str): Glob pattern of the demix output files.
+    workers (int): Number of files read in parallel.
+
+    Returns:
+    tuple: The long DataFrame with LONG_COLUMNS (files in name order), the list of demix records, and the names
+    of the files without any lineage (e.g. failed demix).
+    """
+    paths = list_demix_files(lineage_out_dir, pattern)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_read_long, paths))
+
+    records = [record for record, _ in results]
+    empty = [record['sample_id'] for record, rows in results if not rows]
+    long_df = pd.DataFrame([row for _, rows in results for row in rows], columns=LONG_COLUMNS)
+    long_df['abundance'] = long_df['abundance'].astype(float)
+    return long_df, records, empty
+
+
+def write_aggregate(records, output_file):
+    """
+    Write the records in the 'freyja aggregate' TSV format, for the tools reading '*lineages_aggregate.tsv'.
+    """
+    rows = [dict(record, **{field: record.get(field, '') for field in AGGREGATE_FIELDS}) for record in records]
+    aggregate = pd.DataFrame(rows, columns=['sample_id'] + AGGREGATE_FIELDS).set_index('sample_id')
+    aggregate.index.name = None
+    aggregate.to_csv(output_file, sep='\t')
+    return output_file
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Run the Freyja variants and demix steps for every sample of a sequencing run on a bounded worker pool.
+
+This is the parallel counterpart of the per-sample loop in run_freyja.sh. Samples below the genome coverage
+threshold are skipped, every other sample runs 'freyja variants' followed by 'freyja demix', and the outcome
+of each sample is appended to logs/freyja_demix_status.txt with the same messages as the bash script.
+
+Samples are taken from the manifest written by sample_qc.py, either passed with --manifest or built on the fly
+from the MultiQC variants metrics table of the run.
+
+The Freyja command defaults to the staphb singularity image and can be replaced by any executable taking the
+same arguments, e.g. a stub script when testing locally.
+
+Runs are resumable: a cache manifest in the Freyja working directory records, for every processed sample, a
+fingerprint of its BAM (checksum, size and mtime), the reference FASTA, the Freyja and barcode versions and the
+demix options. Re-running a run only executes Freyja for samples whose inputs or tool versions changed and
+reuses the existing '*_out_variants.tsv'/'*_lin_out.tsv' files otherwise.
+
+run_freyja.sh runs this script for every run and only falls back to its serial loop when called with --serial.
+
+Usage: freyja_scheduler.py <run_name> [--workers N] [--threads-per-job N] [--freyja-cmd CMD] [--status-file FILE]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from sample_qc import SampleQCIndex, read_manifest, write_manifest
+
+# Define constants for file paths and defaults
+WASTEWATER_SEQ_DIR = '/Volumes/NGS_2/wastewater_sequencing'
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REFERENCE_FASTA = os.path.join(SCRIPT_DIR, 'data', 'MN908947.3.fasta')
+DEFAULT_FREYJA_CMD = 'singularity exec --bind {analysis_dir} staphb-freyja-latest.simg freyja'
+COVERAGE_THRESHOLD = 40  # Set 40% as the threshold
+DEMIX_OPTIONS = ['--eps', '0.01', '--covcut', '10', '--confirmedonly']
+CACHE_MANIFEST = 'freyja_cache_manifest.json'
+
+# Environment variables used to cap the threads of the numerical libraries behind the demix solver
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']
+
+
+class StatusFile:
+    """
+    Thread-safe writer for the freyja_demix_status.txt file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, message, timestamp=True):
+        if timestamp:
+            message = f"{datetime.now().strftime('%c')}: {message}"
+        with self._lock:
+            with open(self.path, 'a') as status:
+                status.write(message + '\n')
+
+
+def file_fingerprint(path, previous=None):
+    """
+    Fingerprint a file by size, mtime and SHA-256 checksum.
+
+    The checksum is only recomputed when the size or mtime differ from the previous fingerprint.
+
+    Parameters:
+    path (str): File to fingerprint.
+    previous (dict): Fingerprint recorded for the same file in an earlier run, if any.
+
+    Returns:
+    dict: 'size', 'mtime_ns' and 'sha256' of the file.
+    """
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if previous and all(previous.get(key) == value for key, value in fingerprint.items()):
+        fingerprint['sha256'] = previous['sha256']
+        return fingerprint
+
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            checksum.update(block)
+    fingerprint['sha256'] = checksum.hexdigest()
+    return fingerprint
+
+
+def detect_freyja_versions(freyja_cmd):
+    """
+    Ask Freyja for its version and the version of the lineage barcodes used by demix.
+
+    Returns:
+    dict: 'freyja_version' and 'barcode_version' as reported by the tool.
+
+    Raises:
+    RuntimeError: When the Freyja command cannot be run or exits with an error.
+    """
+    versions = {}
+    for name, args in (('freyja_version', ['--version']), ('barcode_version', ['demix', '--version'])):
+        command = ' '.join(freyja_cmd + args)
+        try:
+            result = subprocess.run(freyja_cmd + args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    universal_newlines=True)
+        except OSError as error:
+            raise RuntimeError(f"Could not run '{command}': {error}") from error
+        if result.returncode != 0:
+            raise RuntimeError(f"'{command}' exited with status {result.returncode}: {result.stdout.strip()}")
+        versions[name] = result.stdout.strip()
+    return versions
+
+
+class FreyjaCache:
+    """
+    Cache manifest recording the inputs and tool versions each sample's Freyja results were produced with.
+
+    Parameters:
+    path (str): Location of the JSON manifest.
+    ref (str): Reference FASTA used for 'freyja variants'.
+    versions (dict): Freyja and barcode versions from detect_freyja_versions.
+    """
+    def __init__(self, path, ref, versions):
+        self.path = path
+        manifest = {}
+        if os.path.isfile(path):
+            with open(path) as handle:
+                manifest = json.load(handle)
+        self.samples = manifest.get('samples', {})
+        self.reference = file_fingerprint(ref, manifest.get('reference'))
+        self.versions = versions
+
+    def sample_key(self, sample, bam):
+        """
+        Compute the cache key of a sample from its BAM, the reference, the tool versions and the demix options.
+
+        Returns:
+        tuple: (key, bam fingerprint)
+        """
+        previous = self.samples.get(sample, {}).get('bam')
+        bam_fingerprint = file_fingerprint(bam, previous)
+        inputs = {
+            'bam': bam_fingerprint['sha256'],
+            'reference': self.reference['sha256'],
+            'demix_options': DEMIX_OPTIONS,
+        }
+        inputs.update(self.versions)
+        key = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+        return key, bam_fingerprint
+
+    def is_fresh(self, sample, key, outputs):
+        return self.samples.get(sample, {}).get('key') == key and all(os.path.isfile(path) for path in outputs)
+
+    def record(self, sample, key, bam_fingerprint):
+        self.samples[sample] = {'key': key, 'bam': bam_fingerprint}
+        self.save()
+
+    def save(self):
+        # Write to a temporary file first so an interrupted run never leaves a truncated manifest
+        manifest = {'reference': self.reference, 'versions': self.versions, 'samples': self.samples}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as handle:
+            json.dump(manifest, handle, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def sample_outputs(sample, workdir, outdir):
+    # Files produced for a sample by the variants and demix steps
+    return [os.path.join(workdir, f'{sample}_out_variants.tsv'),
+            os.path.join(workdir, f'{sample}_out_depths'),
+            os.path.join(outdir, f'{sample}_lin_out.tsv')]
+
+
+def run_freyja_sample(sample, bam, freyja_cmd, workdir, outdir, ref, threads=1):
+    """
+    Run 'freyja variants' and 'freyja demix' for one sample.
+
+    The output of both commands is written to '<workdir>/logs/<sample>.log'.
+
+    Returns:
+    bool: True if demix succeeded and produced '<outdir>/<sample>_lin_out.tsv'.
+    """
+    env = dict(os.environ, **{var: str(threads) for var in THREAD_ENV_VARS})
+    log_dir = os.path.join(workdir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+
+    variants = os.path.join(workdir, f'{sample}_out_variants')
+    depths = os.path.join(workdir, f'{sample}_out_depths')
+    lin_out = os.path.join(outdir, f'{sample}_lin_out.tsv')
+
+    commands = [
+        freyja_cmd + ['variants', bam, '--variants', variants, '--depths', depths, '--ref', ref],
+        freyja_cmd + ['demix', f'{variants}.tsv', depths] + DEMIX_OPTIONS + ['--output', lin_out],
+    ]
+    with open(os.path.join(log_dir, f'{sample}.log'), 'w') as log:
+        for command in commands:
+            result = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, env=env)
+            if result.returncode != 0:
+                return False
+
+    return os.path.isfile(lin_out)
+
+
+def run_or_reuse_sample(sample, bam, freyja_cmd, workdir, outdir, ref, status, threads=1, cache=None):
+    """
+    Reuse the cached Freyja results of a sample when they are up to date, or run Freyja for it.
+
+    This runs in a worker thread, so the BAM checksum of the cache key is computed in parallel with the other
+    samples.
+
+    Returns:
+    tuple: ('cached', 'success' or 'failed', and the (cache key, BAM fingerprint) tuple or None without a cache)
+    """
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.sample_key(sample, bam)
+        if cache.is_fresh(sample, cache_key[0], sample_outputs(sample, workdir, outdir)):
+            status.write(f"Reusing cached Freyja results for {sample}")
+            return 'cached', cache_key
+    status.write(f"Running Freyja variants and demix steps for {sample}")
+    succeeded = run_freyja_sample(sample, bam, freyja_cmd, workdir, outdir, ref, threads)
+    return ('success' if succeeded else 'failed'), cache_key
+
+
+def schedule_freyja(manifest, freyja_cmd, workdir, outdir, ref, status, run_name,
+                    workers=4, threads_per_job=1, cache=None):
+    """
+    Run Freyja for all samples passing the coverage gate on a pool of at most `workers` concurrent jobs.
+
+    Parameters:
+    manifest (list): Sample manifest rows from sample_qc.py with 'sample', 'bam' and 'passed' keys.
+    freyja_cmd (list): Command prefix used to call Freyja.
+    workdir (str): Directory for the variants and depth files.
+    outdir (str): Directory for the '*_lin_out.tsv' demix results.
+    ref (str): Reference FASTA.
+    status (StatusFile): Status file receiving one line per sample.
+    run_name (str): Name of the sequencing run, used in the status messages.
+    workers (int): Maximum number of samples processed at the same time.
+    threads_per_job (int): Thread budget given to each Freyja job.
+    cache (FreyjaCache): Optional cache manifest. Samples with up-to-date results are not re-run.
+
+    Returns:
+    dict: 'success', 'cached', 'failed' or 'skipped' keyed by sample.
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for row in manifest:
+            sample, bam = row['sample'], row['bam']
+            if not row['passed']:
+                status.write(f"Skipping {bam} due to insufficient genome coverage.")
+                results[sample] = 'skipped'
+                continue
+            future = executor.submit(run_or_reuse_sample, sample, bam, freyja_cmd, workdir, outdir, ref, status,
+                                     threads_per_job, cache)
+            futures[future] = sample
+
+        # The cache manifest is only updated from this thread
+        for future in as_completed(futures):
+            sample = futures[future]
+            try:
+                state, cache_key = future.result()
+            except OSError as error:
+                status.write(f"Run {run_name}: Sample {sample} could not be started: {error}", timestamp=False)
+                state, cache_key = 'failed', None
+            if state == 'cached':
+                results[sample] = 'cached'
+            elif state == 'success':
+                status.write(f"Run {run_name}: Sample {sample} processed successfully.", timestamp=False)
+                results[sample] = 'success'
+                if cache is not None:
+                    cache.record(sample, *cache_key)
+            else:
+                status.write(f"Run {run_name}: Sample {sample} did not process successfully. "
+                             "SolverError: Solver 'ECOS' failed. Skipping this sample.", timestamp=False)
+                results[sample] = 'failed'
+
+    return results
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Run Freyja variants and demix for all samples of a run in parallel.')
+    parser.add_argument('run_name', help='Wastewater sequencing run name')
+    parser.add_argument('--analysis-dir', default=WASTEWATER_SEQ_DIR, help='Wastewater sequencing directory')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help='Maximum number of samples processed at the same time')
+    parser.add_argument('--threads-per-job', type=int, default=2, help='Thread budget for each Freyja job')
+    parser.add_argument('--coverage-threshold', type=float, default=COVERAGE_THRESHOLD,
+                        help='Minimum genome coverage (percent) for a sample to be processed')
+    parser.add_argument('--manifest', default=None,
+                        help='Sample manifest written by sample_qc.py. Built from the MultiQC metrics if not given')
+    parser.add_argument('--freyja-cmd', default=DEFAULT_FREYJA_CMD,
+                        help='Command used to call Freyja. {analysis_dir} is replaced by the analysis directory')
+    parser.add_argument('--ref', default=REFERENCE_FASTA, help='Reference SARS-CoV-2 genome')
+    parser.add_argument('--status-file', default=None,
+                        help='Status file of the run (default: <run>/logs/freyja_demix_status.txt)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Re-run every sample instead of reusing results recorded in the cache manifest')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_arguments(args)
+    run_dir = os.path.join(args.analysis_dir, args.run_name)
+
+    # Define working, input and output directories as in run_freyja.sh
+    workdir = os.path.join(run_dir, 'analysis', 'freyja')
+    in_dir = os.path.join(run_dir, 'analysis', 'viralrecon', 'variants', 'bowtie2')
+    outdir = os.path.join(workdir, 'lineage_out')
+    coverage_file = os.path.join(run_dir, 'results', f'{args.run_name}_summary_variants_metrics_mqc.csv')
+    os.makedirs(outdir, exist_ok=True)
+    os.makedirs(os.path.join(run_dir, 'logs'), exist_ok=True)
+
+    status = StatusFile(args.status_file or os.path.join(run_dir, 'logs', 'freyja_demix_status.txt'))
+    freyja_cmd = shlex.split(args.freyja_cmd.format(analysis_dir=args.analysis_dir))
+
+    if args.manifest:
+        manifest = read_manifest(args.manifest)
+    else:
+        manifest = SampleQCIndex(coverage_file).build_manifest(in_dir, args.coverage_threshold)
+        write_manifest(manifest, os.path.join(workdir, f'{args.run_name}_freyja_sample_manifest.csv'))
+    if not manifest:
+        print(f"No BAM files found in {in_dir}.")
+        return 1
+
+    cache = None
+    if not args.no_cache:
+        try:
+            versions = detect_freyja_versions(freyja_cmd)
+        except RuntimeError as error:
+            print(f"Freyja is not available: {error}")
+            status.write(f"Freyja is not available: {error}")
+            return 1
+        status.write(f"Freyja version: {versions['freyja_version']}. Barcode version: {versions['barcode_version']}")
+        cache = FreyjaCache(os.path.join(workdir, CACHE_MANIFEST), args.ref, versions)
+
+    status.write(f"Running Freyja for {len(manifest)} samples with {args.workers} workers "
+                 f"and {args.threads_per_job} threads per job")
+    results = schedule_freyja(manifest, freyja_cmd, workdir, outdir, args.ref, status, args.run_name,
+                              workers=args.workers, threads_per_job=args.threads_per_job, cache=cache)
+
+    counts = {state: list(results.values()).count(state) for state in ('success', 'cached', 'failed', 'skipped')}
+    status.write(f"Demultiplexing step completed and results are stored in {outdir}. "
+                 f"{counts['success']} succeeded, {counts['cached']} reused from cache, "
+                 f"{counts['failed']} failed, {counts['skipped']} skipped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Lightweight stage instrumentation for the Freyja post-processing scripts.
+
+A RunMetrics collects, for every stage of a run, the wall time, CPU time of the calling thread, peak resident
+memory of the process and the number of rows produced, and writes them to a JSON metrics file next to the run
+results. Stages are recorded with the metrics.stage() context manager, and helper functions decorated with
+@timed() record a stage in the metrics active in the calling thread; they cost a single lookup when no run is
+being instrumented.
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+_local = threading.local()
+
+
+def peak_rss_mib():
+    # Peak resident set size of the process so far; ru_maxrss is in bytes on macOS and in KiB on Linux
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def _result_rows(result, *args, **kwargs):
+    # Rows of a DataFrame or Series result, or of the first item of a tuple result
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    return len(result) if hasattr(result, 'shape') else None
+
+
+def active_metrics():
+    return getattr(_local, 'metrics', None)
+
+
+class RunMetrics:
+    """
+    Stage metrics of one script run.
+
+    Used as a context manager, the metrics are active in the current thread while the block runs, and are
+    written to output_file when the block exits (also when it raises, with the error recorded).
+
+    Parameters:
+    script (str): Name of the instrumented script.
+    output_file (str): JSON metrics file. It can also be set once the results directory is known.
+    **info: Extra fields recorded in the metrics file, e.g. run_name.
+    """
+    def __init__(self, script, output_file=None, **info):
+        self.script = script
+        self.output_file = output_file
+        self.info = info
+        self.stages = []
+        self.status = None
+        self.error = None
+        self._start = None
+        self._lock = threading.Lock()
+        self._previous = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self._previous = active_metrics()
+        _local.metrics = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.metrics = self._previous
+        self.wall_s = time.perf_counter() - self._start
+        self.status = 'failed' if exc_type else 'success'
+        self.error = None if exc_value is None else repr(exc_value)
+        if self.output_file:
+            self.write_json(self.output_file)
+
+    def record(self, name, wall_s, cpu_s, rows=None, **fields):
+        with self._lock:
+            self.stages.append(dict({'stage': name, 'wall_s': round(wall_s, 6), 'cpu_s': round(cpu_s, 6),
+                                     'peak_rss_mib': peak_rss_mib(), 'rows': rows}, **fields))
+
+    def stage(self, name, **fields):
+        """
+        Time a block of code. The yielded dict can be given a 'rows' value and other fields to record.
+
+        Example:
+        with metrics.stage('read_new_run') as stage:
+            long_df = read_long_df(lineage_file)
+            stage['rows'] = len(long_df)
+        """
+        return _Stage(self, name, fields)
+
+    def to_dict(self):
+        return dict({
+            'script': self.script,
+            'started_at': getattr(self, 'started_at', None),
+            'status': self.status,
+            'error': self.error,
+            'wall_s': round(getattr(self, 'wall_s', 0.0), 6),
+            'peak_rss_mib': peak_rss_mib(),
+            'stages': self.stages,
+        }, **self.info)
+
+    def write_json(self, output_file):
+        output_dir = os.path.dirname(output_file)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        with open(output_file, 'w') as output:
+            json.dump(self.to_dict(), output, indent=2, default=str)
+
+
+class _Stage:
+    def __init__(self, metrics, name, fields):
+        self.metrics = metrics
+        self.name = name
+        self.fields = dict(fields)
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self.fields
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.fields['error'] = repr(exc_value)
+        self.metrics.record(self.name, time.perf_counter() - self._wall, time.thread_time() - self._cpu,
+                            **self.fields)
+
+
+def timed(name=None, rows=_result_rows):
+    """
+    Decorator recording a call of the function as a stage of the RunMetrics active in the calling thread.
+
+    Parameters:
+    name (str): Stage name, the function's qualified name by default.
+    rows (callable): Called as rows(result, *args, **kwargs) to count the rows produced.
+    """
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = active_metrics()
+            if metrics is None:
+                return func(*args, **kwargs)
+            wall = time.perf_counter()
+            cpu = time.thread_time()
+            result = func(*args, **kwargs)
+            metrics.record(stage_name, time.perf_counter() - wall, time.thread_time() - cpu,
+                           rows(result, *args, **kwargs))
+            return result
+        return wrapper
+    return decorator
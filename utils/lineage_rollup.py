@@ -0,0 +1,201 @@
+"""
+Site x ISO week x lineage group rollup of the merged lineage abundance table, for the dashboards and reports.
+
+The rollup is kept in two small tables written next to the merged '*lineage_abundance_cln.csv':
+
+- '<date>_lineage_rollup_sample_groups.csv': the abundance of every summarized lineage group in every sample
+  (sum of its lineage abundances), keyed by (sample_id, collection_date).
+- '<date>_lineage_rollup_cube.csv': for every site, ISO week and summarized lineage group, the number of samples
+  of the site that week, the number of samples with the group, and the mean (over the samples of the site that
+  week, a sample without the group counting as 0) and max abundance of the group, with the site name and lat/long.
+
+A merge only replaces the sample groups of the samples in the new run, taken from the merged table so lineages
+kept from earlier runs are counted, and only recomputes the cube cells (site, week) of those samples. When no
+previous rollup exists it is built once from the full merged table, reading the CSV in chunks.
+"""
+
+import glob
+import os
+
+import pandas as pd
+
+from instrumentation import timed
+from lineage_schema import read_lineage_abundance
+
+SAMPLE_KEY = ['sample_id', 'collection_date']
+GROUP_COLUMNS = SAMPLE_KEY + ['msd_shrtnm', 'summarized_lineage']
+CELL_COLUMNS = ['msd_shrtnm', 'iso_year', 'iso_week']
+SITE_COLUMNS = ['msd_name', 'latitude', 'longitutde']
+CUBE_COLUMNS = CELL_COLUMNS + ['week_start'] + SITE_COLUMNS + ['summarized_lineage', 'n_site_samples', 'n_samples',
+                                                             'mean_abundance', 'max_abundance']
+
+SAMPLE_GROUPS_SUFFIX = 'lineage_rollup_sample_groups.csv'
+CUBE_SUFFIX = 'lineage_rollup_cube.csv'
+
+
+def sample_groups(df):
+    """
+    Sum the lineage abundances of every summarized lineage group in every sample.
+
+    Parameters:
+    df (pd.DataFrame): Lineage abundance rows with 'sample_id', 'collection_date', 'msd_shrtnm',
+    'summarized_lineage' and 'abundance' columns.
+
+    Returns:
+    pd.DataFrame: One row per sample and group with GROUP_COLUMNS and 'abundance', as plain (non-categorical)
+    values. Sums of separate chunks of the data can be combined by summing them again.
+    """
+    groups = (df[GROUP_COLUMNS + ['abundance']]
+              .astype({'sample_id': object, 'msd_shrtnm': object, 'summarized_lineage': object, 'abundance': float})
+              .groupby(GROUP_COLUMNS, dropna=False)['abundance'].sum()
+              .reset_index())
+    groups['collection_date'] = pd.to_datetime(groups['collection_date'])
+    return groups
+
+
+def _sample_keys(df):
+    return pd.MultiIndex.from_frame(df[SAMPLE_KEY].astype({'sample_id': object}))
+
+
+@timed('rollup_sample_groups_from_csv')
+def sample_groups_from_csv(csv_file, keys=None, chunksize=100000):
+    """
+    Compute the sample groups of a merged lineage abundance CSV, reading it in chunks.
+
+    Parameters:
+    csv_file (str): Path to a '*lineage_abundance_cln.csv' file.
+    keys (pd.MultiIndex): Only use the rows of these (sample_id, collection_date) keys. All rows by default.
+    chunksize (int): Number of rows read per chunk.
+    """
+    parts = []
+    for chunk in read_lineage_abundance(csv_file, chunksize=chunksize):
+        if keys is not None:
+            chunk = chunk[_sample_keys(chunk).isin(keys)]
+        parts.append(sample_groups(chunk))
+    groups = pd.concat(parts, ignore_index=True)
+    return groups.groupby(GROUP_COLUMNS, dropna=False)['abundance'].sum().reset_index()
+
+
+def update_sample_groups(previous, new_groups, keys):
+    """
+    Replace the sample groups of the samples in keys with new_groups.
+
+    Returns:
+    pd.DataFrame: The updated sample groups, sorted by sample, date and group.
+    """
+    kept = previous[~_sample_keys(previous).isin(keys)]
+    groups = pd.concat([kept, new_groups], ignore_index=True)
+    return groups.sort_values(GROUP_COLUMNS, na_position='last').reset_index(drop=True)
+
+
+def _with_week(groups):
+    iso = groups['collection_date'].dt.isocalendar()
+    return groups.assign(iso_year=iso['year'].astype(int).to_numpy(), iso_week=iso['week'].astype(int).to_numpy(),
+                         week_start=(groups['collection_date'] - pd.to_timedelta(iso['day'].astype(int) - 1, unit='D'))
+                         .dt.normalize())
+
+
+@timed('build_rollup_cube')
+def build_cube(groups, sites):
+    """
+    Aggregate sample groups into the site x ISO week x lineage group cube.
+
+    Parameters:
+    groups (pd.DataFrame): Sample groups as returned by sample_groups.
+    sites (pd.DataFrame): Site table indexed by site code (SiteRegistry.sites).
+
+    Returns:
+    pd.DataFrame: Cube rows with CUBE_COLUMNS.
+    """
+    if groups.empty:
+        return pd.DataFrame(columns=CUBE_COLUMNS)
+    groups = _with_week(groups)
+    site_samples = (groups.groupby(CELL_COLUMNS, dropna=False)['sample_id'].nunique()
+                    .rename('n_site_samples').reset_index())
+    cube = (groups.groupby(CELL_COLUMNS + ['week_start', 'summarized_lineage'], dropna=False)['abundance']
+            .agg(n_samples='count', sum_abundance='sum', max_abundance='max')
+            .reset_index()
+            .merge(site_samples, on=CELL_COLUMNS, how='left'))
+    cube['mean_abundance'] = cube.pop('sum_abundance') / cube['n_site_samples']
+
+    site_info = sites.reindex(cube['msd_shrtnm'])
+    for column in SITE_COLUMNS:
+        cube[column] = site_info[column].to_numpy() if column in site_info.columns else None
+    return cube[CUBE_COLUMNS]
+
+
+def update_cube(previous_cube, groups, keys, sites):
+    """
+    Recompute the cube cells (site, ISO week) of the samples in keys from the updated sample groups.
+
+    Returns:
+    pd.DataFrame: The updated cube, sorted by site, week and group.
+    """
+    weeks = _with_week(groups)
+    group_cells = pd.MultiIndex.from_frame(weeks[CELL_COLUMNS])
+    cells = group_cells[_sample_keys(groups).isin(keys)].unique()
+    cell_groups = groups[group_cells.isin(cells)]
+
+    kept = previous_cube[~pd.MultiIndex.from_frame(previous_cube[CELL_COLUMNS]).isin(cells)]
+    cube = pd.concat([kept, build_cube(cell_groups, sites)], ignore_index=True)
+    return cube.sort_values(CELL_COLUMNS + ['summarized_lineage'], na_position='last').reset_index(drop=True)
+
+
+def find_previous_rollup(results_dir):
+    """
+    Returns:
+    tuple: Paths of the latest sample groups and cube files of a results directory, or None when either is missing.
+    """
+    if not results_dir:
+        return None
+    groups_files = sorted(glob.glob(os.path.join(results_dir, f'*{SAMPLE_GROUPS_SUFFIX}')))
+    cube_files = sorted(glob.glob(os.path.join(results_dir, f'*{CUBE_SUFFIX}')))
+    if not groups_files or not cube_files:
+        return None
+    return groups_files[-1], cube_files[-1]
+
+
+def read_sample_groups(groups_file):
+    return pd.read_csv(groups_file, dtype={'sample_id': str, 'msd_shrtnm': str, 'summarized_lineage': str},
+                       parse_dates=['collection_date'])
+
+
+def read_cube(cube_file):
+    """
+    Read a rollup cube, e.g. for a report: the cube is small enough to be loaded whole.
+    """
+    return pd.read_csv(cube_file, dtype={'msd_shrtnm': str, 'msd_name': str, 'summarized_lineage': str},
+                       parse_dates=['week_start'])
+
+
+@timed('update_rollup', rows=lambda result, *args, **kwargs: len(result[1]))
+def update_rollup(new_keys, sites, previous_dir=None, merged_df=None, merged_file=None, chunksize=100000):
+    """
+    Update the rollup for a merge.
+
+    Parameters:
+    new_keys (pd.MultiIndex): (sample_id, collection_date) keys of the samples in the new run.
+    sites (pd.DataFrame): Site table indexed by site code.
+    previous_dir (str): Results directory of the previous merge, searched for the previous rollup.
+    merged_df (pd.DataFrame): The merged lineage abundance table, when it is in memory.
+    merged_file (str): The merged lineage abundance CSV, read in chunks when merged_df is not given.
+    chunksize (int): Number of rows read per chunk from merged_file.
+
+    Returns:
+    tuple: (sample groups, cube, True when the rollup was updated incrementally or False when it was rebuilt)
+    """
+    previous = find_previous_rollup(previous_dir)
+
+    def groups_of(keys=None):
+        if merged_df is None:
+            return sample_groups_from_csv(merged_file, keys, chunksize)
+        rows = merged_df if keys is None else merged_df[_sample_keys(merged_df).isin(keys)]
+        return sample_groups(rows)
+
+    if previous is None:
+        groups = groups_of().sort_values(GROUP_COLUMNS, na_position='last').reset_index(drop=True)
+        return groups, build_cube(groups, sites), False
+
+    groups_file, cube_file = previous
+    groups = update_sample_groups(read_sample_groups(groups_file), groups_of(new_keys), new_keys)
+    return groups, update_cube(read_cube(cube_file), groups, new_keys, sites), True
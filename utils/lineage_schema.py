@@ -0,0 +1,123 @@
+"""
+Compact schema for the long lineage abundance tables.
+
+The per-run '*lingrps_final.csv' and the merged '*lineage_abundance_cln.csv' repeat the same sample, lineage and
+site strings on every row. Reading them with explicit dtypes stores those columns as categoricals and collection
+dates as datetimes, and lets read_csv skip type inference. Abundances stay float64: the merged table is written
+back on every merge, and float32 would rewrite every historical abundance with rounding noise. They are parsed
+with float_precision='round_trip', as the default parser can be off by one in the last digit of an abundance
+that is then written back. The 'idx_name' row number column is not read back; it is regenerated whenever a
+merged table is written.
+"""
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from instrumentation import timed
+
+# Columns stored as categoricals in the long lineage tables
+CATEGORICAL_COLUMNS = ['sample_id', 'lineage', 'uncompress_lineage', 'parent_lineage', 'summarized_lineage',
+                       'msd_shrtnm', 'msd_name']
+
+LONG_DF_DTYPES = {
+    'sample_id': 'category',
+    'lineage': 'category',
+    'abundance': 'float64',
+    'uncompress_lineage': 'category',
+    'parent_lineage': 'category',
+    'summarized_lineage': 'category',
+}
+
+LINEAGE_ABUNDANCE_DTYPES = dict(LONG_DF_DTYPES, **{
+    'msd_shrtnm': 'category',
+    'msd_name': 'category',
+    'longitutde': 'float64',
+    'latitude': 'float64',
+})
+
+
+def _skip_idx_name(column):
+    return column != 'idx_name'
+
+
+@timed('read_long_df')
+def read_long_df(filepath, **kwargs):
+    """
+    Read a '*lingrps_final.csv' file written by freyja_custom_lin_processing.py with the compact dtypes.
+
+    Parameters:
+    filepath (str): Path to the CSV file.
+    **kwargs: Passed on to pd.read_csv, e.g. chunksize.
+
+    Returns:
+    pd.DataFrame: Long lineage data without the 'idx_name' column.
+    """
+    return pd.read_csv(filepath, sep=',', dtype=LONG_DF_DTYPES, usecols=_skip_idx_name,
+                       float_precision='round_trip', **kwargs)
+
+
+@timed('read_lineage_abundance')
+def read_lineage_abundance(filepath, **kwargs):
+    """
+    Read a merged '*lineage_abundance_cln.csv' file with the compact dtypes and parsed collection dates.
+
+    Parameters:
+    filepath (str): Path to the CSV file.
+    **kwargs: Passed on to pd.read_csv, e.g. chunksize.
+
+    Returns:
+    pd.DataFrame: Lineage abundance data without the 'idx_name' column.
+    """
+    return pd.read_csv(filepath, sep=',', dtype=LINEAGE_ABUNDANCE_DTYPES, usecols=_skip_idx_name,
+                       parse_dates=['collection_date'], float_precision='round_trip', **kwargs)
+
+
+def to_compact(df):
+    """
+    Convert the known columns of a lineage DataFrame to the compact dtypes.
+
+    Returns:
+    pd.DataFrame: The converted DataFrame. Columns outside the schema are left untouched.
+    """
+    dtypes = {column: dtype for column, dtype in LINEAGE_ABUNDANCE_DTYPES.items() if column in df.columns}
+    df = df.astype(dtypes)
+    if 'collection_date' in df.columns:
+        df['collection_date'] = pd.to_datetime(df['collection_date'])
+    return df
+
+
+def to_export(df):
+    """
+    Return a lineage DataFrame ready to be written to CSV, with its abundances as float64.
+
+    A float32 abundance is written with its rounding noise (0.0872378349... for 0.0872378367...), so any
+    abundance narrowed in memory is widened again before a lineage table is written.
+    """
+    if 'abundance' in df.columns and df['abundance'].dtype != 'float64':
+        df = df.astype({'abundance': 'float64'})
+    return df
+
+
+def harmonize_categories(frames, columns=CATEGORICAL_COLUMNS):
+    """
+    Give the categorical columns of several DataFrames one shared set of categories.
+
+    pd.concat falls back to object dtype when categoricals differ, so frames from different runs are put on
+    a shared category dictionary before they are combined.
+
+    Parameters:
+    frames (list): DataFrames to harmonize.
+    columns (list): Categorical columns to harmonize, when present in every frame.
+
+    Returns:
+    list: DataFrames whose categorical columns share identical categories.
+    """
+    frames = [frame.copy() for frame in frames]
+    for column in columns:
+        if not all(column in frame.columns for frame in frames):
+            continue
+        categories = union_categoricals([frame[column].astype('category') for frame in frames]).categories
+        dtype = pd.CategoricalDtype(categories)
+        for frame in frames:
+            frame[column] = frame[column].astype(dtype)
+    return frames
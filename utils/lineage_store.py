@@ -0,0 +1,231 @@
+"""
+Persistent SQLite store for the master wastewater lineage abundance table.
+
+Each sequencing run is upserted into the store keyed on (sample_id, collection_date, lineage), so the
+history no longer has to be re-read, re-concatenated and de-duplicated on every run. Rows carry their
+collection month, which acts as the partition used to validate only the data touched by a new run.
+The Microreact CSV is produced as an export from the store.
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+from instrumentation import timed
+from lineage_schema import read_lineage_abundance, to_export
+
+TABLE_NAME = 'lineage_abundance'
+
+# Columns of the Microreact lineage abundance CSV, in output order ('idx_name' is generated on export)
+STORE_COLUMNS = ['sample_id', 'lineage', 'abundance', 'uncompress_lineage', 'parent_lineage',
+                 'summarized_lineage', 'collection_date', 'msd_shrtnm', 'msd_name', 'longitutde', 'latitude']
+KEY_COLUMNS = ['sample_id', 'collection_date', 'lineage']
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+    sample_id TEXT NOT NULL,
+    lineage TEXT NOT NULL,
+    abundance REAL,
+    uncompress_lineage TEXT,
+    parent_lineage TEXT,
+    summarized_lineage TEXT,
+    collection_date TEXT NOT NULL,
+    msd_shrtnm TEXT,
+    msd_name TEXT,
+    longitutde REAL,
+    latitude REAL,
+    collection_month TEXT NOT NULL,
+    PRIMARY KEY (sample_id, collection_date, lineage)
+);
+CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_month ON {TABLE_NAME} (collection_month);
+CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_uncompress ON {TABLE_NAME} (uncompress_lineage);
+CREATE TABLE IF NOT EXISTS loaded_runs (
+    run_name TEXT PRIMARY KEY,
+    loaded_at TEXT NOT NULL,
+    n_rows INTEGER NOT NULL
+);
+"""
+
+
+def _to_store_rows(df):
+    """
+    Normalise a lineage abundance DataFrame to the store columns, with ISO dates and collection month.
+
+    Parameters:
+    df (pd.DataFrame): Lineage data with at least the STORE_COLUMNS key columns.
+
+    Returns:
+    pd.DataFrame: DataFrame with STORE_COLUMNS plus 'collection_month'.
+    """
+    rows = df.reindex(columns=STORE_COLUMNS).copy()
+    collection_date = pd.to_datetime(rows['collection_date'])
+    rows['collection_date'] = collection_date.dt.strftime('%Y-%m-%d')
+    rows['collection_month'] = collection_date.dt.strftime('%Y-%m')
+    # SQLite cannot bind pandas missing values, so convert them to None
+    return rows.astype(object).where(rows.notna(), None)
+
+
+class LineageStore:
+    """
+    SQLite-backed master lineage abundance table.
+
+    Parameters:
+    path (str): Location of the SQLite database file. It is created if it does not exist.
+    """
+    def __init__(self, path):
+        store_dir = os.path.dirname(path)
+        if store_dir and not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def is_empty(self):
+        return self.conn.execute(f"SELECT 1 FROM {TABLE_NAME} LIMIT 1").fetchone() is None
+
+    def count_rows(self):
+        return self.conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0]
+
+    def _insert(self, df, conflict):
+        rows = _to_store_rows(df)
+        columns = list(rows.columns)
+        placeholders = ', '.join('?' * len(columns))
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR {conflict} INTO {TABLE_NAME} ({', '.join(columns)}) VALUES ({placeholders})",
+                rows.itertuples(index=False, name=None))
+        return rows
+
+    @timed('store_import_csv', rows=lambda result, *args, **kwargs: result)
+    def import_csv(self, csv_file, chunksize=100000):
+        """
+        Seed the store from an existing '*lineage_abundance_cln.csv' history file.
+
+        Rows are read in chunks; when a key appears more than once the first occurrence is kept,
+        matching remove_duplicates in freyja_old_new_res_merge.py.
+
+        Parameters:
+        csv_file (str): Path to the lineage abundance CSV.
+        chunksize (int): Number of rows read per chunk.
+
+        Returns:
+        int: Number of rows in the store after the import.
+        """
+        for chunk in read_lineage_abundance(csv_file, chunksize=chunksize):
+            self._insert(chunk, 'IGNORE')
+        return self.count_rows()
+
+    @timed('store_upsert', rows=lambda result, self, df, *args, **kwargs: len(df))
+    def upsert(self, df, run_name=None):
+        """
+        Insert the rows of a new run, replacing any stored rows with the same key.
+
+        Rows from the new run take precedence over the history, and within the new run the first
+        occurrence of a key wins, as in the previous concat + drop_duplicates merge.
+
+        Parameters:
+        df (pd.DataFrame): Lineage data for the new run, including lat/long columns.
+        run_name (str): Optional run name recorded in the 'loaded_runs' table.
+
+        Returns:
+        list: Sorted collection months ('YYYY-MM') touched by the new run.
+        """
+        df = df.drop_duplicates(subset=KEY_COLUMNS, keep='first')
+        rows = self._insert(df, 'REPLACE')
+        if run_name is not None:
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO loaded_runs VALUES (?, ?, ?)",
+                                  (run_name, datetime.now().isoformat(timespec='seconds'), len(rows)))
+        return sorted(rows['collection_month'].dropna().unique())
+
+    def reclassify(self, classifier):
+        """
+        Recompute 'summarized_lineage' from 'uncompress_lineage' with a new lineage classifier.
+
+        Only the distinct uncompressed lineages are classified, and only rows whose group changes are updated.
+
+        Parameters:
+        classifier (LineageClassifier): Classifier built from the updated lineage mapping.
+
+        Returns:
+        pd.DataFrame: One row per (uncompress_lineage, old group) pair that moved, with the new group and the
+        number of rows updated.
+        """
+        groups = pd.read_sql_query(
+            f"SELECT uncompress_lineage, summarized_lineage AS old_summarized_lineage, COUNT(*) AS n_rows "
+            f"FROM {TABLE_NAME} GROUP BY uncompress_lineage, summarized_lineage", self.conn)
+        groups['new_summarized_lineage'] = classifier.classify_series(groups['uncompress_lineage'])
+        moves = groups[groups['old_summarized_lineage'] != groups['new_summarized_lineage']]
+
+        # Rows without an uncompressed lineage are classified as 'NA' and cannot be matched by lineage
+        updates = moves.dropna(subset=['uncompress_lineage']).drop_duplicates('uncompress_lineage')
+        with self.conn:
+            self.conn.executemany(
+                f"UPDATE {TABLE_NAME} SET summarized_lineage = ? WHERE uncompress_lineage = ?",
+                updates[['new_summarized_lineage', 'uncompress_lineage']].itertuples(index=False, name=None))
+            self.conn.execute(f"UPDATE {TABLE_NAME} SET summarized_lineage = 'NA' WHERE uncompress_lineage IS NULL")
+        return moves[['uncompress_lineage', 'old_summarized_lineage', 'new_summarized_lineage', 'n_rows']]
+
+    def _read(self, query, params=(), chunksize=None):
+        frames = pd.read_sql_query(query, self.conn, params=params, chunksize=chunksize)
+        if chunksize is None:
+            frames = [frames]
+        for frame in frames:
+            frame['collection_date'] = pd.to_datetime(frame['collection_date'])
+            yield frame
+
+    @timed('store_fetch_partitions')
+    def fetch_partitions(self, months):
+        """
+        Read every stored row for the given collection months.
+
+        Parameters:
+        months (list): Collection months formatted as 'YYYY-MM'.
+
+        Returns:
+        pd.DataFrame: Stored rows for those months with STORE_COLUMNS.
+        """
+        if not months:
+            return pd.DataFrame(columns=STORE_COLUMNS)
+        placeholders = ', '.join('?' * len(months))
+        query = (f"SELECT {', '.join(STORE_COLUMNS)} FROM {TABLE_NAME} "
+                 f"WHERE collection_month IN ({placeholders})")
+        return next(self._read(query, tuple(months)))
+
+    @timed('store_export_csv', rows=lambda result, *args, **kwargs: result)
+    def export_csv(self, csv_file, chunksize=100000):
+        """
+        Write the whole store as the Microreact lineage abundance CSV.
+
+        Parameters:
+        csv_file (str): Output CSV path. Its directory is created if needed.
+        chunksize (int): Number of rows written per chunk.
+
+        Returns:
+        int: Number of rows written.
+        """
+        output_dir = os.path.dirname(csv_file)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        query = (f"SELECT {', '.join(STORE_COLUMNS)} FROM {TABLE_NAME} "
+                 f"ORDER BY collection_date DESC, sample_id, lineage")
+        n_rows = 0
+        for chunk in self._read(query, chunksize=chunksize):
+            chunk.insert(0, 'idx_name', range(n_rows, n_rows + len(chunk)))
+            to_export(chunk).to_csv(csv_file, index=False, mode='w' if n_rows == 0 else 'a', header=n_rows == 0)
+            n_rows += len(chunk)
+        if n_rows == 0:
+            pd.DataFrame(columns=['idx_name'] + STORE_COLUMNS).to_csv(csv_file, index=False)
+        return n_rows
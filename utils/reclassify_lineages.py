@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Re-apply data/lineage_mapping.json to existing lineage abundance results.
+
+When a group is added to the lineage mapping only 'summarized_lineage' changes, so there is no need to re-run the
+parse and alias steps. This script reads a lineage abundance CSV (the merged '*lineage_abundance_cln.csv' or a
+run's '*lingrps_final.csv') in chunks, classifies each unique 'uncompress_lineage' once and rewrites only the
+'summarized_lineage' column; all other columns are copied as text, unchanged. With --store the SQLite lineage
+store is updated in place instead. The lineages that moved to another group are written to a report.
+
+Usage: reclassify_lineages.py (--csv <file> [--output <file>] | --store <lineage_store.sqlite> [--export <file>])
+                              [--lineage-mapping data/lineage_mapping.json] [--report lineage_group_moves.csv]
+"""
+
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+from utils import LineageClassifier
+from lineage_store import LineageStore
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINEAGE_MAPPING_FILE_PATH = os.path.join(REPO_DIR, 'data', 'lineage_mapping.json')
+
+MOVES_COLUMNS = ['uncompress_lineage', 'old_summarized_lineage', 'new_summarized_lineage', 'n_rows']
+
+
+def reclassify_chunk(chunk, classifier, groups):
+    """
+    Replace the 'summarized_lineage' column of a chunk read as text.
+
+    Parameters:
+    chunk (pd.DataFrame): Lineage rows with 'uncompress_lineage' and 'summarized_lineage' columns.
+    classifier (LineageClassifier): Classifier built from the updated lineage mapping.
+    groups (dict): Group of each uncompressed lineage classified so far, extended in place.
+
+    Returns:
+    tuple: The updated chunk and a DataFrame counting the moved rows per (lineage, old group, new group).
+    """
+    lineages = chunk['uncompress_lineage']
+    for lineage in lineages.unique():
+        if lineage not in groups:
+            # Empty cells are missing lineages, classified as 'NA' like in freyja_custom_lin_processing.py
+            groups[lineage] = classifier.classify(lineage) if lineage else 'NA'
+
+    new_groups = lineages.map(groups)
+    moved = chunk['summarized_lineage'] != new_groups
+    moves = (pd.DataFrame({'uncompress_lineage': lineages[moved],
+                           'old_summarized_lineage': chunk['summarized_lineage'][moved],
+                           'new_summarized_lineage': new_groups[moved]})
+             .groupby(MOVES_COLUMNS[:3]).size().rename('n_rows').reset_index())
+
+    chunk = chunk.assign(summarized_lineage=new_groups)
+    return chunk, moves
+
+
+def reclassify_csv(csv_file, classifier, output_file=None, chunksize=200000):
+    """
+    Rewrite the 'summarized_lineage' column of a lineage abundance CSV.
+
+    Parameters:
+    csv_file (str): Input CSV.
+    classifier (LineageClassifier): Classifier built from the updated lineage mapping.
+    output_file (str): Output CSV. The input is replaced when not given.
+    chunksize (int): Number of rows processed per chunk.
+
+    Returns:
+    pd.DataFrame: Moved lineages with their old group, new group and number of rows.
+    """
+    output_file = output_file or csv_file
+    tmp_file = output_file + '.tmp'
+    groups = {}
+    moves = []
+
+    # Every column is read as text so the unchanged columns are written back exactly as they were
+    chunks = pd.read_csv(csv_file, sep=',', dtype=str, keep_default_na=False, chunksize=chunksize)
+    for i, chunk in enumerate(chunks):
+        chunk, chunk_moves = reclassify_chunk(chunk, classifier, groups)
+        chunk.to_csv(tmp_file, index=False, mode='w' if i == 0 else 'a', header=i == 0)
+        moves.append(chunk_moves)
+    os.replace(tmp_file, output_file)
+
+    print(f"Classified {len(groups)} unique lineages from {csv_file}")
+    if not moves:
+        return pd.DataFrame(columns=MOVES_COLUMNS)
+    return pd.concat(moves).groupby(MOVES_COLUMNS[:3], as_index=False)['n_rows'].sum()
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Recompute summarized_lineage after a lineage mapping update.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--csv', help='Lineage abundance CSV to reclassify')
+    source.add_argument('--store', help='SQLite lineage store to reclassify in place')
+    parser.add_argument('--output', default=None, help='Output CSV (default: replace the --csv file)')
+    parser.add_argument('--export', default=None, help='Export the reclassified --store to this Microreact CSV')
+    parser.add_argument('--lineage-mapping', default=LINEAGE_MAPPING_FILE_PATH, help='Lineage mapping JSON')
+    parser.add_argument('--report', default='lineage_group_moves.csv', help='CSV report of the lineages that moved')
+    parser.add_argument('--chunksize', type=int, default=200000, help='Rows processed per chunk with --csv')
+    args = parser.parse_args(args)
+    # The store is updated in place, so an output file only applies to --csv and an export only to --store
+    if args.store and args.output:
+        parser.error('--output can only be used with --csv, use --export to write the reclassified --store to a CSV')
+    if args.csv and args.export:
+        parser.error('--export can only be used with --store, use --output to write the reclassified --csv elsewhere')
+    return args
+
+
+def main(args=None):
+    args = parse_arguments(args)
+    classifier = LineageClassifier.from_json(args.lineage_mapping)
+
+    if args.store:
+        with LineageStore(args.store) as store:
+            moves = store.reclassify(classifier)
+            if args.export:
+                store.export_csv(args.export)
+    else:
+        moves = reclassify_csv(args.csv, classifier, args.output, args.chunksize)
+
+    moves = moves.sort_values('n_rows', ascending=False)
+    moves.to_csv(args.report, index=False)
+    print(f"{moves['uncompress_lineage'].nunique()} lineages ({int(moves['n_rows'].sum())} rows) moved to another "
+          f"group. Report written to {args.report}")
+    for row in moves.head(20).itertuples(index=False):
+        print(f"  {row.uncompress_lineage}: {row.old_summarized_lineage} -> {row.new_summarized_lineage} ({row.n_rows} rows)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
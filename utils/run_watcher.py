@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Long-running watcher that starts the wastewater analysis as soon as a sequencing run is complete.
+
+Run folders are tracked under the sequencer output directory ('<output_dir>/<instrument>/<raw_run>', completed
+when 'CopyComplete.txt' appears) and under the wastewater sequencing directory ('<ww_dir>/<run_name>', completed
+when 'fastqgen_complete.txt' appears). File system events are used when the optional 'watchdog' package is
+installed; NAS mounts do not deliver events, so the folders are also polled every --interval seconds.
+
+Every completed run is enqueued once as a chain of stages (setup -> viralrecon -> Freyja) in a small SQLite job
+queue. A stage starts when the previous stage of its run is done, and is marked failed when its script exits
+with an error or its log lacks the completion message checked by run_ww_analysis_auto.sh, which stops the chain.
+The queue survives restarts: stages that were running when the watcher stopped are started again. When the queue
+file is new, the runs already completed on the first scan are only recorded as seen, so starting the watcher does
+not re-run the analysis of the whole archive; --process-existing enqueues them instead.
+
+Usage: run_watcher.py [--output-dir /Volumes/NGS/Output] [--ww-dir /Volumes/IDGenomics_NAS/wastewater_sequencing]
+                      [--queue run_watcher_queue.sqlite] [--interval 60] [--max-jobs 1] [--poll] [--once] [--status]
+                      [--seed-existing | --process-existing]
+"""
+
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from samplesheet import SampleSheet
+
+SCRIPT_DIR = '/Volumes/NGS/Bioinformatics/ww_analysis_scripts/Wastewater-genomic-analysis'
+OUTPUT_DIR = '/Volumes/NGS/Output'
+WW_DIR = '/Volumes/IDGenomics_NAS/wastewater_sequencing'
+INSTRUMENT_PREFIX = 'VH'
+
+COPY_COMPLETE = 'CopyComplete.txt'
+FASTQGEN_COMPLETE = 'fastqgen_complete.txt'
+
+# Messages printed by the stage scripts when they complete, as checked by run_ww_analysis_auto.sh
+SETUP_DONE = 'ready for downstream bioinformatics analysis'
+VIRALRECON_DONE = 'Pipeline completed successfully'
+FREYJA_DONE = 'Freyja analysis post-processing completed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_key TEXT PRIMARY KEY,
+    run_name TEXT NOT NULL,
+    marker TEXT NOT NULL,
+    detected_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    command TEXT NOT NULL,
+    success_text TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    returncode INTEGER,
+    log_file TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+"""
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def output_run_name(raw_run):
+    # '<yymmdd>_<instrument>_<counter>_<flowcell>' -> 'UT-<instrument>-<yymmdd>', as in detect_new_ww_VHrun.sh
+    fields = raw_run.split('_')
+    return f'UT-{fields[1]}-{fields[0]}'
+
+
+def output_run_stages(raw_run, run_name, script_dir=SCRIPT_DIR):
+    """Stages of a run found in the sequencer output directory."""
+    return [
+        ('setup', ['bash', os.path.join(script_dir, 'detect_new_ww_VHrun.sh'), f'{raw_run}/'], SETUP_DONE),
+        ('viralrecon', ['bash', os.path.join(script_dir, 'run_viralrecon.sh'), run_name], VIRALRECON_DONE),
+        ('freyja', ['bash', os.path.join(script_dir, 'run_freyja.sh'), run_name], FREYJA_DONE),
+    ]
+
+
+def ww_run_stages(run_name, script_dir=SCRIPT_DIR):
+    """Stages of a run copied to the wastewater sequencing directory, as in run_ww_analysis_auto.sh."""
+    return [
+        ('setup', ['bash', os.path.join(script_dir, 'setup_ww_seq.sh'), run_name], SETUP_DONE),
+        ('viralrecon', ['bash', os.path.join(script_dir, 'run_viralrecon.sh'), run_name], VIRALRECON_DONE),
+        ('freyja', ['bash', os.path.join(script_dir, 'run_freyja.sh'), run_name], FREYJA_DONE),
+    ]
+
+
+class JobQueue:
+    """
+    Persistent SQLite queue of run stages.
+
+    Parameters:
+    path (str): Location of the SQLite database file. It is created if it does not exist.
+
+    Attributes:
+    is_new (bool): True when the database file did not exist yet.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.is_new = not os.path.exists(path)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue_run(self, run_key, run_name, marker, stages):
+        """
+        Add the stages of a completed run, unless the run was already enqueued.
+
+        Parameters:
+        run_key (str): Unique key of the run folder, e.g. its path.
+        run_name (str): Run name used by the stage scripts.
+        marker (str): Completion marker that was found.
+        stages (list): (stage name, command list, completion message) tuples, in order.
+
+        Returns:
+        bool: True when the run was enqueued, False when it was already known.
+        """
+        with self.conn:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?)",
+                                       (run_key, run_name, marker, _now()))
+            if cursor.rowcount == 0:
+                return False
+            self.conn.executemany(
+                "INSERT INTO jobs (run_name, stage, position, command, success_text, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(run_name, stage, position, json.dumps(command), success_text, _now())
+                 for position, (stage, command, success_text) in enumerate(stages)])
+        return True
+
+    def seed_run(self, run_key, run_name, marker):
+        """
+        Record a run as seen without enqueuing its stages, so it is never processed by the watcher.
+
+        Returns:
+        bool: True when the run was recorded, False when it was already known.
+        """
+        with self.conn:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?)",
+                                       (run_key, run_name, marker, _now()))
+        return cursor.rowcount > 0
+
+    def is_known(self, run_key):
+        return self.conn.execute("SELECT 1 FROM runs WHERE run_key = ?", (run_key,)).fetchone() is not None
+
+    def next_ready(self, exclude_runs=()):
+        """
+        Returns:
+        sqlite3.Row: The oldest pending stage whose previous stage is done, or None.
+        """
+        rows = self.conn.execute(
+            "SELECT * FROM jobs AS job WHERE status = 'pending' AND NOT EXISTS ("
+            "  SELECT 1 FROM jobs AS previous WHERE previous.run_name = job.run_name"
+            "  AND previous.position < job.position AND previous.status != 'done') "
+            "ORDER BY id").fetchall()
+        for row in rows:
+            if row['run_name'] not in exclude_runs:
+                return row
+        return None
+
+    def mark(self, job_id, status, returncode=None, log_file=None):
+        column = 'started_at' if status == 'running' else 'finished_at'
+        with self.conn:
+            self.conn.execute(
+                f"UPDATE jobs SET status = ?, returncode = COALESCE(?, returncode), "
+                f"log_file = COALESCE(?, log_file), {column} = ? WHERE id = ?",
+                (status, returncode, log_file, _now(), job_id))
+
+    def recover(self):
+        # Stages left running by a stopped watcher are started again
+        with self.conn:
+            return self.conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'").rowcount
+
+    def jobs(self):
+        return self.conn.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+
+
+def find_completed_runs(output_dir=OUTPUT_DIR, ww_dir=WW_DIR, instrument_prefix=INSTRUMENT_PREFIX):
+    """
+    Poll the watched directories for run folders with a completion marker.
+
+    Yields:
+    tuple: (run_key, run_name, marker path, stages)
+    """
+    if output_dir and os.path.isdir(output_dir):
+        with os.scandir(output_dir) as instruments:
+            instrument_dirs = [entry.path for entry in instruments
+                               if entry.is_dir() and entry.name.startswith(instrument_prefix)]
+        for instrument_dir in instrument_dirs:
+            with os.scandir(instrument_dir) as runs:
+                for entry in runs:
+                    marker = os.path.join(entry.path, COPY_COMPLETE)
+                    if entry.is_dir() and entry.name.count('_') >= 1 and os.path.exists(marker):
+                        yield output_run(entry.path)
+
+    if ww_dir and os.path.isdir(ww_dir):
+        with os.scandir(ww_dir) as runs:
+            for entry in runs:
+                marker = os.path.join(entry.path, FASTQGEN_COMPLETE)
+                if entry.is_dir() and os.path.exists(marker):
+                    yield ww_run(entry.path)
+
+
+def output_run(run_dir):
+    raw_run = os.path.basename(os.path.normpath(run_dir))
+    run_name = output_run_name(raw_run)
+    return run_dir, run_name, os.path.join(run_dir, COPY_COMPLETE), output_run_stages(raw_run, run_name)
+
+
+def ww_run(run_dir):
+    run_name = os.path.basename(os.path.normpath(run_dir))
+    return run_dir, run_name, os.path.join(run_dir, FASTQGEN_COMPLETE), ww_run_stages(run_name)
+
+
+def has_wastewater_samples(run_dir):
+    # Sequencer output runs without wastewater samples are never enqueued
+    sample_sheet = os.path.join(run_dir, 'SampleSheet.csv')
+    return os.path.exists(sample_sheet) and SampleSheet(sample_sheet).has_wastewater()
+
+
+def start_event_observer(paths, events):
+    """
+    Push the folders of new completion markers to the events queue using watchdog, when it is installed.
+
+    Returns:
+    Observer: The started observer, or None when watchdog is not available.
+    """
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        return None
+
+    class MarkerHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            path = getattr(event, 'dest_path', None) or event.src_path
+            if os.path.basename(path) in (COPY_COMPLETE, FASTQGEN_COMPLETE):
+                events.put(os.path.dirname(path))
+
+    observer = Observer()
+    for path in paths:
+        if path and os.path.isdir(path):
+            observer.schedule(MarkerHandler(), path, recursive=True)
+    observer.start()
+    return observer
+
+
+class Watcher:
+    """
+    Detect completed runs, enqueue their stages and run up to max_jobs stages at a time.
+
+    With seed_existing, the runs found by the first scan are recorded as seen instead of being enqueued. It defaults
+    to True when the job queue is new.
+    """
+    def __init__(self, job_queue, output_dir=OUTPUT_DIR, ww_dir=WW_DIR, log_dir='.', max_jobs=1,
+                 instrument_prefix=INSTRUMENT_PREFIX, seed_existing=None):
+        self.queue = job_queue
+        self.seed_existing = job_queue.is_new if seed_existing is None else seed_existing
+        self.output_dir = output_dir
+        self.ww_dir = ww_dir
+        self.log_dir = log_dir
+        self.max_jobs = max_jobs
+        self.instrument_prefix = instrument_prefix
+        self.running = {}  # job id -> (Popen, log file handle, job row)
+
+    def enqueue(self, run_key, run_name, marker, stages):
+        if self.queue.is_known(run_key):
+            return False
+        if os.path.basename(marker) == COPY_COMPLETE and not has_wastewater_samples(run_key):
+            return False
+        if self.queue.enqueue_run(run_key, run_name, marker, stages):
+            print(f"{_now()} : Run {run_name} is complete ({marker}). Enqueued {', '.join(stage for stage, _, _ in stages)}")
+            return True
+        return False
+
+    def scan(self):
+        runs = find_completed_runs(self.output_dir, self.ww_dir, self.instrument_prefix)
+        if self.seed_existing:
+            # Runs completed before the watcher was started are not processed again
+            self.seed_existing = False
+            seeded = sum(self.queue.seed_run(run_key, run_name, marker) for run_key, run_name, marker, _ in runs)
+            print(f"{_now()} : Recorded {seeded} already completed runs as seen, they will not be processed")
+            return 0
+        return sum(self.enqueue(*run) for run in runs)
+
+    def handle_event(self, run_dir):
+        # Event for a marker file: the run folder is either under the output or the wastewater directory
+        if os.path.exists(os.path.join(run_dir, COPY_COMPLETE)):
+            return self.enqueue(*output_run(run_dir))
+        if os.path.exists(os.path.join(run_dir, FASTQGEN_COMPLETE)):
+            return self.enqueue(*ww_run(run_dir))
+        return False
+
+    def start_jobs(self):
+        while len(self.running) < self.max_jobs:
+            busy_runs = {job['run_name'] for _, _, job in self.running.values()}
+            job = self.queue.next_ready(busy_runs)
+            if job is None:
+                return
+            log_file = os.path.join(self.log_dir, f"{job['run_name']}_{job['stage']}.log")
+            log = None
+            try:
+                log = open(log_file, 'a')
+                process = subprocess.Popen(json.loads(job['command']), stdout=log, stderr=subprocess.STDOUT)
+            except OSError as error:
+                # A stage that cannot be started (missing script, permissions) fails and stops the chain of its run
+                if log is not None:
+                    log.write(f"{_now()} : Could not start {job['stage']}: {error}\n")
+                    log.close()
+                self.queue.mark(job['id'], 'failed', log_file=log_file if log is not None else None)
+                print(f"{_now()} : {job['stage']} for run {job['run_name']} could not be started ({error}), "
+                      f"the next stages will not run")
+                continue
+            self.queue.mark(job['id'], 'running', log_file=log_file)
+            self.running[job['id']] = (process, log, job)
+            print(f"{_now()} : Started {job['stage']} for run {job['run_name']}, logging to {log_file}")
+
+    def check_jobs(self):
+        for job_id, (process, log, job) in list(self.running.items()):
+            returncode = process.poll()
+            if returncode is None:
+                continue
+            log.close()
+            del self.running[job_id]
+            succeeded = returncode == 0 and _log_contains(log.name, job['success_text'])
+            self.queue.mark(job_id, 'done' if succeeded else 'failed', returncode)
+            print(f"{_now()} : {job['stage']} for run {job['run_name']} "
+                  f"{'completed' if succeeded else f'failed (exit code {returncode}), the next stages will not run'}")
+
+    def tick(self):
+        self.check_jobs()
+        self.start_jobs()
+
+
+def _log_contains(log_file, text):
+    if not text:
+        return True
+    with open(log_file, errors='replace') as log:
+        return any(text.lower() in line.lower() for line in log)
+
+
+def print_status(job_queue):
+    print(f"{'id':>5}  {'run':<28}{'stage':<12}{'status':<10}{'started':<21}{'finished':<21}")
+    for job in job_queue.jobs():
+        print(f"{job['id']:>5}  {job['run_name']:<28}{job['stage']:<12}{job['status']:<10}"
+              f"{job['started_at'] or '':<21}{job['finished_at'] or '':<21}")
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Watch for completed sequencing runs and run the wastewater analysis stages.')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help='Sequencer output directory with <instrument>/<raw_run> folders')
+    parser.add_argument('--ww-dir', default=WW_DIR, help='Wastewater sequencing directory with <run_name> folders')
+    parser.add_argument('--instrument-prefix', default=INSTRUMENT_PREFIX, help='Instrument folders of the output directory to watch')
+    parser.add_argument('--queue', default='run_watcher_queue.sqlite', help='SQLite job queue')
+    parser.add_argument('--log-dir', default=None, help='Directory of the stage logs (default: next to the queue)')
+    parser.add_argument('--interval', type=float, default=60, help='Seconds between polls of the watched directories')
+    parser.add_argument('--max-jobs', type=int, default=1, help='Number of stages run at the same time')
+    parser.add_argument('--poll', action='store_true', help='Only poll, even when watchdog is installed')
+    parser.add_argument('--once', action='store_true', help='Scan once, run the queued stages to completion and exit')
+    parser.add_argument('--status', action='store_true', help='Print the job queue and exit')
+    seed = parser.add_mutually_exclusive_group()
+    seed.add_argument('--seed-existing', action='store_true',
+                      help='Record the runs already completed as seen without processing them (default for a new queue)')
+    seed.add_argument('--process-existing', action='store_true',
+                      help='Enqueue the runs already completed when the queue is new, instead of recording them as seen')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_arguments(args)
+    job_queue = JobQueue(args.queue)
+    if args.status:
+        print_status(job_queue)
+        return 0
+
+    log_dir = args.log_dir or os.path.join(os.path.dirname(os.path.abspath(args.queue)), 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    recovered = job_queue.recover()
+    if recovered:
+        print(f"{_now()} : {recovered} stages interrupted by the last shutdown will be started again")
+
+    seed_existing = args.seed_existing or (job_queue.is_new and not args.process_existing)
+    watcher = Watcher(job_queue, args.output_dir, args.ww_dir, log_dir, args.max_jobs, args.instrument_prefix,
+                      seed_existing)
+    events = queue.Queue()
+    observer = None if args.poll or args.once else start_event_observer([args.output_dir, args.ww_dir], events)
+    print(f"{_now()} : Watching {args.output_dir} and {args.ww_dir} "
+          f"({'file system events and ' if observer else ''}polling every {args.interval:g}s)")
+
+    next_scan = 0
+    try:
+        while True:
+            if time.monotonic() >= next_scan:
+                watcher.scan()
+                next_scan = time.monotonic() + args.interval
+            while not events.empty():
+                watcher.handle_event(events.get())
+            watcher.tick()
+            if args.once and not watcher.running and job_queue.next_ready() is None:
+                break
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"{_now()} : Stopping. {len(watcher.running)} running stages will be restarted on the next start")
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+        job_queue.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
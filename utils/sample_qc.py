@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Sample QC index built from the viralrecon MultiQC variants metrics table.
+
+'<run_name>_summary_variants_metrics_mqc.csv' is parsed once and its columns are looked up by header name,
+so the genome coverage and median depth of any sample are available in O(1) and the lookup keeps working
+if MultiQC reorders its columns. The index is used to write the filtered sample manifest consumed by the
+Freyja stage (freyja_scheduler.py).
+
+Usage: sample_qc.py <coverage_file> <bam_dir> <manifest_file> [--coverage-threshold 40]
+"""
+
+import argparse
+import csv
+import glob
+import os
+import sys
+
+BAM_SUFFIX = '.ivar_trim.sorted.bam'
+COVERAGE_THRESHOLD = 40  # Set 40% as the threshold
+
+# Header names used by viralrecon for the coverage breadth and median depth metrics
+COVERAGE_COLUMN = '% Coverage > 10x'
+MEDIAN_DEPTH_COLUMN = 'Coverage median'
+
+MANIFEST_COLUMNS = ['sample', 'identifier', 'bam', 'coverage', 'median_depth', 'passed']
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SampleQCIndex:
+    """
+    Per-sample coverage and median depth read from the MultiQC variants metrics CSV.
+
+    Parameters:
+    metrics_file (str): Path to '<run_name>_summary_variants_metrics_mqc.csv'.
+    coverage_column (str): Header of the genome coverage column used for gating.
+    median_depth_column (str): Header of the median depth column.
+    """
+    def __init__(self, metrics_file, coverage_column=COVERAGE_COLUMN, median_depth_column=MEDIAN_DEPTH_COLUMN):
+        self.coverage = {}
+        self.median_depth = {}
+        with open(metrics_file, newline='') as metrics:
+            reader = csv.DictReader(metrics)
+            # Match the headers case-insensitively and ignore surrounding whitespace
+            headers = {name.strip().lower(): name for name in reader.fieldnames or []}
+            missing = [column for column in (coverage_column, median_depth_column) if column.lower() not in headers]
+            if missing:
+                raise ValueError(f"Column(s) {', '.join(missing)} not found in {metrics_file}")
+            sample_column = reader.fieldnames[0]
+            coverage_column = headers[coverage_column.lower()]
+            median_depth_column = headers[median_depth_column.lower()]
+
+            for row in reader:
+                sample = row[sample_column].strip()
+                self.coverage[sample] = _to_float(row[coverage_column])
+                self.median_depth[sample] = _to_float(row[median_depth_column])
+
+    def __contains__(self, sample):
+        return sample in self.coverage
+
+    def get_coverage(self, sample):
+        return self.coverage.get(sample)
+
+    def get_median_depth(self, sample):
+        return self.median_depth.get(sample)
+
+    def passes(self, sample, coverage_threshold=COVERAGE_THRESHOLD):
+        coverage = self.coverage.get(sample)
+        return coverage is not None and coverage >= coverage_threshold
+
+    def build_manifest(self, bam_dir, coverage_threshold=COVERAGE_THRESHOLD):
+        """
+        Build the sample manifest for the primer-trimmed BAM files of a run.
+
+        Parameters:
+        bam_dir (str): Directory with the '*.ivar_trim.sorted.bam' files.
+        coverage_threshold (float): Minimum genome coverage for a sample to pass.
+
+        Returns:
+        list: One dict per BAM with MANIFEST_COLUMNS keys, sorted by identifier. 'sample' drops the
+        trailing '-UT...' run tag from the identifier, as in run_freyja.sh.
+        """
+        manifest = []
+        for bam in sorted(glob.glob(os.path.join(bam_dir, f'*{BAM_SUFFIX}'))):
+            identifier = os.path.basename(bam)[:-len(BAM_SUFFIX)]
+            manifest.append({
+                'sample': identifier.rsplit('-UT', 1)[0],
+                'identifier': identifier,
+                'bam': bam,
+                'coverage': self.get_coverage(identifier),
+                'median_depth': self.get_median_depth(identifier),
+                'passed': self.passes(identifier, coverage_threshold),
+            })
+        return manifest
+
+
+def write_manifest(manifest, manifest_file):
+    with open(manifest_file, 'w', newline='') as output:
+        writer = csv.DictWriter(output, fieldnames=MANIFEST_COLUMNS)
+        writer.writeheader()
+        writer.writerows(manifest)
+
+
+def read_manifest(manifest_file):
+    with open(manifest_file, newline='') as manifest:
+        rows = list(csv.DictReader(manifest))
+    for row in rows:
+        row['coverage'] = _to_float(row['coverage'])
+        row['median_depth'] = _to_float(row['median_depth'])
+        row['passed'] = row['passed'] == 'True'
+    return rows
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Write the coverage-filtered Freyja sample manifest for a run.')
+    parser.add_argument('coverage_file', help='MultiQC summary_variants_metrics_mqc.csv file')
+    parser.add_argument('bam_dir', help='Directory with the *.ivar_trim.sorted.bam files')
+    parser.add_argument('manifest_file', help='Output manifest CSV')
+    parser.add_argument('--coverage-threshold', type=float, default=COVERAGE_THRESHOLD,
+                        help='Minimum genome coverage (percent) for a sample to pass')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_arguments(args)
+    manifest = SampleQCIndex(args.coverage_file).build_manifest(args.bam_dir, args.coverage_threshold)
+    write_manifest(manifest, args.manifest_file)
+    n_passed = sum(row['passed'] for row in manifest)
+    print(f"{n_passed} of {len(manifest)} samples passed the {args.coverage_threshold}% coverage threshold. "
+          f"Manifest written to {args.manifest_file}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Parser for Illumina sample sheets (v2 and v1) used to find the wastewater samples of a sequencing run.
+
+The sample sheet is read once and split into its '[Section]' blocks. Samples are classified with explicit rules:
+
+1. Sample rows are the rows of the data sections ('[BCLConvert_Data]', '[Cloud_Data]', '[Data]', ...), keyed by
+   their exact 'Sample_ID'.
+2. A sample is clinical when any field of any of its rows matches CLINICAL_PATTERN (case-insensitive).
+3. Every other sample listed in '[Cloud_Data]' (or in any data section when the sheet has no '[Cloud_Data]') is a
+   wastewater sample.
+
+The wastewater sample list, the clinical sample list and the sample sheet without the clinical sample rows are
+written in a single pass. Rows are matched on their Sample_ID, not on a substring of the line.
+
+--check only decides whether the run is a wastewater run. Like the former 'grep -i wastewater', it succeeds when
+wastewater is mentioned anywhere in the sheet, including the '[Header]' and project fields.
+
+Usage: samplesheet.py <SampleSheet.csv> <analysis_dir> <run_name> [--check]
+"""
+
+import argparse
+import csv
+import os
+import re
+import sys
+
+CLINICAL_PATTERN = re.compile(r'patient|covidseq|flu|influenza|RSV|measles', re.IGNORECASE)
+WASTEWATER_PATTERN = re.compile(r'wastewater', re.IGNORECASE)
+SECTION_PATTERN = re.compile(r'^\[(?P<name>[^\]]+)\]')
+SAMPLE_ID_COLUMN = 'Sample_ID'
+CLOUD_DATA = 'Cloud_Data'
+
+
+class SampleSheet:
+    """
+    Sample sheet split into sections.
+
+    Parameters:
+    path (str): Path to the SampleSheet.csv file.
+
+    Attributes:
+    lines (list): (section name or None, raw line, parsed fields) for every line of the file, in order.
+    sections (dict): Parsed rows of each section, in file order.
+    data (dict): For each data section, its rows as dicts keyed by the section's column header.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lines = []
+        self.sections = {}
+        section = None
+        with open(path, newline='') as sample_sheet:
+            for raw_line in sample_sheet:
+                fields = next(csv.reader([raw_line]), [])
+                match = SECTION_PATTERN.match(fields[0].strip()) if fields else None
+                if match:
+                    section = match.group('name')
+                    self.sections.setdefault(section, [])
+                elif section is not None and any(field.strip() for field in fields):
+                    self.sections[section].append(fields)
+                self.lines.append((section, raw_line, fields))
+
+        self.data = {}
+        for name, rows in self.sections.items():
+            if name.endswith('Data') and rows and rows[0][0].strip() == SAMPLE_ID_COLUMN:
+                header = [column.strip() for column in rows[0]]
+                self.data[name] = [dict(zip(header, (field.strip() for field in row))) for row in rows[1:]]
+
+    def sample_rows(self):
+        """
+        Returns:
+        dict: All data section rows of each Sample_ID, in file order.
+        """
+        samples = {}
+        for rows in self.data.values():
+            for row in rows:
+                if row.get(SAMPLE_ID_COLUMN):
+                    samples.setdefault(row[SAMPLE_ID_COLUMN], []).append(row)
+        return samples
+
+    def classify(self):
+        """
+        Classify every sample as 'clinical' or 'wastewater' with the rules of the module docstring.
+
+        Returns:
+        dict: Class of each Sample_ID, in file order. Samples that are neither clinical nor listed in the
+        wastewater section are not included.
+        """
+        listed = self.data.get(CLOUD_DATA)
+        listed = None if listed is None else {row.get(SAMPLE_ID_COLUMN) for row in listed}
+        classes = {}
+        for sample, rows in self.sample_rows().items():
+            if any(CLINICAL_PATTERN.search(value) for row in rows for value in row.values() if value):
+                classes[sample] = 'clinical'
+            elif listed is None or sample in listed:
+                classes[sample] = 'wastewater'
+        return classes
+
+    def has_wastewater(self):
+        # A run has wastewater samples when any line of the sheet mentions wastewater, as with 'grep -i wastewater':
+        # some sheets only name the project in '[Header]' (RunName, Description) or in the project fields
+        return any(WASTEWATER_PATTERN.search(raw_line) for _, raw_line, _ in self.lines)
+
+    def write_filtered(self, output_file, exclude):
+        """
+        Write the sample sheet without the data rows of the excluded samples. All other lines are copied as is.
+        """
+        with open(output_file, 'w', newline='') as output:
+            for section, raw_line, fields in self.lines:
+                in_data = section in self.data
+                if in_data and fields and fields[0].strip() in exclude:
+                    continue
+                output.write(raw_line)
+
+
+def write_sample_lists(sample_sheet, analysis_dir, run_name):
+    """
+    Write '<run_name>_wastewater_sample_list.csv', '<run_name>_clinical_sample_list.txt' and
+    '<run_name>_Samplesheet_ww.csv' to analysis_dir.
+
+    Returns:
+    dict: Class of each Sample_ID.
+    """
+    classes = sample_sheet.classify()
+    clinical = [sample for sample, sample_class in classes.items() if sample_class == 'clinical']
+    wastewater = [sample for sample, sample_class in classes.items() if sample_class == 'wastewater']
+
+    with open(os.path.join(analysis_dir, f'{run_name}_wastewater_sample_list.csv'), 'w') as output:
+        output.writelines(f'{sample}\n' for sample in wastewater)
+    with open(os.path.join(analysis_dir, f'{run_name}_clinical_sample_list.txt'), 'w') as output:
+        output.writelines(f'{sample}\n' for sample in clinical)
+    sample_sheet.write_filtered(os.path.join(analysis_dir, f'{run_name}_Samplesheet_ww.csv'), set(clinical))
+    return classes
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Write the wastewater sample list and sample sheet of a run.')
+    parser.add_argument('sample_sheet', help='Illumina SampleSheet.csv of the run')
+    parser.add_argument('analysis_dir', nargs='?', default=None, help='Directory the sample lists are written to')
+    parser.add_argument('run_name', nargs='?', default=None, help='Run name used in the output file names')
+    parser.add_argument('--check', action='store_true',
+                        help='Only check for wastewater samples: exit with 0 if the run has any, 1 otherwise')
+    parsed_args = parser.parse_args(args)
+    if not parsed_args.check and (parsed_args.analysis_dir is None or parsed_args.run_name is None):
+        parser.error('analysis_dir and run_name are required unless --check is given')
+    return parsed_args
+
+
+def main(args=None):
+    args = parse_arguments(args)
+    sample_sheet = SampleSheet(args.sample_sheet)
+
+    if args.check:
+        return 0 if sample_sheet.has_wastewater() else 1
+
+    classes = write_sample_lists(sample_sheet, args.analysis_dir, args.run_name)
+    n_wastewater = sum(sample_class == 'wastewater' for sample_class in classes.values())
+    print(f"{n_wastewater} wastewater and {len(classes) - n_wastewater} clinical samples found in {args.sample_sheet}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Site registry for the wastewater sampling sites.
+
+'msd_short_names_lat_long.csv' is loaded once into a lookup indexed by the site code (msd_shrtnm). Wastewater
+sample IDs ('<yymmdd>_<site code>') are parsed with one compiled regex, and each distinct date string is only
+converted to a date once. Sites missing from the registry are reported instead of being dropped by an inner join.
+"""
+
+import functools
+import re
+from datetime import datetime
+
+import pandas as pd
+
+from instrumentation import timed
+
+# '<yymmdd>_<site code>', the site code is everything after the first underscore
+SAMPLE_ID_PATTERN = re.compile(r'^(?P<date>\d{6})_(?P<site>.+)$')
+DATE_FORMAT = '%y%m%d'
+
+
+@functools.lru_cache(maxsize=None)
+def parse_collection_date(date_str):
+    # Collection dates repeat for every lineage and every sample of a day, so each string is parsed once
+    try:
+        return datetime.strptime(date_str, DATE_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_sample_id(sample_id):
+    """
+    Split a wastewater sample ID into its collection date and site code.
+
+    Returns:
+    tuple: (datetime or None, site code or None)
+    """
+    match = SAMPLE_ID_PATTERN.match(sample_id) if isinstance(sample_id, str) else None
+    if match is None:
+        return None, None
+    return parse_collection_date(match.group('date')), match.group('site')
+
+
+class SiteRegistry:
+    """
+    Lookup of site name and coordinates by site code.
+
+    Parameters:
+    lat_long_file (str): CSV with 'msd_name', 'msd_shrtnm', 'longitutde' and 'latitude' columns.
+    """
+    def __init__(self, lat_long_file):
+        sites = pd.read_csv(lat_long_file, sep=',')
+        # Keep the first row of a site code listed twice, so every code resolves to one site
+        self.sites = sites.drop_duplicates(subset='msd_shrtnm').set_index('msd_shrtnm')
+        self.columns = list(self.sites.columns)
+
+    def __contains__(self, site_code):
+        return site_code in self.sites.index
+
+    def lookup(self, site_code):
+        """
+        Returns:
+        dict: Site columns for the site code, or None when it is not registered.
+        """
+        if site_code not in self.sites.index:
+            return None
+        return self.sites.loc[site_code].to_dict()
+
+    @timed('annotate_sites')
+    def annotate(self, df, sample_col='sample_id'):
+        """
+        Add 'collection_date', 'msd_shrtnm' and the site columns to a lineage DataFrame.
+
+        Sample IDs are parsed once per unique value. Rows whose site code is not in the registry are kept with
+        empty site columns, and rows whose sample ID cannot be parsed are removed; both are listed in the report.
+
+        Parameters:
+        df (pd.DataFrame): Lineage data with a sample ID column.
+        sample_col (str): Name of the sample ID column.
+
+        Returns:
+        tuple: The annotated DataFrame and a report DataFrame with one row per unmatched sample ID, its site
+        code, the reason ('unparsed_sample_id' or 'unknown_site') and the number of rows.
+        """
+        # Map plain values, the sample ID column may be categorical
+        sample_ids = df[sample_col].astype(object)
+        parsed = {sample_id: parse_sample_id(sample_id) for sample_id in sample_ids.dropna().unique()}
+        parsed_ids = pd.DataFrame.from_dict(parsed, orient='index', columns=['collection_date', 'msd_shrtnm'])
+
+        annotated = df.copy()
+        annotated['collection_date'] = pd.to_datetime(sample_ids.map(parsed_ids['collection_date']))
+        annotated['msd_shrtnm'] = sample_ids.map(parsed_ids['msd_shrtnm'])
+        site_columns = self.sites.reindex(annotated['msd_shrtnm'])
+        for column in self.columns:
+            annotated[column] = site_columns[column].to_numpy()
+
+        unparsed = annotated['collection_date'].isna()
+        unknown = ~unparsed & ~annotated['msd_shrtnm'].isin(self.sites.index)
+        unmatched = unparsed | unknown
+        report = (pd.DataFrame({sample_col: sample_ids[unmatched], 'msd_shrtnm': annotated['msd_shrtnm'][unmatched],
+                                'reason': unparsed[unmatched].map({True: 'unparsed_sample_id', False: 'unknown_site'})})
+                  .groupby([sample_col, 'msd_shrtnm', 'reason'], dropna=False)
+                  .size().rename('n_rows').reset_index())
+
+        return annotated[~unparsed], report
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Stage the wastewater FASTQ files of a sequencing run for analysis and NCBI submission.
+
+Replaces the find | grep -zf | parallel mv, the failed sample size filter and the rename/cp loop of
+setup_ww_seq.sh and detect_new_ww_VHrun.sh. The wastewater sample list is loaded into a set and every FASTQ
+file name is parsed ('<sample>_S<n>[_L<lane>]_R<1|2>_001.fastq.gz') so samples are matched on their exact ID
+instead of a substring of the path. The analysis name, NCBI name or failed-sample destination of every file is
+computed in one pass, then the files are moved (or copied) into raw_data/fastq and hard-linked (or copied when
+a hard link is not possible) into ncbi_submission by a thread pool.
+
+With --qc, samples are routed to failed_samples by the FASTQ pre-QC of fastq_qc.py (read count and mean base
+quality, streamed from the gzip files) instead of the file size, and the QC table is written to
+'<run_name>_fastq_qc.csv' in the analysis directory.
+
+Usage: stage_fastqs.py <run_name> <fastq_dir> <analysis_dir> --sample-list <file> [--copy] [--min-size 1048576]
+                       [--qc] [--min-reads 10000] [--min-mean-quality 20] [--workers 8] [--dry-run]
+"""
+
+import argparse
+import csv
+import os
+import re
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+FASTQ_PATTERN = re.compile(r'^(?P<sample>.+?)(?P<set_lane>_S\d+(?:_L\d+)?)?_(?P<read>R[12])_001\.fastq\.gz$')
+
+# Positive and negative controls are analysed but not submitted to NCBI
+CONTROL_PREFIXES = ('CPC', 'NTC')
+
+# FASTQ files smaller than this are moved to failed_samples (1MB)
+MIN_SIZE = 1024 * 1024
+
+NCBI_SUFFIX = '-UT'
+
+
+def load_sample_list(sample_list_file):
+    """
+    Read the wastewater sample IDs, one per line (extra CSV fields are ignored), into a set.
+    """
+    with open(sample_list_file, newline='') as sample_list:
+        return {row[0].strip() for row in csv.reader(sample_list) if row and row[0].strip()}
+
+
+def parse_fastq_name(filename):
+    """
+    Returns:
+    tuple: (sample ID, read 'R1' or 'R2'), or None when the name is not an Illumina FASTQ name.
+    """
+    match = FASTQ_PATTERN.match(filename)
+    if match is None:
+        return None
+    return match.group('sample'), match.group('read')
+
+
+def staged_names(sample, read, run_name):
+    """
+    Names of a FASTQ file for the analysis (raw_data/fastq) and for NCBI submission.
+
+    NovaSeq sample IDs already contain the run name: the set and lane identifiers are dropped for the analysis
+    name and the run name is replaced with '-UT' for NCBI. Other runs get the run name appended to the sample
+    ID for the analysis and '-UT' for NCBI.
+    """
+    if run_name in sample:
+        analysis_name = f'{sample}_{read}_001.fastq.gz'
+        ncbi_name = analysis_name.replace(f'-{run_name}', NCBI_SUFFIX, 1)
+    else:
+        analysis_name = f'{sample}-{run_name}_{read}_001.fastq.gz'
+        ncbi_name = f'{sample}{NCBI_SUFFIX}_{read}_001.fastq.gz'
+    return analysis_name, ncbi_name
+
+
+def _scan(fastq_dir, skip_dirs):
+    # Recursive os.scandir listing of the *.fastq.gz files, skipping the staging directories
+    stack = [fastq_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if os.path.abspath(entry.path) not in skip_dirs:
+                        stack.append(entry.path)
+                elif entry.name.endswith('.fastq.gz') and entry.is_file():
+                    yield entry
+
+
+def plan_staging(fastq_dir, samples, run_name, analysis_dir, min_size=MIN_SIZE):
+    """
+    Decide where every wastewater FASTQ file of fastq_dir goes, without touching any file.
+
+    Parameters:
+    fastq_dir (str): Directory searched recursively for *.fastq.gz files.
+    samples (set): Wastewater sample IDs.
+    run_name (str): Sequencing run name.
+    analysis_dir (str): Run analysis directory with raw_data/fastq, failed_samples and ncbi_submission.
+    min_size (int): Files smaller than this many bytes are moved to failed_samples.
+
+    Returns:
+    tuple: List of planned files (dicts with 'source', 'sample', 'read', 'size', 'status', 'destination' and
+    'ncbi_path'), and the sorted sample IDs of the list without any FASTQ file.
+    """
+    ww_fastq = os.path.join(analysis_dir, 'raw_data', 'fastq')
+    failed_dir = os.path.join(analysis_dir, 'failed_samples')
+    ncbi_dir = os.path.join(analysis_dir, 'ncbi_submission')
+    skip_dirs = {os.path.abspath(path) for path in (ww_fastq, failed_dir, ncbi_dir)}
+
+    plan = []
+    destinations = set()
+    found = set()
+    # Sorted by file name so the first lane of a sample is the one staged when lanes collide
+    for entry in sorted(_scan(fastq_dir, skip_dirs), key=lambda entry: (entry.name, entry.path)):
+        parsed = parse_fastq_name(entry.name)
+        if parsed is None:
+            continue
+        sample, read = parsed
+        # NovaSeq FASTQ names carry the run name after the sample ID of the sample sheet
+        list_id = sample if sample in samples else sample.replace(f'-{run_name}', '', 1)
+        if list_id not in samples:
+            continue
+        found.add(list_id)
+
+        size = entry.stat().st_size
+        item = {'source': entry.path, 'sample': sample, 'read': read, 'size': size, 'ncbi_path': None}
+        if size < min_size:
+            item['status'] = 'failed'
+            item['destination'] = os.path.join(failed_dir, entry.name)
+        else:
+            analysis_name, ncbi_name = staged_names(sample, read, run_name)
+            item['status'] = 'staged'
+            item['destination'] = os.path.join(ww_fastq, analysis_name)
+            if not sample.startswith(CONTROL_PREFIXES):
+                item['ncbi_path'] = os.path.join(ncbi_dir, ncbi_name)
+
+        # Files of several lanes of one sample would overwrite each other once renamed
+        if item['destination'] in destinations:
+            item['status'] = 'duplicate'
+            item['ncbi_path'] = None
+        destinations.add(item['destination'])
+        plan.append(item)
+
+    plan.sort(key=lambda item: item['source'])
+    return plan, sorted(samples - found)
+
+
+def apply_qc(plan, qc_rows, analysis_dir):
+    """
+    Route the files of the samples that failed the pre-QC to failed_samples instead of raw_data/fastq.
+
+    Parameters:
+    plan (list): Planned files from plan_staging.
+    qc_rows (list): QC table rows from fastq_qc.qc_samples.
+    analysis_dir (str): Run analysis directory.
+
+    Returns:
+    list: The updated plan.
+    """
+    failed = {row['sample'] for row in qc_rows if row['status'] == 'fail'}
+    failed_dir = os.path.join(analysis_dir, 'failed_samples')
+    for item in plan:
+        if item['status'] == 'staged' and item['sample'] in failed:
+            item['status'] = 'failed'
+            item['destination'] = os.path.join(failed_dir, os.path.basename(item['source']))
+            item['ncbi_path'] = None
+    return plan
+
+
+def qc_sample_files(plan):
+    # FASTQ files of every staged sample keyed by read, the input of fastq_qc.qc_samples
+    sample_files = {}
+    for item in plan:
+        if item['status'] == 'staged':
+            sample_files.setdefault(item['sample'], {})[item['read']] = item['source']
+    return sample_files
+
+
+def link_or_copy(source, destination):
+    # A hard link costs no space or copy time; fall back to a copy across file systems
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+        return 'link'
+    except OSError:
+        shutil.copy2(source, destination)
+        return 'copy'
+
+
+def _stage_file(item, copy=False):
+    if item['status'] == 'duplicate':
+        return item
+    if copy:
+        shutil.copy2(item['source'], item['destination'])
+    else:
+        shutil.move(item['source'], item['destination'])
+    if item['ncbi_path']:
+        item['ncbi_method'] = link_or_copy(item['destination'], item['ncbi_path'])
+    return item
+
+
+def execute_plan(plan, analysis_dir, copy=False, workers=8, dry_run=False):
+    """
+    Move (or copy) the planned files and link them into ncbi_submission with a thread pool.
+
+    With dry_run the planned actions are printed and no file is touched.
+    """
+    if dry_run:
+        for item in plan:
+            action = 'copy' if copy else 'move'
+            ncbi = f" and link to {item['ncbi_path']}" if item['ncbi_path'] else ''
+            print(f"[dry-run] {item['status']}: {action} {item['source']} to {item['destination']}{ncbi}")
+        return plan
+
+    for subdir in (os.path.join('raw_data', 'fastq'), 'failed_samples', 'ncbi_submission'):
+        os.makedirs(os.path.join(analysis_dir, subdir), exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda item: _stage_file(item, copy), plan))
+
+
+def write_ncbi_info(plan, info_file):
+    """
+    Write the '<run_name>_ncbi_submission_info.csv' rows (sample ID, R1 file, R2 file) used in Data-flo to
+    build the NCBI submission templates.
+    """
+    ncbi_files = {os.path.basename(item['ncbi_path']) for item in plan if item['ncbi_path']}
+    rows = []
+    for file1 in sorted(name for name in ncbi_files if name.endswith('_R1_001.fastq.gz')):
+        sample_id = file1[:-len('_R1_001.fastq.gz')]
+        file2 = f'{sample_id}_R2_001.fastq.gz'
+        rows.append([sample_id, file1, file2 if file2 in ncbi_files else ''])
+    with open(info_file, 'w', newline='') as info:
+        csv.writer(info, lineterminator='\n').writerows(rows)
+    return rows
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Stage the wastewater FASTQ files of a run for analysis and NCBI submission.')
+    parser.add_argument('run_name', help='Sequencing run name, e.g. UT-VH00770-230600')
+    parser.add_argument('fastq_dir', help='Directory searched recursively for the run FASTQ files')
+    parser.add_argument('analysis_dir', help='Run analysis directory')
+    parser.add_argument('--sample-list', required=True, help='Wastewater sample list, one sample ID per line')
+    parser.add_argument('--copy', action='store_true', help='Copy the FASTQ files instead of moving them')
+    parser.add_argument('--min-size', type=int, default=None,
+                        help=f'FASTQ files smaller than this many bytes are moved to failed_samples '
+                             f'(default: {MIN_SIZE}, or no size limit with --qc)')
+    parser.add_argument('--qc', action='store_true',
+                        help='Route samples to failed_samples with the FASTQ pre-QC instead of the file size')
+    parser.add_argument('--min-reads', type=int, default=None, help='Pre-QC minimum number of reads (read pairs) per sample')
+    parser.add_argument('--min-mean-quality', type=float, default=None, help='Pre-QC minimum mean Phred base quality')
+    parser.add_argument('--workers', type=int, default=8, help='Number of files staged in parallel')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the planned moves, links and copies')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_arguments(args)
+    samples = load_sample_list(args.sample_list)
+    min_size = args.min_size if args.min_size is not None else 0 if args.qc else MIN_SIZE
+    plan, missing = plan_staging(args.fastq_dir, samples, args.run_name, args.analysis_dir, min_size)
+
+    if args.qc:
+        # Only needed with --qc, and fastq_qc imports parse_fastq_name from this module
+        import fastq_qc
+        qc_rows = fastq_qc.qc_samples(qc_sample_files(plan), args.workers,
+                                      fastq_qc.MIN_READS if args.min_reads is None else args.min_reads,
+                                      fastq_qc.MIN_MEAN_QUALITY if args.min_mean_quality is None else args.min_mean_quality)
+        plan = apply_qc(plan, qc_rows, args.analysis_dir)
+        n_failed = sum(row['status'] == 'fail' for row in qc_rows)
+        print(f"FASTQ pre-QC: {len(qc_rows) - n_failed} of {len(qc_rows)} samples passed")
+        for row in qc_rows:
+            if row['status'] == 'fail':
+                print(f"  {row['sample']} failed: {row['reason']}")
+        if not args.dry_run:
+            os.makedirs(args.analysis_dir, exist_ok=True)
+            fastq_qc.write_qc_table(qc_rows, os.path.join(args.analysis_dir, f'{args.run_name}_fastq_qc.csv'))
+
+    staged = execute_plan(plan, args.analysis_dir, args.copy, args.workers, args.dry_run)
+    counts = {status: sum(item['status'] == status for item in staged) for status in ('staged', 'failed', 'duplicate')}
+    failed_reason = 'that failed the pre-QC' if args.qc else f'smaller than {min_size} bytes'
+    print(f"{counts['staged']} FASTQ files staged in raw_data/fastq, {counts['failed']} {failed_reason} "
+          f"moved to failed_samples, {sum(bool(item['ncbi_path']) for item in staged)} linked to ncbi_submission.")
+    if counts['duplicate']:
+        print(f"WARNING: {counts['duplicate']} FASTQ files would overwrite another file of the same sample and were left in place: "
+              + ', '.join(item['source'] for item in staged if item['status'] == 'duplicate'))
+    if missing:
+        print(f"WARNING: {len(missing)} samples of the sample list have no FASTQ file: {', '.join(missing)}")
+
+    if not args.dry_run:
+        info_file = os.path.join(args.analysis_dir, f'{args.run_name}_ncbi_submission_info.csv')
+        rows = write_ncbi_info(staged, info_file)
+        print(f"{len(rows)} samples written to {info_file}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,49 +1,83 @@
 import re
+import json
+import functools
+import numpy as np
 import pandas as pd
 import os
+from pandas.api.types import is_list_like
+
+from instrumentation import timed
+
+def _split_column(col):
+    # Split space-joined Freyja fields into lists; columns already split by a previous pass are left as is
+    if len(col) and is_list_like(col.iloc[0]):
+        return col
+    return col.str.split()
+
+@timed('parse_lineage_aggregate')
+def parse_lineage_aggregate(agg_df, sample_col='sample_id'):
+    """
+    Convert the space-joined 'lineages' and 'abundances' columns of a Freyja aggregate table
+    straight into a long DataFrame with one row per sample and lineage, without a per-row Python loop.
+
+    Lineages and abundances are paired positionally like zip(), so a row with mismatched lengths is
+    truncated to the shorter list. A lineage repeated within a sample keeps its last abundance, as the
+    old linDict did.
+
+    Parameters:
+    agg_df (pd.DataFrame): Freyja aggregate data with sample_col, 'lineages' and 'abundances' columns.
+    sample_col (str): Column holding the sample identifier.
+
+    Returns:
+    pd.DataFrame: Long DataFrame with 'sample_id', 'lineage' and 'abundance' columns.
+    """
+    agg_df = agg_df.dropna(subset=['lineages', 'abundances'])
+    # Without any lineages left the columns are not strings, so there is nothing to split
+    if agg_df.empty:
+        return pd.DataFrame({'sample_id': pd.Series(dtype=object), 'lineage': pd.Series(dtype=object),
+                             'abundance': pd.Series(dtype=float)})
+    lineages = _split_column(agg_df['lineages']).reset_index(drop=True)
+    abundances = _split_column(agg_df['abundances']).reset_index(drop=True)
+
+    # Number of (lineage, abundance) pairs per sample, as zip() would produce
+    n_pairs = np.minimum(lineages.str.len().to_numpy(), abundances.str.len().to_numpy())
+
+    lin_long = lineages.explode()
+    abund_long = abundances.explode()
+    lin_keep = lin_long.groupby(level=0).cumcount().to_numpy() < n_pairs[lin_long.index]
+    abund_keep = abund_long.groupby(level=0).cumcount().to_numpy() < n_pairs[abund_long.index]
+    lin_long = lin_long[lin_keep]
+    abund_long = abund_long[abund_keep]
+
+    long_df = pd.DataFrame({
+        'row': lin_long.index,
+        'sample_id': agg_df[sample_col].to_numpy()[lin_long.index],
+        'lineage': lin_long.to_numpy(),
+        'abundance': pd.to_numeric(abund_long.to_numpy()).astype(float),
+    })
+    long_df = long_df.drop_duplicates(subset=['row', 'lineage'], keep='last').drop(columns='row')
+
+    return long_df.reset_index(drop=True)
 
 def prepLineageDict(agg_d0, thresh=0.001, config=None, lineage_info=None):
-    agg_d0.loc[:, 'lineages'] = agg_d0['lineages'].apply(lambda x:
-                                                         re.sub(' +', ' ', x)
-                                                           .split(' ')).copy()
-    agg_d0.loc[:, 'abundances'] = agg_d0['abundances'].apply(lambda x:
-                                                            re.sub(' +', ' ', x)
-                                                              .split(' ')).copy()
-    # print([float(abund) for abund in agg_d0.iloc[0].loc['abundances']])
+    agg_d0['lineages'] = _split_column(agg_d0['lineages'])
+    agg_d0['abundances'] = _split_column(agg_d0['abundances'])
     #Create 'linDict' column with mapped lineages and abundances values
-    agg_d0.loc[:, 'linDict'] = [{lin: float(abund) for lin, abund in
-                                zip(agg_d0.loc[samp, 'lineages'],
-                                    agg_d0.loc[samp, 'abundances'])}
-                                for samp in agg_d0.index]
+    agg_d0['linDict'] = [{lin: float(abund) for lin, abund in zip(lins, abunds)}
+                         for lins, abunds in zip(agg_d0['lineages'], agg_d0['abundances'])]
 
-   
     return agg_d0
 
 def expand_data(processed_data):
-    expanded_data = []
+    # Use the columnar parser whenever the split lineages/abundances are still available
+    if {'lineages', 'abundances'}.issubset(processed_data.columns):
+        return parse_lineage_aggregate(processed_data)
 
-    for index, row in processed_data.iterrows():
-        sample_id = row['sample_id']
-        # summarized = row['summarized']
-    
-        # Extract the summarized lineage value
-        # summarized_lineage = re.search(r"(\w+)", summarized)
-        #if summarized_lineage:
-        #    summarized_lineage_value = summarized_lineage.group(1)
-        #else:
-        #    summarized_lineage_value = None
+    expanded_data = [{'sample_id': sample_id, 'lineage': lineage, 'abundance': abundance}
+                     for sample_id, linDict in zip(processed_data['sample_id'], processed_data['linDict'])
+                     for lineage, abundance in linDict.items()]
 
-        linDict = row['linDict']
-
-        for lineage, abundance in linDict.items():
-            expanded_data.append({
-                'sample_id': sample_id,
-                'lineage': lineage,
-                'abundance': abundance,
-                #'summarized_lineage': summarized_lineage_value
-            })
-
-    return pd.DataFrame(expanded_data)
+    return pd.DataFrame(expanded_data, columns=['sample_id', 'lineage', 'abundance'])
 
 
 #def get_parent_lineage(lineage, lineage_mapping):
@@ -52,17 +86,72 @@ def expand_data(processed_data):
   #          return parent_lineage
   #  return 'NA'
 
-def get_parent_lineage(lineage, lineage_mapping):
-    if lineage.startswith("X"):
-        return "Recombinant"
-        
-    for parent_lineage_dict in lineage_mapping:
-        parent_lineage = parent_lineage_dict["name"]
-        prefixes = parent_lineage_dict["prefixes"]
-        if any(re.match(f"^{prefix}(\\.|$)", lineage) for prefix in prefixes):
-            return parent_lineage
+class LineageClassifier:
+    """
+    Assign lineages to the parent lineage groups defined in lineage_mapping.json.
+
+    The mapping prefixes are stored once in a trie over the dot-separated lineage components, so a
+    lineage is classified with a single walk instead of one regex match per prefix. Prefixes are
+    matched on whole components ('BA.2' matches 'BA.2' and 'BA.2.75' but not 'BA.21') and, when
+    several prefixes match, the group listed first in the mapping wins, as in get_parent_lineage.
+
+    Parameters:
+    lineage_mapping (list): List of {'name': ..., 'prefixes': [...]} dictionaries.
+    """
+    def __init__(self, lineage_mapping):
+        self.group_names = []
+        self._trie = {}
+        for order, parent_lineage_dict in enumerate(lineage_mapping):
+            self.group_names.append(parent_lineage_dict["name"])
+            for prefix in parent_lineage_dict["prefixes"]:
+                node = self._trie
+                for part in prefix.split('.'):
+                    node = node.setdefault(part, {})
+                # The None key marks the end of a prefix and holds the order of the first group that defines it
+                node.setdefault(None, order)
+
+    @classmethod
+    def from_json(cls, filepath):
+        with open(filepath, 'r') as file:
+            return cls(json.load(file))
+
+    def classify(self, lineage):
+        if not isinstance(lineage, str):
+            return 'NA'
+        if lineage.startswith("X"):
+            return "Recombinant"
+
+        best = None
+        node = self._trie
+        for part in lineage.split('.'):
+            node = node.get(part)
+            if node is None:
+                break
+            order = node.get(None)
+            if order is not None and (best is None or order < best):
+                best = order
+
+        return 'NA' if best is None else self.group_names[best]
+
+    @timed('classify_lineages')
+    def classify_series(self, lineages):
+        """
+        Classify a whole column of lineages, walking the trie once per unique value.
+
+        Parameters:
+        lineages (pd.Series): Lineage names, e.g. the 'uncompress_lineage' column.
+
+        Returns:
+        pd.Series: Parent lineage group for each row, aligned with the input.
+        """
+        mapping = {lineage: self.classify(lineage) for lineage in lineages.dropna().unique()}
+        return lineages.map(mapping).fillna('NA')
 
-    return 'NA'
+def get_parent_lineage(lineage, lineage_mapping):
+    # lineage_mapping can be the parsed lineage_mapping.json or a prebuilt LineageClassifier
+    if not isinstance(lineage_mapping, LineageClassifier):
+        lineage_mapping = LineageClassifier(lineage_mapping)
+    return lineage_mapping.classify(lineage)
 
 def custom_parent(aliasor, name):
     uncompressed = aliasor.uncompress(name)
@@ -76,6 +165,45 @@ def custom_parent(aliasor, name):
     #print(f"Compressed Parent: {compressed_parent}")
     return compressed_parent
 
+class CachedAliasor:
+    """
+    Memoising wrapper around a pango_aliasor Aliasor instance.
+
+    uncompress, compress and custom_parent results are kept in bounded LRU caches, and the *_series
+    methods only evaluate the unique lineages of a column before mapping the results back onto it.
+    The wrapper can be passed anywhere an Aliasor is expected, e.g. to custom_parent.
+
+    Parameters:
+    aliasor (Aliasor): The pango_aliasor instance to wrap.
+    maxsize (int): Maximum number of lineages kept in each cache.
+    alias_key (dict): Version information of the alias key used by the aliasor, recorded with the run outputs.
+    """
+    def __init__(self, aliasor, maxsize=8192, alias_key=None):
+        self.aliasor = aliasor
+        self.alias_key = alias_key
+        self.uncompress = functools.lru_cache(maxsize=maxsize)(aliasor.uncompress)
+        self.compress = functools.lru_cache(maxsize=maxsize)(aliasor.compress)
+        self.custom_parent = functools.lru_cache(maxsize=maxsize)(functools.partial(custom_parent, self))
+
+    @timed('uncompress_lineages')
+    def uncompress_series(self, lineages):
+        return _map_unique(lineages, self.uncompress)
+
+    @timed('parent_lineages')
+    def custom_parent_series(self, lineages):
+        return _map_unique(lineages, self.custom_parent)
+
+    def cache_info(self):
+        # Hit/miss counters for each cache, e.g. {'uncompress': {'hits': 10, 'misses': 2, ...}, ...}
+        return {name: getattr(self, name).cache_info()._asdict()
+                for name in ('uncompress', 'compress', 'custom_parent')}
+
+def _map_unique(values, func):
+    # Evaluate func once per unique value and broadcast the results back onto the column
+    uniques = values.unique()
+    return values.map(dict(zip(uniques, map(func, uniques))))
+
+@timed('save_output', rows=lambda result, df, *args, **kwargs: len(df))
 def save_output(df, output_dir, output_file):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
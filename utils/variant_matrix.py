@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Sparse sample x mutation allele frequency matrix built from the viralrecon 'variants_long_table.csv'.
+
+The long table has one row per sample and variant and is large for full runs. It is read in chunks with
+explicit dtypes and only the needed columns, keeping the variants that passed the ivar filters. Samples and
+mutations ('<REF><POS><ALT>', e.g. 'C241T') are numbered as they are first seen, and the allele frequencies
+are kept as COO arrays (sample index, mutation index, AF). Samples are mapped to their collection date and site
+code like the Freyja results, and a site x mutation aggregation (samples with the mutation, mean AF over the
+samples of the site) is added using the 'msd_short_names_lat_long.csv' site codes.
+
+The matrix is saved with np.savez_compressed as '<run_name>_variant_af_matrix.npz'. Matrices of several runs
+can be loaded and queried together for a set of mutations. scipy is optional: to_scipy() returns a
+scipy.sparse.csr_matrix when it is installed.
+
+Usage: variant_matrix.py build <variants_long_table.csv> <output.npz> [--run-name NAME] [--chunksize 200000]
+                               [--min-dp 10] [--all-filters] [--lat-long-file msd_short_names_lat_long.csv]
+       variant_matrix.py query <matrix.npz ...> --mutation C241T [--mutation S:N501Y] [--by-site] [--output out.csv]
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from site_registry import SiteRegistry, parse_sample_id
+
+try:
+    import scipy.sparse
+except ImportError:  # scipy is only needed for to_scipy()
+    scipy = None
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+VARIANT_COLUMNS = ['SAMPLE', 'POS', 'REF', 'ALT', 'FILTER', 'DP', 'AF', 'GENE', 'HGVS_P_1LETTER']
+VARIANT_DTYPES = {
+    'SAMPLE': 'category',
+    'POS': 'int32',
+    'REF': 'category',
+    'ALT': 'category',
+    'FILTER': 'category',
+    'DP': 'float32',
+    'AF': 'float32',
+    'GENE': 'category',
+    'HGVS_P_1LETTER': 'category',
+}
+PASS_FILTER = 'PASS'
+
+
+def clean_sample_id(sample):
+    # Same sample IDs as the Freyja results: '<yymmdd>-<site>-UT-<run>' -> '<yymmdd>_<site>'
+    return sample.split('-UT')[0].replace('-', '_')
+
+
+def _mutation_keys(chunk):
+    return chunk['REF'].astype(str) + chunk['POS'].astype(str) + chunk['ALT'].astype(str)
+
+
+def _amino_acid_keys(chunk):
+    # 'S:N501Y' style names of the amino acid changes, empty for non-coding or synonymous variants
+    gene = chunk['GENE'].astype(object).fillna('')
+    change = chunk['HGVS_P_1LETTER'].astype(object).fillna('').str.replace('p.', '', regex=False)
+    return np.where((gene != '') & (change != '') & (change != '.'), gene + ':' + change, '')
+
+
+class _Vocabulary:
+    # Assigns consecutive integer codes to values in the order they are first seen
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, values):
+        uniques = pd.unique(values)
+        for value in uniques:
+            if value not in self.codes:
+                self.codes[value] = len(self.values)
+                self.values.append(value)
+        return pd.Series(values).map(self.codes).to_numpy(dtype=np.int32)
+
+
+class VariantMatrix:
+    """
+    Sparse sample x mutation allele frequency matrix of one or more runs.
+
+    Attributes:
+    samples (np.ndarray): Sample IDs of the matrix rows.
+    sample_runs, sample_dates, sample_sites (np.ndarray): Run name, collection date ('YYYY-MM-DD' or '') and
+    site code ('' when the sample ID cannot be parsed) of every sample.
+    mutations (np.ndarray): '<REF><POS><ALT>' mutation of the matrix columns.
+    amino_acids (np.ndarray): Amino acid change of every mutation, e.g. 'S:N501Y', or ''.
+    row, col (np.ndarray): int32 sample and mutation indices of the non-zero entries.
+    af (np.ndarray): float32 allele frequency of the non-zero entries.
+    """
+    def __init__(self, samples, sample_runs, sample_dates, sample_sites, mutations, amino_acids, row, col, af):
+        self.samples = np.asarray(samples, dtype=str)
+        self.sample_runs = np.asarray(sample_runs, dtype=str)
+        self.sample_dates = np.asarray(sample_dates, dtype=str)
+        self.sample_sites = np.asarray(sample_sites, dtype=str)
+        self.mutations = np.asarray(mutations, dtype=str)
+        self.amino_acids = np.asarray(amino_acids, dtype=str)
+        self.row = np.asarray(row, dtype=np.int32)
+        self.col = np.asarray(col, dtype=np.int32)
+        self.af = np.asarray(af, dtype=np.float32)
+
+    @property
+    def shape(self):
+        return len(self.samples), len(self.mutations)
+
+    @classmethod
+    def from_csv(cls, variants_file, run_name='', chunksize=200000, min_dp=0, pass_only=True):
+        """
+        Build the matrix from a viralrecon variants long table, reading it in chunks.
+
+        Parameters:
+        variants_file (str): Path to 'variants_long_table.csv'.
+        run_name (str): Run name recorded for every sample.
+        chunksize (int): Number of rows read per chunk.
+        min_dp (int): Variants with a lower depth are left out.
+        pass_only (bool): Only keep the variants whose FILTER is PASS.
+
+        Returns:
+        VariantMatrix: The matrix. A sample and mutation listed twice keeps its highest allele frequency.
+        """
+        samples, mutations = _Vocabulary(), _Vocabulary()
+        amino_acids = {}
+        rows, cols, afs = [], [], []
+        for chunk in pd.read_csv(variants_file, usecols=lambda column: column in VARIANT_DTYPES,
+                                 dtype=VARIANT_DTYPES, chunksize=chunksize):
+            keep = chunk['AF'].notna() & (chunk['AF'] > 0)
+            if pass_only and 'FILTER' in chunk.columns:
+                keep &= chunk['FILTER'].astype(object) == PASS_FILTER
+            if min_dp:
+                keep &= chunk['DP'] >= min_dp
+            chunk = chunk[keep]
+            if chunk.empty:
+                continue
+
+            keys = _mutation_keys(chunk).to_numpy()
+            rows.append(samples.encode(chunk['SAMPLE'].astype(object).to_numpy()))
+            cols.append(mutations.encode(keys))
+            afs.append(chunk['AF'].to_numpy(dtype=np.float32))
+            if 'GENE' in chunk.columns and 'HGVS_P_1LETTER' in chunk.columns:
+                for key, amino_acid in zip(keys, _amino_acid_keys(chunk)):
+                    if amino_acid:
+                        amino_acids.setdefault(key, amino_acid)
+
+        row = np.concatenate(rows) if rows else np.empty(0, dtype=np.int32)
+        col = np.concatenate(cols) if cols else np.empty(0, dtype=np.int32)
+        af = np.concatenate(afs) if afs else np.empty(0, dtype=np.float32)
+        row, col, af = _max_duplicates(row, col, af)
+
+        sample_ids = [clean_sample_id(sample) for sample in samples.values]
+        parsed = [parse_sample_id(sample_id) for sample_id in sample_ids]
+        return cls(sample_ids, [run_name] * len(sample_ids),
+                   [date.strftime('%Y-%m-%d') if date else '' for date, _ in parsed],
+                   [site or '' for _, site in parsed],
+                   mutations.values, [amino_acids.get(key, '') for key in mutations.values], row, col, af)
+
+    def save(self, output_file):
+        """
+        Save the matrix with np.savez_compressed.
+        """
+        output_dir = os.path.dirname(output_file)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        np.savez_compressed(output_file, samples=self.samples, sample_runs=self.sample_runs,
+                            sample_dates=self.sample_dates, sample_sites=self.sample_sites,
+                            mutations=self.mutations, amino_acids=self.amino_acids,
+                            row=self.row, col=self.col, af=self.af)
+        return output_file
+
+    @classmethod
+    def load(cls, matrix_file):
+        with np.load(matrix_file, allow_pickle=False) as arrays:
+            return cls(*(arrays[name] for name in ('samples', 'sample_runs', 'sample_dates', 'sample_sites',
+                                                    'mutations', 'amino_acids', 'row', 'col', 'af')))
+
+    @classmethod
+    def combine(cls, matrices):
+        """
+        Stack the samples of several matrices over the union of their mutations.
+        """
+        mutations = _Vocabulary()
+        amino_acids = {}
+        rows, cols, afs = [], [], []
+        offset = 0
+        for matrix in matrices:
+            rows.append(matrix.row + offset)
+            cols.append(mutations.encode(matrix.mutations)[matrix.col] if len(matrix.mutations) else matrix.col)
+            afs.append(matrix.af)
+            for mutation, amino_acid in zip(matrix.mutations, matrix.amino_acids):
+                if amino_acid:
+                    amino_acids.setdefault(mutation, amino_acid)
+            offset += len(matrix.samples)
+        return cls(np.concatenate([matrix.samples for matrix in matrices]),
+                   np.concatenate([matrix.sample_runs for matrix in matrices]),
+                   np.concatenate([matrix.sample_dates for matrix in matrices]),
+                   np.concatenate([matrix.sample_sites for matrix in matrices]),
+                   mutations.values, [amino_acids.get(mutation, '') for mutation in mutations.values],
+                   np.concatenate(rows), np.concatenate(cols), np.concatenate(afs))
+
+    def to_scipy(self):
+        """
+        Returns:
+        scipy.sparse.csr_matrix: The sample x mutation matrix. Raises ImportError when scipy is not installed.
+        """
+        if scipy is None:
+            raise ImportError('scipy is required for VariantMatrix.to_scipy()')
+        return scipy.sparse.coo_matrix((self.af, (self.row, self.col)), shape=self.shape).tocsr()
+
+    def mutation_indices(self, mutations):
+        # Columns of mutations given as '<REF><POS><ALT>' or as amino acid changes such as 'S:N501Y'
+        wanted = set(mutations)
+        return np.flatnonzero(np.isin(self.mutations, list(wanted)) | np.isin(self.amino_acids, list(wanted)))
+
+    def query(self, mutations):
+        """
+        Allele frequencies of the given mutations in every sample where they were called.
+
+        Returns:
+        pd.DataFrame: One row per sample and mutation with the sample's run, collection date and site.
+        """
+        entries = np.flatnonzero(np.isin(self.col, self.mutation_indices(mutations)))
+        row, col = self.row[entries], self.col[entries]
+        return pd.DataFrame({
+            'sample_id': self.samples[row],
+            'run_name': self.sample_runs[row],
+            'collection_date': self.sample_dates[row],
+            'msd_shrtnm': self.sample_sites[row],
+            'mutation': self.mutations[col],
+            'amino_acid': self.amino_acids[col],
+            'af': self.af[entries],
+        }).sort_values(['mutation', 'collection_date', 'sample_id']).reset_index(drop=True)
+
+    def site_aggregate(self, sites=None, mutations=None):
+        """
+        Aggregate the matrix by site code.
+
+        Parameters:
+        sites (pd.DataFrame): Site table indexed by site code (SiteRegistry.sites) for the site names and lat/long.
+        mutations (list): Only aggregate these mutations. All mutations by default.
+
+        Returns:
+        pd.DataFrame: One row per site and mutation with the number of samples of the site, the number of
+        samples with the mutation and the mean (a sample without the mutation counting as 0) and max AF.
+        """
+        site_codes, site_index = np.unique(self.sample_sites, return_inverse=True)
+        site_index = site_index.ravel()
+        n_site_samples = np.bincount(site_index, minlength=len(site_codes))
+
+        entries = np.arange(len(self.af)) if mutations is None else \
+            np.flatnonzero(np.isin(self.col, self.mutation_indices(mutations)))
+        frame = pd.DataFrame({'site': site_index[self.row[entries]], 'col': self.col[entries], 'af': self.af[entries]})
+        aggregated = frame.groupby(['site', 'col'])['af'].agg(n_samples='count', sum_af='sum', max_af='max').reset_index()
+
+        result = pd.DataFrame({
+            'msd_shrtnm': site_codes[aggregated['site']],
+            'mutation': self.mutations[aggregated['col']],
+            'amino_acid': self.amino_acids[aggregated['col']],
+            'n_site_samples': n_site_samples[aggregated['site']],
+            'n_samples': aggregated['n_samples'].to_numpy(),
+            'max_af': aggregated['max_af'].to_numpy(),
+        })
+        result['mean_af'] = aggregated['sum_af'].to_numpy() / result['n_site_samples']
+        if sites is not None:
+            site_info = sites.reindex(result['msd_shrtnm'])
+            for column in site_info.columns:
+                result[column] = site_info[column].to_numpy()
+        return result.sort_values(['msd_shrtnm', 'mutation']).reset_index(drop=True)
+
+
+def _max_duplicates(row, col, af):
+    # Keep the highest allele frequency of a (sample, mutation) pair listed more than once
+    if len(af) == 0:
+        return row, col, af
+    order = np.lexsort((-af, col, row))
+    row, col, af = row[order], col[order], af[order]
+    first = np.ones(len(af), dtype=bool)
+    first[1:] = (row[1:] != row[:-1]) | (col[1:] != col[:-1])
+    return row[first], col[first], af[first]
+
+
+def load_matrices(matrix_files):
+    """
+    Load the matrices of several runs as one matrix for cross-run queries.
+    """
+    return VariantMatrix.combine([VariantMatrix.load(matrix_file) for matrix_file in matrix_files])
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Build and query sparse sample x mutation allele frequency matrices.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Build the matrix of a variants long table')
+    build.add_argument('variants_file', help='viralrecon variants_long_table.csv')
+    build.add_argument('output', help='Output .npz file')
+    build.add_argument('--run-name', default='', help='Run name recorded for the samples')
+    build.add_argument('--chunksize', type=int, default=200000, help='Rows of the variants table read per chunk')
+    build.add_argument('--min-dp', type=int, default=0, help='Leave out variants with a lower depth')
+    build.add_argument('--all-filters', action='store_true', help='Keep the variants that did not PASS the ivar filters')
+
+    query = subparsers.add_parser('query', help='Query mutations across the matrices of several runs')
+    query.add_argument('matrices', nargs='+', help='.npz matrix files')
+    query.add_argument('--mutation', action='append', required=True,
+                       help="Mutation as '<REF><POS><ALT>' (e.g. C241T) or amino acid change (e.g. S:N501Y)")
+    query.add_argument('--by-site', action='store_true', help='Aggregate the allele frequencies by site')
+    query.add_argument('--output', default=None, help='Write the result to this CSV file instead of printing it')
+
+    for subparser in (build, query):
+        subparser.add_argument('--lat-long-file', default=os.path.join(DATA_DIR, 'msd_short_names_lat_long.csv'),
+                               help='Site codes with their names and coordinates')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_arguments(args)
+    sites = SiteRegistry(args.lat_long_file)
+
+    if args.command == 'build':
+        matrix = VariantMatrix.from_csv(args.variants_file, args.run_name, args.chunksize, args.min_dp,
+                                        not args.all_filters)
+        matrix.save(args.output)
+        unknown = sorted({site for site in matrix.sample_sites if site and site not in sites})
+        print(f"{matrix.shape[0]} samples x {matrix.shape[1]} mutations ({len(matrix.af)} allele frequencies) "
+              f"written to {args.output}")
+        if unknown:
+            print(f"WARNING: site codes missing from {args.lat_long_file}: {', '.join(unknown)}")
+        return 0
+
+    matrix = load_matrices(args.matrices)
+    result = matrix.site_aggregate(sites.sites, args.mutation) if args.by_site else matrix.query(args.mutation)
+    if args.output:
+        result.to_csv(args.output, index=False)
+        print(f"{result.shape[0]} rows written to {args.output}")
+    else:
+        print(result.to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())